@@ -0,0 +1,92 @@
+{% macro apply_games_scope_retention(removed_usernames=[]) %}
+
+{#
+    ### Retention strategy explanation:
+    The games scope is a sliding window of [month_history_depth] months (see games_scope_start_date).
+    When the window moves, the games which fell out of it are deleted from int_games_filtered and from every persisted model built on top of it, instead of rebuilding the warehouse with --full-refresh.
+    The games of the users no longer ingested ([removed_usernames], set by run_all.py) are purged the same way.
+    - Models carrying [uuid] and [username] are matched against the purged (uuid, username) pairs of int_games_filtered.
+    - Other models carrying [end_time] (e.g. obt_games_stats_filtered) are filtered on [end_time] directly, and on [games_sk] for the removed users.
+    - Models carrying only [username] (e.g. int_players_base) are filtered on the removed users.
+    int_games_filtered is purged last, in the same transaction.
+#}
+
+{% if not execute %}
+    {% do return(none) %}
+{% endif %}
+
+{% set scope_node_id = 'model.' ~ project_name ~ '.int_games_filtered' %}
+{% set scope_node = graph.nodes[scope_node_id] %}
+{% set scope_relation = adapter.get_relation(database=scope_node.database, schema=scope_node.schema, identifier=scope_node.alias) %}
+{% if scope_relation is none %}
+    {{ log("int_games_filtered does not exist yet - nothing to purge", info=True) }}
+    {% do return(none) %}
+{% endif %}
+
+{# Collect all persisted models downstream of int_games_filtered #}
+{% set downstream_ids = [scope_node_id] %}
+{% for _ in range(graph.nodes | length) %}
+    {% set found = [] %}
+    {% for node in graph.nodes.values() %}
+        {% if node.resource_type == 'model' and node.unique_id not in downstream_ids %}
+            {% for parent_id in node.depends_on.nodes %}
+                {% if parent_id in downstream_ids and node.unique_id not in found %}
+                    {% do found.append(node.unique_id) %}
+                {% endif %}
+            {% endfor %}
+        {% endif %}
+    {% endfor %}
+    {% if found | length == 0 %}
+        {% break %}
+    {% endif %}
+    {% do downstream_ids.extend(found) %}
+{% endfor %}
+
+{% set removed_condition = none %}
+{% if removed_usernames %}
+    {% set quoted_usernames = [] %}
+    {% for username in removed_usernames %}
+        {% do quoted_usernames.append("'" ~ username | lower | replace("'", "''") ~ "'") %}
+    {% endfor %}
+    {% set removed_condition = "LOWER(s.username) IN (" ~ quoted_usernames | join(', ') ~ ")" %}
+{% endif %}
+{% set purge_condition = "s.end_time < " ~ games_scope_start_date() ~ (" OR " ~ removed_condition if removed_condition else "") %}
+
+{% set delete_statements = [] %}
+{% for node_id in downstream_ids[1:] %}
+    {% set node = graph.nodes[node_id] %}
+    {% if node.config.materialized in ['incremental', 'table'] %}
+        {% set relation = adapter.get_relation(database=node.database, schema=node.schema, identifier=node.alias) %}
+        {% if relation is not none %}
+            {% set columns = adapter.get_columns_in_relation(relation) | map(attribute='name') | map('lower') | list %}
+            {% if 'uuid' in columns and 'username' in columns %}
+                {% do delete_statements.append(
+                    "DELETE FROM " ~ relation ~ " WHERE (uuid, username) IN (SELECT s.uuid, s.username FROM " ~ scope_relation ~ " s WHERE " ~ purge_condition ~ ")"
+                ) %}
+            {% elif 'end_time' in columns %}
+                {% do delete_statements.append(
+                    "DELETE FROM " ~ relation ~ " WHERE end_time < " ~ games_scope_start_date()
+                ) %}
+                {% if removed_condition and 'games_sk' in columns %}
+                    {% do delete_statements.append(
+                        "DELETE FROM " ~ relation ~ " WHERE games_sk IN (SELECT " ~ dbt_utils.generate_surrogate_key(['s.uuid', 's.username']) ~ " FROM " ~ scope_relation ~ " s WHERE " ~ removed_condition ~ ")"
+                    ) %}
+                {% endif %}
+            {% elif removed_condition and 'username' in columns %}
+                {% do delete_statements.append(
+                    "DELETE FROM " ~ relation ~ " s WHERE " ~ removed_condition
+                ) %}
+            {% endif %}
+        {% endif %}
+    {% endif %}
+{% endfor %}
+{% do delete_statements.append("DELETE FROM " ~ scope_relation ~ " s WHERE " ~ purge_condition) %}
+
+{% for statement in delete_statements %}
+    {{ log("Retention: " ~ statement, info=True) }}
+{% endfor %}
+
+{# run-operation does not commit by itself #}
+{% do run_query(delete_statements | join(';\n') ~ ';\nCOMMIT;') %}
+
+{% endmacro %}
@@ -0,0 +1,17 @@
+{% macro backfill_users_condition(alias) -%}
+{#
+    Games of the users to backfill (var [backfill_usernames], set by run_all.py for the users whose games were landed since the previous build): their history is older than the [end_time] watermark of the incremental models.
+    Meant to be OR-ed with the watermark condition. Games already in the model are skipped (NOT EXISTS on the indexed (username, uuid)), so the backfill can be repeated safely.
+#}
+{%- set usernames = var('backfill_usernames', []) -%}
+{%- if usernames -%}
+    OR (
+        LOWER({{ alias }}.username) IN ({% for username in usernames %}'{{ username | lower | replace("'", "''") }}'{% if not loop.last %}, {% endif %}{% endfor %})
+        AND NOT EXISTS (
+            SELECT 1
+            FROM {{ this }} i
+            WHERE i.username = {{ alias }}.username AND i.uuid = {{ alias }}.uuid
+        )
+    )
+{%- endif -%}
+{%- endmacro %}
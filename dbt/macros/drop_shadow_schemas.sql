@@ -0,0 +1,26 @@
+{% macro drop_shadow_schemas(suffix) %}
+
+{#
+    Drops the shadow schemas (and the schemas retired by a previous swap) left over by an interrupted blue/green build.
+    Executed before every shadow build so that it always starts from empty schemas.
+#}
+
+{% if not execute %}
+    {% do return(none) %}
+{% endif %}
+
+{% set statements = [] %}
+{% for schema in get_project_model_schemas() %}
+    {% for leftover in [schema ~ suffix, schema ~ '__retired'] %}
+        {% do statements.append("DROP SCHEMA IF EXISTS " ~ adapter.quote(leftover) ~ " CASCADE") %}
+    {% endfor %}
+{% endfor %}
+
+{% for statement in statements %}
+    {{ log(statement, info=True) }}
+{% endfor %}
+
+{# run-operation does not commit by itself #}
+{% do run_query(statements | join(';\n') ~ ';\nCOMMIT;') %}
+
+{% endmacro %}
@@ -1,6 +1,6 @@
 {% macro games_scope_condition(alias='') -%}
 {%- set prefix = alias ~ '.' if alias else '' -%}
-    {{ prefix }}end_time >= DATE_TRUNC('MONTH', CURRENT_DATE - INTERVAL '{{ var('data_scope')['month_history_depth'] }} MONTHS') 
+    {{ prefix }}end_time >= {{ games_scope_start_date() }} 
     AND {{ prefix }}time_class = ANY(ARRAY{{ var('data_scope')['time_class'] }}::text[]) 
     AND {{ prefix }}rated
 {%- endmacro %}
\ No newline at end of file
@@ -0,0 +1,3 @@
+{% macro games_scope_start_date() -%}
+    DATE_TRUNC('MONTH', CURRENT_DATE - INTERVAL '{{ var('data_scope')['month_history_depth'] }} MONTHS')
+{%- endmacro %}
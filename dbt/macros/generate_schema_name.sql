@@ -1,8 +1,14 @@
 {% macro generate_schema_name(custom_schema_name, node) -%}
     {%- set default_schema = target.schema -%}
     {%- if custom_schema_name is none -%}
-        {{ default_schema }}
+        {%- set schema_name = default_schema -%}
     {%- else -%}
-        {{ custom_schema_name | trim }}
+        {%- set schema_name = custom_schema_name | trim -%}
     {%- endif -%}
-{%- endmacro %}
\ No newline at end of file
+    {#- Blue/green builds: project models are redirected to shadow schemas, swapped afterwards with swap_shadow_schemas -#}
+    {%- if node is not none and node.resource_type == 'model' and node.package_name == project_name -%}
+        {{ schema_name ~ var('shadow_schema_suffix') }}
+    {%- else -%}
+        {{ schema_name }}
+    {%- endif -%}
+{%- endmacro %}
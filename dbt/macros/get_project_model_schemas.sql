@@ -0,0 +1,10 @@
+{% macro get_project_model_schemas() %}
+    {#- Distinct schemas of the models of this project (packages such as dbt_project_evaluator excluded) -#}
+    {% set schemas = [] %}
+    {% for node in graph.nodes.values() %}
+        {% if node.resource_type == 'model' and node.package_name == project_name and node.schema not in schemas %}
+            {% do schemas.append(node.schema) %}
+        {% endif %}
+    {% endfor %}
+    {{ return(schemas | sort) }}
+{% endmacro %}
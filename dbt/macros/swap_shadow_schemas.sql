@@ -0,0 +1,39 @@
+{% macro swap_shadow_schemas(suffix) %}
+
+{#
+    ### Blue/green swap explanation:
+    A full refresh is built in shadow schemas (var shadow_schema_suffix, see generate_schema_name) while the live schemas keep serving the dashboards.
+    Once the build succeeded, each live schema is renamed to <schema>__retired and each shadow schema is renamed to the live name, in a single transaction.
+    Renaming a schema does not touch the tables it contains, so readers are never blocked and never see empty or partial tables.
+    Views keep pointing to the right tables since Postgres tracks view dependencies by object id, not by name.
+    The retired schemas are dropped in a second transaction, which only waits for the queries still reading them.
+#}
+
+{% if not execute %}
+    {% do return(none) %}
+{% endif %}
+
+{% set swap_statements = [] %}
+{% set drop_statements = [] %}
+{% for schema in get_project_model_schemas() %}
+    {% if not adapter.check_schema_exists(target.database, schema ~ suffix) %}
+        {{ exceptions.raise_compiler_error("Shadow schema " ~ schema ~ suffix ~ " does not exist. The shadow build must succeed before swapping.") }}
+    {% endif %}
+    {% if adapter.check_schema_exists(target.database, schema) %}
+        {% do swap_statements.append("ALTER SCHEMA " ~ adapter.quote(schema) ~ " RENAME TO " ~ adapter.quote(schema ~ '__retired')) %}
+        {% do drop_statements.append("DROP SCHEMA " ~ adapter.quote(schema ~ '__retired') ~ " CASCADE") %}
+    {% endif %}
+    {% do swap_statements.append("ALTER SCHEMA " ~ adapter.quote(schema ~ suffix) ~ " RENAME TO " ~ adapter.quote(schema)) %}
+{% endfor %}
+
+{% for statement in swap_statements + drop_statements %}
+    {{ log(statement, info=True) }}
+{% endfor %}
+
+{# run-operation does not commit by itself #}
+{% do run_query(swap_statements | join(';\n') ~ ';\nCOMMIT;') %}
+{% if drop_statements %}
+    {% do run_query(drop_statements | join(';\n') ~ ';\nCOMMIT;') %}
+{% endif %}
+
+{% endmacro %}
@@ -2,7 +2,8 @@
     materialized = 'incremental',
     incremental_strategy = 'append',
     post_hook = [
-        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_end_time ON {{ this }} (end_time)"
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_end_time ON {{ this }} (end_time)",
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_username_uuid ON {{ this }} (username, uuid)"
     ]
 ) }}
 
@@ -51,6 +52,7 @@ WITH incremental_partition AS (
             SELECT MAX(i.end_time)
             FROM {{ this }} i
         )
+        {{ backfill_users_condition('pg') }}
     {% endif %}
 )
 
@@ -2,7 +2,8 @@
     materialized = 'incremental',
     incremental_strategy = 'append',
     post_hook = [
-        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_end_time ON {{ this }} (end_time)"
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_end_time ON {{ this }} (end_time)",
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_username_uuid ON {{ this }} (username, uuid)"
     ]
 ) }}
 
@@ -50,8 +51,11 @@ WHERE
     TRUE
     AND {{ games_scope_condition('g') }}
     {% if is_incremental() %}
-        AND g.end_time > (
-            SELECT MAX(i.end_time)
-            FROM {{ this }} i
+        AND (
+            g.end_time > (
+                SELECT MAX(i.end_time)
+                FROM {{ this }} i
+            )
+            {{ backfill_users_condition('g') }}
         )
     {% endif %}
\ No newline at end of file
@@ -2,45 +2,105 @@
     materialized = 'incremental',
     incremental_strategy = 'append',
     post_hook = [
-        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_run_timestamp ON {{ this }} (run_timestamp)"
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_run_timestamp ON {{ this }} (run_timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_uuid ON {{ this }} (uuid)"
     ]
 ) }}
 
+{#
+    ### Update strategy explanation:
+    - A game is only integrated once classified by its openings at ingestion (INNER JOIN on stg_times__players_games_openings).
+    - Incremental runs take the new games of int_game_moves_enriched ([run_timestamp]), plus the games classified after
+      their moves were integrated ([openings_log_timestamp]), which are not in this model yet.
+    - run_timestamp is set to current_timestamp at load time (like int_game_moves_enriched), so that downstream models
+      also pick up the games classified late.
+#}
+
 {% set openings_depth = var('openings')['hierarchy_depth'] + 1 %}
 
-WITH aggregate_fields AS (
+WITH
+{% if is_incremental() %}
+    new_games AS (
+        SELECT
+            games.username,
+            games.uuid
+        FROM {{ ref('int_game_moves_enriched') }} games
+        WHERE games.run_timestamp > (
+            SELECT MAX(i.run_timestamp)
+            FROM {{ this }} i
+        )
+        UNION
+        -- Games classified after their moves were integrated
+        SELECT
+            games.username,
+            games.uuid
+        FROM {{ ref('stg_times__players_games_openings') }} games_openings
+        INNER JOIN {{ ref('int_game_moves_enriched') }} games
+            ON games.uuid = games_openings.uuid
+        WHERE
+            games_openings.log_timestamp > (
+                SELECT MAX(i.openings_log_timestamp)
+                FROM {{ this }} i
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM {{ this }} i
+                WHERE i.uuid = games.uuid AND i.username = games.username
+            )
+    ),
+{% endif %}
+
+aggregate_fields AS (
     SELECT
         games.username,
         games.uuid,
-        MAX(games.run_timestamp) AS run_timestamp,
+        CURRENT_TIMESTAMP AS run_timestamp,
+        MAX(games_openings.log_timestamp) AS openings_log_timestamp,
         {% for n in range(1, openings_depth) %}
             STRING_AGG(CASE WHEN games.move_number <= {{ n }} THEN games.move ELSE NULL END, ' ' ORDER BY games.move_number ASC) AS opener_{{ n }}_moves{% if not loop.last %},{% endif %}
         {% endfor %}
     FROM {{ ref('int_game_moves_enriched') }} games
+    INNER JOIN {{ ref('stg_times__players_games_openings') }} games_openings
+        ON games_openings.uuid = games.uuid
     {% if is_incremental() %}
-        WHERE games.run_timestamp > (
-            SELECT MAX(i.run_timestamp)
-            FROM {{ this }} i
-        )
+        INNER JOIN new_games
+            ON new_games.uuid = games.uuid AND new_games.username = games.username
     {% endif %}
     GROUP BY games.username, games.uuid
 )
 
+, games_openings_levels AS (
+    -- Opening of the game after each ply, recognised from its positions at ingestion (see doc opening_ids)
+    SELECT
+        games_openings.uuid,
+        levels.opening_id,
+        levels.level
+    FROM {{ ref('stg_times__players_games_openings') }} games_openings
+    CROSS JOIN LATERAL UNNEST(games_openings.opening_ids) WITH ORDINALITY AS levels (opening_id, level)
+    WHERE games_openings.uuid IN (SELECT agg.uuid FROM aggregate_fields agg)
+)
+
+, openings_names AS (
+    SELECT
+        levels.uuid,
+        {% for i in range(1, openings_depth, 1) %}
+            MAX(CASE WHEN levels.level = {{ i }} THEN op.name END) AS uci_hierarchy_level_{{ i }}_name{% if not loop.last %},{% endif %}
+        {% endfor %}
+    FROM games_openings_levels levels
+    LEFT JOIN {{ ref('int_openings_hierarchy') }} op
+        ON op.opening_id = levels.opening_id
+    GROUP BY levels.uuid
+)
+
 , integrate_openings_hierarchy AS (
     SELECT
         agg.*,
         {% for i in range(1, openings_depth, 1) %}
-            COALESCE(
-                {% for j in range(openings_depth - 1, 0, -1) %}
-                    op{{ j }}.uci_hierarchy_level_{{ i }}_name{% if not loop.last %},{% endif %}
-                {% endfor %}
-            ) AS uci_hierarchy_level_{{ i }}_name{% if not loop.last %},{% endif %}
+            names.uci_hierarchy_level_{{ i }}_name{% if not loop.last %},{% endif %}
         {% endfor %}
     FROM aggregate_fields agg
-    {% for i in range(1, openings_depth, 1) %}
-        LEFT JOIN {{ ref('int_openings_hierarchy') }} op{{ i }}
-            ON agg.opener_{{ i }}_moves = op{{ i }}.uci
-    {% endfor %}
+    LEFT JOIN openings_names names
+        ON names.uuid = agg.uuid
 )
 
 SELECT
@@ -1,113 +1,45 @@
-{{ config(materialized = 'table') }}
-
-{# Required for dbt dependency inference because ref() is inside the conditional block. #}
--- depends_on: {{ ref('stg_openings__chess_openings') }}
-
-{# 
+{{ config(
+    materialized = 'incremental',
+    incremental_strategy = 'append',
+    on_schema_change = 'append_new_columns',
+    post_hook = [
+        "DELETE FROM {{ this }} WHERE openings_sha256 IS DISTINCT FROM (SELECT MAX(s.openings_sha256) FROM {{ ref('stg_openings__chess_openings') }} s)",
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_opening_id ON {{ this }} (opening_id)",
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_uci ON {{ this }} (uci)"
+    ]
+) }}
+
+{#
     ### Update strategy explanation:
-    For performance reasons, rebuilds only with --full-refresh; otherwise runs SELECT * FROM {{ this }}.
+    The hierarchy (names of the parent openings at each level, from the prefix tree of the [uci] moves) is computed by
+    chess_openings_pipeline.py when the openings dataset changes, and stored with the hash of the dataset [openings_sha256].
+    Rows are only appended when this hash differs from the one already built (otherwise nothing is inserted), then the
+    post-hook removes the rows of the previous dataset.
 #}
 
-
-{% set existing_relation = adapter.get_relation(
-    database=this.database,
-    schema=this.schema,
-    identifier=this.identifier
-) %}
-
-{% if not flags.FULL_REFRESH and existing_relation is not none %}
-
-    SELECT
-        *
-    FROM {{ this }}
-
-{% else %}
-
-    -- Dynamically determine the maximum depth of UCI move sequences in the source data using [uci_moves_depth]
-    {% set get_max_depth_query %}
-        SELECT
-            MAX(array_length(regexp_split_to_array(uci, ' '), 1)) AS uci_moves_depth
-        FROM {{ ref('stg_openings__chess_openings') }}
-    {% endset %}
-
-    {% set max_depth_results = run_query(get_max_depth_query) %}
-    {% if execute %}
-        {% set max_depth = max_depth_results.columns[0].values()[0] %}
-    {% else %}
-        {% set max_depth = 10 %} {# dummy default value for the DBT project parse phase (https://docs.getdbt.com/reference/dbt-jinja-functions/execute) #}
-    {% endif %}
-
-    WITH extract_moves AS (
-        SELECT
-            eco,
-            "eco-volume",
-            name,
-            pgn,
-            epd,
-            log_timestamp,
-            uci,
-            REGEXP_SPLIT_TO_ARRAY(uci, ' ')                         AS uci_moves_array,
-            ARRAY_LENGTH(REGEXP_SPLIT_TO_ARRAY(uci, ' '), 1)        AS uci_moves_depth
-        FROM {{ ref('stg_openings__chess_openings') }}
+{% set openings_depth = var('openings')['hierarchy_depth'] + 1 %}
+
+SELECT
+    openings.opening_id,
+    openings.eco,
+    openings."eco-volume",
+    openings.name,
+    openings.pgn,
+    openings.epd,
+    openings.log_timestamp,
+    openings.uci,
+    REGEXP_SPLIT_TO_ARRAY(openings.uci, ' ') AS uci_moves_array,
+    openings.uci_moves_depth,
+    openings.uci_hierarchy_level_names,
+    -- Levels deeper than the opening itself keep its name
+    {% for i in range(1, openings_depth) %}
+        openings.uci_hierarchy_level_names[LEAST({{ i }}, openings.uci_moves_depth)] AS uci_hierarchy_level_{{ i }}_name,
+    {% endfor %}
+    openings.openings_sha256
+FROM {{ ref('stg_openings__chess_openings') }} openings
+{% if is_incremental() %}
+    WHERE openings.openings_sha256 IS DISTINCT FROM (
+        SELECT MAX(i.openings_sha256)
+        FROM {{ this }} i
     )
-
-    -- Generate [uci] keys for previous hierarchy levels only
-    , parent_hierarchy AS (
-        SELECT
-            *,
-            {% for i in range(1, max_depth) %}
-                CASE
-                    WHEN {{ i }} <= uci_moves_depth THEN ARRAY_TO_STRING(uci_moves_array[1:{{ i }}], ' ')
-                END AS uci_hierarchy_level_{{ i }}{% if not loop.last %},{% endif %}
-            {% endfor %}
-        FROM extract_moves
-    )
-
-    -- For each previous hierarchy level, join to the original table to get the [name] (if any matches!)
-    , parent_hierarchy_with_names AS (
-        SELECT
-            p.*,
-            {% for i in range(1, max_depth) %}
-                level_{{ i }}.name AS uci_hierarchy_level_{{ i }}_name_matching{% if not loop.last %},{% endif %}
-            {% endfor %}
-        FROM parent_hierarchy p
-        {% for i in range(1, max_depth) %}
-            LEFT JOIN {{ ref('stg_openings__chess_openings') }} AS level_{{ i }}
-            ON level_{{ i }}.UCI = p.uci_hierarchy_level_{{ i }}
-        {% endfor %}
-    )
-
-    , parent_hierarchy_with_filled_names AS (
-        SELECT
-            eco,
-            "eco-volume",
-            name,
-            pgn,
-            epd,
-            log_timestamp,
-            uci,
-            uci_moves_array,
-            uci_moves_depth,
-            {% for i in range(1, max_depth) %}
-                {% if i == 1 %}
-                    uci_hierarchy_level_1_name_matching AS uci_hierarchy_level_1_name
-                {% else %}
-                    COALESCE(
-                        -- To fill the blank [name], search for the first non-null name_matching from the current level up to level 1
-                        uci_hierarchy_level_{{ i }}_name_matching,
-                        {% for j in range(i-1, 0, -1) %}
-                            uci_hierarchy_level_{{ j }}_name_matching{% if not loop.last %}, {% endif %}
-                        {% endfor %}
-                    ) AS uci_hierarchy_level_{{ i }}_name
-                {% endif %}
-                {% if not loop.last %},{% endif %}
-            {% endfor %}
-        FROM parent_hierarchy_with_names
-    )
-
-    SELECT
-        *
-    FROM parent_hierarchy_with_filled_names
-    ORDER BY uci
-
-{% endif %}
\ No newline at end of file
+{% endif %}
@@ -2,7 +2,8 @@
     materialized = 'incremental',
     incremental_strategy = 'append',
     post_hook = [
-        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_end_time ON {{ this }} (end_time)"
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_end_time ON {{ this }} (end_time)",
+        "CREATE INDEX IF NOT EXISTS idx_{{ this.name }}_username_uuid ON {{ this }} (username, uuid)"
     ]
 ) }}
 
@@ -51,8 +52,11 @@ FROM {{ ref('int_games_filtered') }} AS g
 WHERE
     TRUE
     {% if is_incremental() %}
-        AND end_time > (
-            SELECT MAX(i.end_time)
-            FROM {{ this }} AS i
+        AND (
+            g.end_time > (
+                SELECT MAX(i.end_time)
+                FROM {{ this }} AS i
+            )
+            {{ backfill_users_condition('g') }}
         )
     {% endif %}
\ No newline at end of file
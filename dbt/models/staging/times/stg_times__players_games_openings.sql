@@ -0,0 +1,4 @@
+{{ config(materialized = 'view') }}
+
+SELECT *
+FROM {{ source('times', 'players_games_openings') }}
\ No newline at end of file
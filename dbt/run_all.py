@@ -1,98 +1,115 @@
-"""Run the chess data pipelines in a continuous loop.
+"""Run the chess data pipelines continuously.
 
-Flow per iteration:
-- Run source pipelines (chess.com API optionally, game times, stockfish moves)
-- Run dbt seed
-- Run dbt run with --full-refresh once per day, otherwise regular dbt run
-- Ping healthcheck URLs and run dbt tests every 100 iterations
+Two execution modes are available (RUN_MODE environment variable):
+
+serial (default) - one loop, flow per iteration:
+- Run source pipelines (chess.com API optionally, game times, stockfish moves), each reporting the rows it landed
+- Run dbt seed only when the seed files content hash changed
+- Run dbt run with --full-refresh only when the dbt logic (models, macros, vars, config) changed, built in shadow
+  schemas and atomically swapped with the live schemas (blue/green), otherwise:
+  - purge the games which fell out of the sliding games scope window whenever the window moved
+  - run a regular dbt run restricted to the models downstream of the sources that received new rows
+    (skipped entirely when nothing changed)
+- Ping healthcheck URLs and run dbt tests: incremental tests on the newly loaded rows every DBT_TEST_EVERY_N_BUILDS
+  iterations (default: 1), and a full sweep every DBT_FULL_TEST_EVERY_N_BUILDS iterations (default: 100)
 - Sleep for SLEEP_TIME seconds, then repeat
+
+workers - API ingestion, clock parsing, engine analysis and dbt refresh run as independent long-running workers,
+each with its own cadence. The dbt worker builds (as above) as soon as DBT_MIN_NEW_GAMES newly analyzed games landed,
+or when other changes have been pending for more than DBT_MAX_STALENESS seconds.
+
+In both modes, dbt runs in-process (dbt Python runner): the project is parsed once and the manifest is reused by every
+dbt command, until the project files change.
+
+The duration, rows in/out and exit status of every stage and dbt command are appended to the
+orchestration.stage_metrics table, with an optional alert on stages slower than SLOW_STAGE_ALERT_SECONDS.
 """
 
-import subprocess
 import sys
 import time
+import threading
 import requests
 from dotenv import load_dotenv
 import os
-from datetime import date
+
+from scripts.helper import get_engine
+from scripts.orchestration.stages import run_stage, report_rows
+from scripts.orchestration.dbt_build import DbtBuilder
+from scripts.orchestration.metrics import StageMetrics
+from scripts.orchestration.workers import PendingChanges, Worker, run_workers
+
+
+def _run_dbt_tests(builder: DbtBuilder, url_dbt_test: str, build_count: int) -> None:
+    """Incremental dbt tests every DBT_TEST_EVERY_N_BUILDS builds, and a full sweep every DBT_FULL_TEST_EVERY_N_BUILDS."""
+    DBT_TEST_EVERY_N_BUILDS = int(os.getenv("DBT_TEST_EVERY_N_BUILDS", "1")) # Default: incremental tests after every build
+    DBT_FULL_TEST_EVERY_N_BUILDS = int(os.getenv("DBT_FULL_TEST_EVERY_N_BUILDS", "100")) # Default: full sweep every 100 builds
+
+    if build_count % DBT_FULL_TEST_EVERY_N_BUILDS == 0:
+        test_passed = builder.test(full=True)
+    elif build_count % DBT_TEST_EVERY_N_BUILDS == 0:
+        test_passed = builder.test(full=False)
+    else:
+        return
+
+    # Healthcheck
+    if test_passed:
+        print("dbt test passed. Pinging success URL.")
+        requests.get(url_dbt_test, timeout=5)
+    else:
+        print("dbt test failed. Pinging failure URL.")
+        requests.get(url_dbt_test + "/fail", timeout=5)
+
 
 def run_pipeline_forever():
     load_dotenv()
 
     URL = os.getenv("HEALTHCHECK_URL")
     URL_DBT_TEST = os.getenv("HEALTHCHECK_URL_DBT_TEST")
-    
+
     # Configuration options
     SKIP_CHESS_COM_API = os.getenv("SKIP_CHESS_COM_API", "false").lower() == "true" # Default: False
     SLEEP_TIME = int(os.getenv("SLEEP_TIME", "600")) # Default: 600 seconds (10 minutes)
-    
+    FULL_REFRESH_INTERVAL_DAYS = int(os.getenv("FULL_REFRESH_INTERVAL_DAYS", "0")) # Default: 0 (only when the dbt logic changes)
+    RUN_MODE = os.getenv("RUN_MODE", "serial").lower() # Default: serial
+    SLOW_STAGE_ALERT_SECONDS = float(os.getenv("SLOW_STAGE_ALERT_SECONDS", "0")) # Default: 0 (no slow stage alert)
+    SLOW_STAGE_ALERT_URL = os.getenv("SLOW_STAGE_ALERT_URL") # Optional: URL receiving the slow stage alerts
+
     execution_count = 0
-    last_full_refresh_date = None
+    engine = get_engine()
+    metrics = StageMetrics(engine, slow_stage_seconds=SLOW_STAGE_ALERT_SECONDS, alert_url=SLOW_STAGE_ALERT_URL)
+    builder = DbtBuilder(engine, metrics, full_refresh_interval_days=FULL_REFRESH_INTERVAL_DAYS)
 
     # openings
-    subprocess.run(
-        [sys.executable, "chess_openings_pipeline.py"],
-        check=True,
-        cwd="scripts/openings"
-    )
+    run_stage("openings", metrics)
+
+    if RUN_MODE == "workers":
+        run_workers_forever(builder, metrics, URL, URL_DBT_TEST, SKIP_CHESS_COM_API, SLEEP_TIME)
+        return
 
     while True:
         try:
+            stage_rows = {}
+
             # chess.com API (conditional)
             if not SKIP_CHESS_COM_API:
-                subprocess.run(
-                    [sys.executable, "chess_games_pipeline.py"],
-                    check=True,
-                    cwd="scripts/chess_com_api"
-                )
+                stage_rows["chess_com_api"] = report_rows(run_stage("chess_com_api", metrics))
 
             # chess games times
-            subprocess.run(
-                [sys.executable, "chess_games_times_pipeline.py"],
-                check=True,
-                cwd="scripts/games_times"
-            )
+            stage_rows["games_times"] = report_rows(run_stage("games_times", metrics))
 
             # chess games moves
-            subprocess.run(
-                [sys.executable, "chess_games_moves_pipeline.py"],
-                check=True,
-                cwd="scripts/stockfish"
-            )
+            stage_rows["stockfish"] = report_rows(run_stage("stockfish", metrics))
 
             # DBT
-            subprocess.run(["dbt", "seed"], check=True)
-            today = date.today()
-            # Run a full-refresh only once per calendar day. All other loop iterations use a regular incremental build.
-            if last_full_refresh_date != today:
-                print("Running daily dbt full-refresh build")
-                subprocess.run(
-                    ["dbt", "run", "--full-refresh", "--exclude", "dbt_project_evaluator"],
-                    check=True,
-                )
-                last_full_refresh_date = today
-            else:
-                print("Running regular dbt build (daily full-refresh already completed)")
-                subprocess.run(["dbt", "run", "--exclude", "dbt_project_evaluator"], check=True)
+            builder.build(stage_rows)
 
             # Healthcheck
             requests.get(URL, timeout=5)
             print(f"Healthcheck ping sent.")
-            
-            # DBT test - every N executions
+
+            # DBT test - incremental every N executions, full sweep every M executions
             execution_count += 1
-            if execution_count % 100 == 0:
-                print(f"Running dbt test (execution {execution_count})")
-                test_result = subprocess.run(["dbt", "test", "--exclude", "dbt_project_evaluator"], capture_output=True, text=True)
-                
-                # Healthcheck
-                if test_result.returncode == 0:
-                    print("dbt test passed. Pinging success URL.")
-                    requests.get(URL_DBT_TEST, timeout=5)
-                else:
-                    print("dbt test failed. Pinging failure URL.")
-                    print(test_result.stderr)
-                    requests.get(URL_DBT_TEST + "/fail", timeout=5)
+            _run_dbt_tests(builder, URL_DBT_TEST, execution_count)
 
             # Sleep
             time.sleep(SLEEP_TIME)
@@ -103,5 +120,63 @@ def run_pipeline_forever():
             print(e)
             sys.exit(1)
 
+
+def run_workers_forever(builder: DbtBuilder, metrics: StageMetrics, url: str, url_dbt_test: str, skip_chess_com_api: bool, sleep_time: int):
+    # Cadences (seconds to wait between two runs of the same worker)
+    API_CADENCE = int(os.getenv("API_CADENCE", str(sleep_time))) # Default: SLEEP_TIME
+    TIMES_CADENCE = int(os.getenv("TIMES_CADENCE", "60")) # Default: 60 seconds
+    STOCKFISH_CADENCE = int(os.getenv("STOCKFISH_CADENCE", "0")) # Default: 0 (continuous, as long as games are pending)
+    DBT_CADENCE = int(os.getenv("DBT_CADENCE", "60")) # Default: 60 seconds between two trigger checks
+    # dbt triggers
+    DBT_MIN_NEW_GAMES = int(os.getenv("DBT_MIN_NEW_GAMES", "1")) # Default: build as soon as 1 new game is analyzed
+    DBT_MAX_STALENESS = int(os.getenv("DBT_MAX_STALENESS", str(sleep_time))) # Default: SLEEP_TIME
+
+    pending = PendingChanges()
+    stop_event = threading.Event()
+    dbt_state = {"build_count": 0, "last_build": time.monotonic()}
+
+    def _stage_task(stage: str):
+        def _task():
+            pending.add(stage, run_stage(stage, metrics))
+        return _task
+
+    def _stockfish_task():
+        report = run_stage("stockfish", metrics)
+        pending.add("stockfish", report)
+        # Nothing left to analyze: wait for the next cadence tick (at least the clock parsing cadence) to avoid busy-looping
+        if report is not None and report.get("games", 0) == 0:
+            stop_event.wait(max(STOCKFISH_CADENCE, TIMES_CADENCE))
+
+    def _dbt_task():
+        staleness = time.monotonic() - dbt_state["last_build"]
+        if (
+            not builder.initial_build_done
+            or pending.games("stockfish") >= DBT_MIN_NEW_GAMES
+            or (pending.has_changes() and staleness >= DBT_MAX_STALENESS)
+        ):
+            builder.build(pending.pop())
+            dbt_state["last_build"] = time.monotonic()
+            dbt_state["build_count"] += 1
+
+            _run_dbt_tests(builder, url_dbt_test, dbt_state["build_count"])
+
+        # Healthcheck
+        requests.get(url, timeout=5)
+
+    workers = [
+        Worker("games_times", _stage_task("games_times"), TIMES_CADENCE, stop_event),
+        Worker("stockfish", _stockfish_task, STOCKFISH_CADENCE, stop_event),
+        Worker("dbt", _dbt_task, DBT_CADENCE, stop_event),
+    ]
+    if not skip_chess_com_api:
+        workers.insert(0, Worker("chess_com_api", _stage_task("chess_com_api"), API_CADENCE, stop_event))
+
+    failed_worker = run_workers(workers, stop_event)
+    requests.get(url + "/fail", timeout=5)
+    print("Healthcheck failure ping sent.")
+    print(failed_worker.error if failed_worker else "Workers stopped.")
+    sys.exit(1)
+
+
 if __name__ == "__main__":
-    run_pipeline_forever()
\ No newline at end of file
+    run_pipeline_forever()
@@ -5,18 +5,15 @@ from scripts.helper import get_engine
 from sqlalchemy import text
 
 def _extract_schemas_from_dbt_project(dbt_config):
-    """Helper to extract schema names from dbt_project.yml config."""
+    """Helper to extract the seed schema names from dbt_project.yml config.
+    Model schemas are not extracted: they are never dropped, but replaced by the blue/green full refresh of run_all.py
+    (built in shadow schemas, then swapped), so that dashboards keep working during the rebuild.
+    """
     schemas = set()
     project_name = dbt_config.get("name")
     if not project_name:
         return schemas
 
-    # Get schemas from models
-    models_config = dbt_config.get("models", {}).get(project_name, {})
-    for model_group in models_config.values():
-        if isinstance(model_group, dict) and model_group.get("+schema"):
-            schemas.add(model_group["+schema"])
-
     # Get schema from seeds
     seeds_config = dbt_config.get("seeds", {}).get(project_name, {})
     if isinstance(seeds_config, dict) and seeds_config.get("+schema"):
@@ -38,7 +35,7 @@ def _get_schemas_all_from_config():
             if key == "chess_com_api":
                 schemas.add(f"{schema}_staging")
 
-    # Load dbt_project.yml to get model and seed schemas
+    # Load dbt_project.yml to get seed schemas
     with open("dbt_project.yml", "r") as f:
         dbt_config = yaml.safe_load(f)
         schemas.update(_extract_schemas_from_dbt_project(dbt_config))
@@ -47,8 +44,9 @@ def _get_schemas_all_from_config():
 
 def drop_schemas():
     """
-    This function will delete all staging schemas except Stockfish, as well as all DBT schemas.
-    Finally, it executes the regular run_all.py script.
+    This function will delete all raw schemas except Stockfish, as well as the dbt seeds and orchestration schemas.
+    Finally, it executes the regular run_all.py script, which detects the missing orchestration state and runs a
+    blue/green full refresh: the dbt model schemas are rebuilt in shadow schemas and swapped once complete.
     """
     schemas = _get_schemas_all_from_config()
     print("The following schemas will be dropped:")
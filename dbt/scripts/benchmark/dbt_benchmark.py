@@ -0,0 +1,146 @@
+"""Benchmark of the dbt models build time on a synthetic dataset, compared to a stored baseline.
+
+Run from the dbt folder: python -m scripts.benchmark.dbt_benchmark (or make dbt_benchmark)
+
+Flow:
+- (Re)create the benchmark database BENCHMARK_DB_NAME on the Postgres server of the .env file (never the DB_NAME database)
+- Load a synthetic dataset: BENCHMARK_USERS users x BENCHMARK_GAMES_PER_USER games over the games scope window
+- dbt seed, then dbt run --full-refresh (phase "full")
+- Load BENCHMARK_INCREMENTAL_GAMES_PER_USER new games per user, then a regular dbt run (phase "incremental")
+- Collect the execution time of each model from target/run_results.json, save them in target/dbt_benchmark.json,
+  and compare them to the baseline (dbt_benchmark_baseline.json). Exits with an error if a model got slower
+  by more than BENCHMARK_TOLERANCE (relative) and BENCHMARK_MIN_SECONDS (absolute).
+- With BENCHMARK_UPDATE_BASELINE=true (or if there is no baseline yet), the results become the new baseline.
+"""
+
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from dbt.cli.main import dbtRunner
+from dotenv import load_dotenv
+
+from scripts.helper import get_engine
+from scripts.benchmark.synthetic_data import create_database, generate_openings, load_games, load_openings
+
+RUN_RESULTS_PATH = os.path.join("target", "run_results.json")
+RESULTS_PATH = os.path.join("target", "dbt_benchmark.json")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "dbt_benchmark_baseline.json")
+
+
+def _run_dbt(args: list[str]) -> dict:
+    """Run a dbt command and return the execution time (seconds) of each model, from run_results.json."""
+    result = dbtRunner().invoke(args)
+    if not result.success:
+        raise RuntimeError(f"dbt {' '.join(args)} failed") from result.exception
+    with open(RUN_RESULTS_PATH, "r") as f:
+        run_results = json.load(f)
+    return {
+        node["unique_id"]: round(node["execution_time"], 3)
+        for node in run_results["results"]
+        if node["unique_id"].startswith("model.")
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> list[dict]:
+    """Models (per phase) slower than the baseline by more than `tolerance` (relative) and `min_seconds` (absolute)."""
+    regressions = []
+    for phase, timings in results["timings"].items():
+        for model, seconds in timings.items():
+            baseline_seconds = baseline["timings"].get(phase, {}).get(model)
+            if baseline_seconds is None:
+                continue
+            if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds > min_seconds:
+                regressions.append({
+                    "phase": phase, "model": model, "baseline_seconds": baseline_seconds, "seconds": seconds,
+                })
+    return regressions
+
+
+def _print_timings(results: dict, baseline: dict | None) -> None:
+    for phase, timings in results["timings"].items():
+        print(f"\n{phase} build ({sum(timings.values()):.1f}s):")
+        for model, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+            baseline_seconds = (baseline or {}).get("timings", {}).get(phase, {}).get(model)
+            reference = f" (baseline: {baseline_seconds:.3f}s)" if baseline_seconds is not None else ""
+            print(f"  {model.split('.')[-1]:<40} {seconds:>8.3f}s{reference}")
+
+
+def run_benchmark():
+    load_dotenv()
+
+    BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", "chess_benchmark") # Default: chess_benchmark
+    USERS = int(os.getenv("BENCHMARK_USERS", "20")) # Default: 20 users
+    GAMES_PER_USER = int(os.getenv("BENCHMARK_GAMES_PER_USER", "200")) # Default: 200 games per user
+    INCREMENTAL_GAMES_PER_USER = int(os.getenv("BENCHMARK_INCREMENTAL_GAMES_PER_USER", "10")) # Default: 10 games per user
+    OPENINGS = int(os.getenv("BENCHMARK_OPENINGS", "3000")) # Default: 3000 openings (size of the Lichess dataset)
+    SEED = int(os.getenv("BENCHMARK_SEED", "42")) # Default: 42
+    TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", "0.2")) # Default: 20% slower than the baseline
+    MIN_SECONDS = float(os.getenv("BENCHMARK_MIN_SECONDS", "0.5")) # Default: and at least 0.5 second slower
+    UPDATE_BASELINE = os.getenv("BENCHMARK_UPDATE_BASELINE", "false").lower() == "true" # Default: False
+
+    # All following connections (helpers, dlt and dbt profile) target the benchmark database
+    create_database(BENCHMARK_DB_NAME, drop_existing=True)
+    os.environ["DB_NAME"] = BENCHMARK_DB_NAME
+    engine = get_engine()
+
+    parameters = {
+        "users": USERS, "games_per_user": GAMES_PER_USER, "incremental_games_per_user": INCREMENTAL_GAMES_PER_USER,
+        "openings": OPENINGS, "seed": SEED,
+    }
+    print(f"Loading synthetic dataset in database {BENCHMARK_DB_NAME}: {parameters}")
+    now = datetime.now(timezone.utc)
+    usernames = [f"synthetic_user_{i:05d}" for i in range(USERS)]
+    openings = generate_openings(OPENINGS, seed=SEED)
+    load_openings(engine, openings)
+    load_games(
+        engine, usernames, GAMES_PER_USER, start=now - timedelta(days=300), end=now - timedelta(days=1),
+        openings_uci=list(openings["uci"]), seed=SEED, loaded_at=now - timedelta(hours=1),
+    )
+
+    timings = {}
+    _run_dbt(["seed"])
+    timings["full"] = _run_dbt(["run", "--full-refresh", "--exclude", "dbt_project_evaluator"])
+
+    load_games(
+        engine, usernames, INCREMENTAL_GAMES_PER_USER, start=now - timedelta(days=1), end=now,
+        openings_uci=list(openings["uci"]), seed=SEED + 1, loaded_at=now,
+    )
+    timings["incremental"] = _run_dbt(["run", "--exclude", "dbt_project_evaluator"])
+
+    results = {"run_at": now.isoformat(), "parameters": parameters, "timings": timings}
+    with open(RESULTS_PATH, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved in {RESULTS_PATH}")
+
+    baseline = None
+    if os.path.isfile(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)
+    if baseline is not None and baseline["parameters"] != parameters:
+        print(f"Baseline dataset parameters differ ({baseline['parameters']}): no comparison")
+        baseline = None
+    _print_timings(results, baseline)
+
+    if UPDATE_BASELINE or not os.path.isfile(BASELINE_PATH):
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline updated: {BASELINE_PATH}")
+        return
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, TOLERANCE, MIN_SECONDS)
+        if regressions:
+            print("\nPerformance regressions versus the baseline:")
+            for regression in regressions:
+                print(
+                    f"  [{regression['phase']}] {regression['model']}: "
+                    f"{regression['baseline_seconds']:.3f}s -> {regression['seconds']:.3f}s"
+                )
+            sys.exit(1)
+        print("\nNo performance regression versus the baseline.")
+
+
+if __name__ == "__main__":
+    run_benchmark()
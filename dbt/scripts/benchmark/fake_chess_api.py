@@ -0,0 +1,222 @@
+"""Local stand-in of the chess.com published-data API, to exercise and benchmark the ingestion offline.
+
+It serves the endpoints used by the chess source: player/{username}/games/archives and
+player/{username}/games/{YYYY}/{MM}, under /pub/ like api.chess.com. Modes:
+- synthetic: games generated by synthetic_data.py, deterministically per username (any username exists)
+- record: requests are forwarded to api.chess.com and the responses saved in the record directory
+- replay: responses are served from the record directory (404 if not recorded)
+
+Faults can be injected: latency, random 404 and 429 responses (with a Retry-After header), and ETag support
+(If-None-Match answered by 304 Not Modified) can be disabled.
+
+Run from the dbt folder: python -m scripts.benchmark.fake_chess_api, then set OFFICIAL_CHESS_API_URL to the printed
+URL for the chess.com API pipeline. Settings: FAKE_API_PORT (default: 8765), FAKE_API_MODE (default: synthetic),
+FAKE_API_RECORD_DIR (default: target/fake_chess_api), FAKE_API_GAMES_PER_USER (default: 300),
+FAKE_API_MONTHS (default: 6), FAKE_API_SEED (default: 42), FAKE_API_LATENCY_MS (default: 0),
+FAKE_API_404_RATE and FAKE_API_429_RATE (default: 0), FAKE_API_RETRY_AFTER_SECONDS (default: 1),
+FAKE_API_ETAG (default: true).
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from dotenv import load_dotenv
+
+from scripts.benchmark.synthetic_data import generate_games, generate_openings
+
+CHESS_API_URL = "https://api.chess.com/pub/"
+ARCHIVES_PATH_RE = re.compile(r"^player/(?P<username>[^/]+)/games/archives$")
+ARCHIVE_PATH_RE = re.compile(r"^player/(?P<username>[^/]+)/games/(?P<month>\d{4}/\d{2})$")
+
+
+class FakeChessApi:
+    """chess.com API stand-in. `start()` serves it on a local port in a background thread and returns its base URL."""
+
+    def __init__(
+        self,
+        mode: str = "synthetic",
+        record_dir: str = os.path.join("target", "fake_chess_api"),
+        games_per_user: int = 300,
+        months: int = 6,
+        seed: int = 42,
+        latency_ms: float = 0,
+        error_404_rate: float = 0,
+        error_429_rate: float = 0,
+        retry_after_seconds: int = 1,
+        etag: bool = True,
+    ):
+        if mode not in ("synthetic", "record", "replay"):
+            raise ValueError(f"Unknown fake chess.com API mode: {mode}")
+        self.mode = mode
+        self.record_dir = record_dir
+        self.games_per_user = games_per_user
+        self.months = months
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.error_404_rate = error_404_rate
+        self.error_429_rate = error_429_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.etag = etag
+        self.requests_count = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._archives = {} # username -> {month: games}, synthetic mode
+        self._openings_uci = list(generate_openings(200, seed=seed)["uci"]) if mode == "synthetic" else None
+        self._end = datetime.now(timezone.utc) # games of the last `months` months, the same for every request
+        self._server = None
+
+    def start(self, port: int = 0) -> str:
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _FakeChessApiHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_port}/pub/"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _games_generator(self) -> partial:
+        """generate_games with the settings of the API (picklable, to generate users in worker processes)."""
+        return partial(
+            generate_games, games_per_user=self.games_per_user, start=self._end - timedelta(days=30 * self.months),
+            end=self._end, openings_uci=self._openings_uci, seed=self.seed,
+        )
+
+    def _add_archives(self, username: str, games: list[dict]) -> dict:
+        archives = {}
+        for game in sorted(games, key=lambda game: game["end_time"]):
+            month = datetime.fromtimestamp(game["end_time"], tz=timezone.utc).strftime("%Y/%m")
+            # the source adds these fields itself
+            archives.setdefault(month, []).append(
+                {key: value for key, value in game.items() if key not in ("username", "archive_url")}
+            )
+        with self._lock:
+            return self._archives.setdefault(username, archives)
+
+    def preload(self, usernames: list[str], workers: int | None = None) -> None:
+        """Generate the synthetic games of users upfront, in parallel, so that requests do not wait for them."""
+        usernames = [username.lower() for username in usernames]
+        with multiprocessing.Pool(workers) as pool:
+            for username, (games, _, _) in zip(usernames, pool.imap(self._games_generator(), ([u] for u in usernames))):
+                self._add_archives(username, games)
+
+    def _synthetic_archives(self, username: str) -> dict:
+        """Games of a user grouped by archive month, generated on the first request."""
+        username = username.lower()
+        if username in self._archives:
+            return self._archives[username]
+        games, _, _ = self._games_generator()([username])
+        return self._add_archives(username, games)
+
+    def _get_document(self, path: str, base_url: str) -> dict | None:
+        """JSON document of an API path (relative to /pub/), or None if it does not exist."""
+        if self.mode == "synthetic":
+            match = ARCHIVES_PATH_RE.match(path)
+            if match:
+                archives = self._synthetic_archives(match["username"])
+                return {"archives": [f"{base_url}player/{match['username']}/games/{month}" for month in sorted(archives)]}
+            match = ARCHIVE_PATH_RE.match(path)
+            if match:
+                games = self._synthetic_archives(match["username"]).get(match["month"])
+                return None if games is None else {"games": games}
+            return None
+
+        record_path = os.path.join(self.record_dir, *path.split("/")) + ".json"
+        if self.mode == "record":
+            response = requests.get(f"{CHESS_API_URL}{path}", timeout=30)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            os.makedirs(os.path.dirname(record_path), exist_ok=True)
+            with open(record_path, "w", encoding="utf-8") as f:
+                f.write(response.text)
+        if not os.path.isfile(record_path):
+            return None
+        with open(record_path, "r", encoding="utf-8") as f:
+            # archive urls point to the recorded API: serve them from the fake one
+            return json.loads(f.read().replace(CHESS_API_URL, base_url))
+
+    def handle(self, path: str, headers: dict, base_url: str) -> tuple[int, dict, bytes]:
+        """Status, headers and body of the response to a GET request."""
+        with self._lock:
+            self.requests_count += 1
+            draw = self._random.random()
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if draw < self.error_429_rate:
+            return 429, {"Retry-After": str(self.retry_after_seconds)}, b""
+        if draw < self.error_429_rate + self.error_404_rate:
+            return 404, {}, b""
+
+        document = self._get_document(path, base_url)
+        if document is None:
+            return 404, {}, b""
+        body = json.dumps(document).encode("utf-8")
+        if not self.etag:
+            return 200, {"Content-Type": "application/json"}, body
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"Content-Type": "application/json", "ETag": etag}, body
+
+
+class _FakeChessApiHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        api = self.server.api
+        path = self.path.split("?")[0]
+        if not path.startswith("/pub/"):
+            status, headers, body = 404, {}, b""
+        else:
+            status, headers, body = api.handle(path[len("/pub/"):], self.headers, f"http://{self.headers['Host']}/pub/")
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # one line per request would flood the benchmark output
+
+
+def serve_fake_chess_api():
+    load_dotenv()
+
+    PORT = int(os.getenv("FAKE_API_PORT", "8765")) # Default: 8765
+    api = FakeChessApi(
+        mode=os.getenv("FAKE_API_MODE", "synthetic"), # Default: synthetic
+        record_dir=os.getenv("FAKE_API_RECORD_DIR", os.path.join("target", "fake_chess_api")), # Default: target/fake_chess_api
+        games_per_user=int(os.getenv("FAKE_API_GAMES_PER_USER", "300")), # Default: 300 games per user
+        months=int(os.getenv("FAKE_API_MONTHS", "6")), # Default: games of the last 6 months
+        seed=int(os.getenv("FAKE_API_SEED", "42")), # Default: 42
+        latency_ms=float(os.getenv("FAKE_API_LATENCY_MS", "0")), # Default: no latency
+        error_404_rate=float(os.getenv("FAKE_API_404_RATE", "0")), # Default: no 404
+        error_429_rate=float(os.getenv("FAKE_API_429_RATE", "0")), # Default: no 429
+        retry_after_seconds=int(os.getenv("FAKE_API_RETRY_AFTER_SECONDS", "1")), # Default: 1 second
+        etag=os.getenv("FAKE_API_ETAG", "true").lower() == "true", # Default: True
+    )
+    base_url = api.start(PORT)
+    print(f"Fake chess.com API ({api.mode}) serving on {base_url}: set OFFICIAL_CHESS_API_URL={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    serve_fake_chess_api()
@@ -0,0 +1,101 @@
+"""Benchmark of the chess.com API ingestion (chess_games_pipeline.py) against the local fake chess.com API.
+
+Run from the dbt folder: python -m scripts.benchmark.ingestion_benchmark (or make ingestion_benchmark)
+
+Flow:
+- (Re)create the benchmark database INGESTION_BENCHMARK_DB_NAME (never the DB_NAME database) and use a dedicated
+  dlt data directory, so that neither the production tables nor the production pipeline state are touched
+- Serve synthetic archives with the fake chess.com API (scripts/benchmark/fake_chess_api.py) for
+  INGESTION_BENCHMARK_USERS users with INGESTION_BENCHMARK_GAMES_PER_USER games each over INGESTION_BENCHMARK_MONTHS
+  months, with INGESTION_BENCHMARK_LATENCY_MS of latency per request and INGESTION_BENCHMARK_429_RATE of throttled requests
+- Run the pipeline in INGESTION_BENCHMARK_SHARDS shards (CHESS_API_SHARDS), to measure how it scales with the workers
+- Phase "initial": run the pipeline for all users (all archives are new) and measure the games ingested per second
+- Phase "idle": run it again without new games and measure the duration of an idle loop
+- Save the results in target/ingestion_benchmark.json
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from scripts.helper import get_engine
+from scripts.benchmark.fake_chess_api import FakeChessApi
+from scripts.benchmark.synthetic_data import create_database
+from scripts.orchestration.metrics import StageMetrics
+from scripts.orchestration.stages import run_stage
+
+RESULTS_PATH = os.path.join("target", "ingestion_benchmark.json")
+
+
+def _run_ingestion(metrics: StageMetrics) -> tuple[float, int]:
+    """Run the chess.com API stage and return its duration (seconds) and the number of games landed."""
+    start = time.monotonic()
+    report = run_stage("chess_com_api", metrics)
+    return round(time.monotonic() - start, 3), (report or {}).get("rows", 0)
+
+
+def run_benchmark():
+    load_dotenv()
+
+    BENCHMARK_DB_NAME = os.getenv("INGESTION_BENCHMARK_DB_NAME", "chess_ingestion_benchmark") # Default: chess_ingestion_benchmark
+    USERS = int(os.getenv("INGESTION_BENCHMARK_USERS", "50")) # Default: 50 users
+    GAMES_PER_USER = int(os.getenv("INGESTION_BENCHMARK_GAMES_PER_USER", "300")) # Default: 300 games per user
+    MONTHS = int(os.getenv("INGESTION_BENCHMARK_MONTHS", "6")) # Default: games of the last 6 months
+    LATENCY_MS = float(os.getenv("INGESTION_BENCHMARK_LATENCY_MS", "50")) # Default: 50ms per request
+    RATE_429 = float(os.getenv("INGESTION_BENCHMARK_429_RATE", "0")) # Default: no throttling
+    SEED = int(os.getenv("INGESTION_BENCHMARK_SEED", "42")) # Default: 42
+    SHARDS = int(os.getenv("INGESTION_BENCHMARK_SHARDS", "1")) # Default: 1, no sharding
+
+    # All following connections (helpers, dlt) target the benchmark database, with a dedicated pipeline state
+    create_database(BENCHMARK_DB_NAME, drop_existing=True)
+    os.environ["DB_NAME"] = BENCHMARK_DB_NAME
+    dlt_data_dir = tempfile.mkdtemp(prefix="ingestion_benchmark_dlt_")
+    os.environ["DLT_DATA_DIR"] = dlt_data_dir
+    engine = get_engine()
+
+    usernames = [f"synthetic_user_{i:05d}" for i in range(USERS)]
+    api = FakeChessApi(
+        games_per_user=GAMES_PER_USER, months=MONTHS, seed=SEED, latency_ms=LATENCY_MS, error_429_rate=RATE_429,
+    )
+    print(f"Generating the archives of {USERS} users")
+    api.preload(usernames)
+    os.environ["OFFICIAL_CHESS_API_URL"] = api.start()
+    os.environ["CHESS_API_USERNAMES"] = ",".join(usernames)
+    os.environ["CHESS_API_SHARDS"] = str(SHARDS)
+
+    parameters = {
+        "users": USERS, "games_per_user": GAMES_PER_USER, "months": MONTHS, "latency_ms": LATENCY_MS,
+        "rate_429": RATE_429, "seed": SEED, "shards": SHARDS,
+        "loader_file_format": os.getenv("DLT_LOADER_FILE_FORMAT", "csv"),
+    }
+    metrics = StageMetrics(engine)
+    phases = {}
+    try:
+        for phase in ["initial", "idle"]:
+            requests_before = api.requests_count
+            seconds, games = _run_ingestion(metrics)
+            phases[phase] = {
+                "seconds": seconds,
+                "games": games,
+                "games_per_second": round(games / seconds, 1) if seconds else None,
+                "requests": api.requests_count - requests_before,
+            }
+            print(f"Phase {phase}: {phases[phase]}")
+    finally:
+        api.stop()
+        shutil.rmtree(dlt_data_dir, ignore_errors=True)
+
+    results = {"run_at": datetime.now(timezone.utc).isoformat(), "parameters": parameters, "phases": phases}
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved in {RESULTS_PATH}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,173 @@
+"""Query plans of the hot queries, compared to a stored baseline to catch plans flipping to sequential scans.
+
+Run from the dbt folder: python -m scripts.benchmark.query_plans (or make query_plans)
+
+Hot queries:
+- games_to_process (helper.py), for the game times and Stockfish pipelines
+- the MAX(...) watermark subquery of each incremental dbt model
+- the Streamlit dataset query (streamlit/data/streamlit_games_stats_filtered.sql)
+
+Flow:
+- Run EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) on each query against QUERY_PLANS_DB_NAME (default: DB_NAME), in a
+  transaction which is rolled back. The plans are saved in target/query_plans.json.
+- Compare them to the baseline (query_plans_baseline.json): a query is flagged if its plan has a sequential scan
+  on a relation which was not sequentially scanned in the baseline, or if its estimated cost grew by more than
+  QUERY_PLANS_COST_TOLERANCE (relative, default: 1 i.e. doubled). Exits with an error if a query is flagged.
+- With QUERY_PLANS_UPDATE_BASELINE=true (or if there is no baseline yet), the plans become the new baseline.
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from scripts.helper import get_engine, load_config, load_dbt_project, get_table_settings, games_to_process
+
+PLANS_PATH = os.path.join("target", "query_plans.json")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "query_plans_baseline.json")
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "models")
+STREAMLIT_QUERY_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "streamlit", "data", "streamlit_games_stats_filtered.sql"
+)
+
+# Batch sizes of the game times and Stockfish pipelines
+GAMES_TO_PROCESS_LIMITS = {"games_times": 10000, "stockfish": 100}
+
+# Watermark subquery of the incremental models, e.g. SELECT MAX(i.log_timestamp) FROM {{ this }} i
+WATERMARK_RE = re.compile(r"SELECT\s+MAX\(i\.(\w+)\)\s+FROM\s+\{\{\s*this\s*\}\}\s+i", re.IGNORECASE)
+
+
+def get_watermark_columns(model_sql: str) -> list[str]:
+    """Columns of the watermark subqueries of an incremental model, in order of appearance (a model can have several,
+    e.g. int_games_openings on [run_timestamp] and [openings_log_timestamp])."""
+    return list(dict.fromkeys(match.group(1) for match in WATERMARK_RE.finditer(model_sql)))
+
+
+def get_hot_queries(engine: Engine) -> dict:
+    """Mapping query name -> SQL of the queries whose plans are tracked."""
+    config = load_config()
+    queries = {}
+    for source_key, limit in GAMES_TO_PROCESS_LIMITS.items():
+        table_name, _ = get_table_settings(config, source_key)
+        query = games_to_process(engine, config["postgres"]["schemas"][source_key], table_name, limit=limit)
+        queries[f"games_to_process.{source_key}"] = query.replace("%%", "%") # text() escapes the % itself
+
+    dbt_project = load_dbt_project()
+    models_config = dbt_project["models"][dbt_project["name"]]
+    for model_path in sorted(glob.glob(os.path.join(MODELS_DIR, "**", "*.sql"), recursive=True)):
+        with open(model_path, "r") as f:
+            columns = get_watermark_columns(f.read())
+        layer = os.path.relpath(model_path, MODELS_DIR).split(os.sep)[0]
+        model_name = os.path.splitext(os.path.basename(model_path))[0]
+        schema_name = models_config[layer]["+schema"]
+        for column in columns:
+            queries[f"watermark.{model_name}.{column}"] = f'SELECT MAX(i.{column}) FROM "{schema_name}"."{model_name}" i'
+
+    with open(STREAMLIT_QUERY_PATH, "r") as f:
+        queries["streamlit_games_stats_filtered"] = f.read()
+    return queries
+
+
+def _walk_plan(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk_plan(child)
+
+
+def summarize_plan(plan: dict) -> dict:
+    """Cost, execution time, buffers and sequentially scanned relations of an EXPLAIN (FORMAT JSON) plan."""
+    root = plan["Plan"]
+    return {
+        "total_cost": root["Total Cost"],
+        "execution_ms": plan.get("Execution Time"),
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+        "seq_scans": sorted({
+            f'{node.get("Schema", "")}.{node["Relation Name"]}'.lstrip(".")
+            for node in _walk_plan(root)
+            if node["Node Type"] == "Seq Scan"
+        }),
+    }
+
+
+def explain(engine: Engine, query: str) -> dict:
+    """EXPLAIN ANALYZE a query (it is executed) in a transaction which is rolled back."""
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            result = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) {query}")).scalar()
+            transaction.rollback()
+    return result[0] if isinstance(result, list) else json.loads(result)[0]
+
+
+def compare_to_baseline(results: dict, baseline: dict, cost_tolerance: float) -> list[dict]:
+    """Queries with new sequential scans or an estimated cost higher than the baseline by more than `cost_tolerance`."""
+    flags = []
+    for name, summary in results["queries"].items():
+        baseline_summary = baseline["queries"].get(name)
+        if baseline_summary is None:
+            continue
+        new_seq_scans = sorted(set(summary["seq_scans"]) - set(baseline_summary["seq_scans"]))
+        if new_seq_scans:
+            flags.append({"query": name, "reason": f"new sequential scan on {', '.join(new_seq_scans)}"})
+        if summary["total_cost"] > baseline_summary["total_cost"] * (1 + cost_tolerance):
+            flags.append({
+                "query": name,
+                "reason": f"cost {baseline_summary['total_cost']:.0f} -> {summary['total_cost']:.0f}",
+            })
+    return flags
+
+
+def run_query_plans():
+    load_dotenv()
+
+    DB_NAME = os.getenv("QUERY_PLANS_DB_NAME", os.getenv("DB_NAME")) # Default: DB_NAME
+    COST_TOLERANCE = float(os.getenv("QUERY_PLANS_COST_TOLERANCE", "1")) # Default: cost doubled
+    UPDATE_BASELINE = os.getenv("QUERY_PLANS_UPDATE_BASELINE", "false").lower() == "true" # Default: False
+
+    os.environ["DB_NAME"] = DB_NAME
+    engine = get_engine()
+
+    plans, summaries = {}, {}
+    for name, query in get_hot_queries(engine).items():
+        try:
+            plans[name] = explain(engine, query)
+        except Exception as e: # e.g. a model not built yet in this database
+            print(f"Could not explain {name}: {e}")
+            continue
+        summaries[name] = summarize_plan(plans[name])
+        print(
+            f"{name:<50} cost {summaries[name]['total_cost']:>12.0f} "
+            f"{summaries[name]['execution_ms'] or 0:>10.1f}ms  seq scans: {', '.join(summaries[name]['seq_scans']) or '-'}"
+        )
+
+    results = {"run_at": datetime.now(timezone.utc).isoformat(), "database": DB_NAME, "queries": summaries}
+    os.makedirs(os.path.dirname(PLANS_PATH), exist_ok=True)
+    with open(PLANS_PATH, "w") as f:
+        json.dump({**results, "plans": plans}, f, indent=2)
+    print(f"Query plans saved in {PLANS_PATH}")
+
+    if UPDATE_BASELINE or not os.path.isfile(BASELINE_PATH):
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {BASELINE_PATH}")
+        return
+
+    with open(BASELINE_PATH, "r") as f:
+        baseline = json.load(f)
+    flags = compare_to_baseline(results, baseline, COST_TOLERANCE)
+    if flags:
+        print("\nQuery plan regressions versus the baseline:")
+        for flag in flags:
+            print(f"  {flag['query']}: {flag['reason']}")
+        sys.exit(1)
+    print("\nNo query plan regression versus the baseline.")
+
+
+if __name__ == "__main__":
+    run_query_plans()
@@ -0,0 +1,476 @@
+"""Synthetic chess.com dataset: games (players_games), clock times, Stockfish move evaluations and openings.
+
+Games are legal random games starting with an opening of the synthetic openings dataset, so that every dbt model
+(including the openings hierarchy) has data to process. They are shaped like the chess.com API archives: PGN with
+[%clk] comments, TCN, ratings, time controls, results and terminations, including the games filtered out by the
+data scope (daily, unrated, chess960).
+
+The generation is deterministic: the games of a user only depend on the seed and the username, whatever the number
+of workers generating them in parallel.
+
+Run from the dbt folder to load a synthetic database: python -m scripts.benchmark.synthetic_data (or make synthetic_data)
+- SYNTHETIC_DB_NAME: target database (default: chess_synthetic), created on the Postgres server of the .env file.
+  It must differ from DB_NAME. SYNTHETIC_RESET=true drops it first.
+- SYNTHETIC_USERS x SYNTHETIC_GAMES_PER_USER games (default: 1000 x 1000), ending during the last SYNTHETIC_MONTHS
+  months (default: 12), with SYNTHETIC_OPENINGS openings (default: 3000) and SYNTHETIC_SEED (default: 42).
+- SYNTHETIC_ANALYZED_SHARE: share of the games with clock times and Stockfish evaluations (default: 1). Use a lower
+  share to leave work to the game times and Stockfish pipelines.
+- SYNTHETIC_WORKERS: number of generation processes (default: number of CPUs).
+"""
+
+import hashlib
+import multiprocessing
+import os
+import random
+import tempfile
+import uuid as uuid_lib
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+import chess
+import dlt
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import BigInteger, DateTime
+
+from scripts.helper import get_engine, load_config, load_dbt_project, get_table_settings, create_index_if_not_exists, copy_dataframe
+from scripts.openings.opening_classifier import OpeningClassifier, format_opening_ids
+from scripts.openings.opening_hierarchy import HIERARCHY_DTYPE, add_hierarchy_columns
+
+# time class: (share of the games, time controls)
+TIME_CONTROLS = {
+    "bullet": (0.25, ["60", "60+1", "120+1"]),
+    "blitz":  (0.45, ["180", "180+2", "300", "300+5"]),
+    "rapid":  (0.25, ["600", "600+5", "900+10", "1800"]),
+    "daily":  (0.05, ["1/86400", "1/259200"]),
+}
+UNRATED_SHARE = 0.05
+CHESS960_SHARE = 0.01
+DRAW_SHARE = 0.06
+ACCURACIES_SHARE = 0.4
+
+# Column types of the game times and Stockfish pipelines tables
+LOG_TIMESTAMP_DTYPE = {"log_timestamp": DateTime(timezone=True)}
+
+# chess.com TCN move encoding: 2 characters per move (from square, to square or promotion)
+TCN_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!?{~}(^)[_]@#$,./&-*++="
+TCN_PROMOTION_PIECES = "qnrbkp"
+
+TERMINATIONS = {
+    "checkmated":   "{winner} won by checkmate",
+    "resigned":     "{winner} won by resignation",
+    "timeout":      "{winner} won on time",
+    "abandoned":    "{winner} won - game abandoned",
+    "agreed":       "Game drawn by agreement",
+    "repetition":   "Game drawn by repetition",
+    "stalemate":    "Game drawn by stalemate",
+    "insufficient": "Game drawn by insufficient material",
+}
+
+
+def encode_tcn(moves: list[chess.Move]) -> str:
+    tcn = []
+    for move in moves:
+        to_index = move.to_square
+        if move.promotion:
+            piece_index = TCN_PROMOTION_PIECES.index(chess.piece_symbol(move.promotion))
+            file_offset = chess.square_file(move.to_square) - chess.square_file(move.from_square)
+            to_index = 64 + piece_index * 3 + file_offset + 1
+        tcn.append(TCN_ALPHABET[move.from_square] + TCN_ALPHABET[to_index])
+    return "".join(tcn)
+
+
+def _format_clock(seconds: float) -> str:
+    """chess.com PGN clock format, e.g. 0:02:59.9"""
+    tenths = int(round(seconds * 10))
+    hours, rest = divmod(tenths, 36000)
+    minutes, rest = divmod(rest, 600)
+    return f"{hours}:{minutes:02d}:{rest // 10:02d}.{rest % 10}"
+
+
+def _format_movetext(sans: list[str], clocks: list[float] | None = None) -> str:
+    """SAN movetext, with chess.com [%clk] comments when clocks are given (e.g. 1. e4 {[%clk 0:02:59.9]} 1... e5 ...)"""
+    parts = []
+    for i, san in enumerate(sans):
+        number = f"{i // 2 + 1}." if i % 2 == 0 else f"{i // 2 + 1}..."
+        if clocks is None:
+            parts.append(f"{number} {san}" if i % 2 == 0 else san)
+        else:
+            parts.append(f"{number} {san} {{[%clk {_format_clock(clocks[i])}]}}")
+    return " ".join(parts)
+
+
+def generate_openings(nb_openings: int, seed: int) -> pd.DataFrame:
+    """Openings shaped like the Lichess openings dataset (eco-volume, eco, name, pgn, uci, epd)."""
+    rng = random.Random(seed)
+    openings = {}
+    while len(openings) < nb_openings:
+        board = chess.Board()
+        sans = []
+        for _ in range(rng.randint(1, 12)):
+            legal_moves = list(board.legal_moves)
+            if not legal_moves: # e.g. fool's mate
+                break
+            sans.append(board.san_and_push(rng.choice(legal_moves)))
+        uci = " ".join(move.uci() for move in board.move_stack)
+        if uci in openings:
+            continue
+        eco = f"{rng.choice('ABCDE')}{rng.randint(0, 99):02d}"
+        openings[uci] = {
+            "eco-volume": eco[0],
+            "eco": eco,
+            "name": f"Synthetic Opening {len(openings) + 1}",
+            "pgn": _format_movetext(sans),
+            "uci": uci,
+            "epd": board.epd(),
+        }
+    return pd.DataFrame(list(openings.values()))
+
+
+def _play_game(rng: random.Random, board: chess.Board, opening_uci: str | None) -> list[str]:
+    """Play a legal random game (after the opening, if any) and return its SAN moves."""
+    sans = [board.san_and_push(chess.Move.from_uci(uci)) for uci in opening_uci.split(" ")] if opening_uci else []
+    nb_plies = rng.randint(max(len(sans), 20), 160)
+    while len(sans) < nb_plies:
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        sans.append(board.san_and_push(rng.choice(legal_moves)))
+    return sans
+
+
+def _play_clocks(rng: random.Random, nb_plies: int, time_control: str) -> list[float]:
+    if "/" in time_control: # daily: fixed time per move
+        time_per_move = float(time_control.split("/")[1])
+        return [round(time_per_move - rng.uniform(60, time_per_move - 60), 1) for _ in range(nb_plies)]
+
+    base, _, increment = time_control.partition("+")
+    remaining = [float(base), float(base)]
+    clocks = []
+    for ply in range(nb_plies):
+        side = ply % 2
+        think_time = min(rng.expovariate(40 / float(base)), remaining[side] - 0.1)
+        remaining[side] = remaining[side] - think_time + float(increment or 0)
+        clocks.append(round(remaining[side], 1))
+    return clocks
+
+
+def _game_duration(clocks: list[float], time_control: str) -> float:
+    """Seconds spent by both players, from their remaining clock times."""
+    if "/" in time_control: # daily: the clock restarts at each move
+        return sum(float(time_control.split("/")[1]) - clock for clock in clocks)
+    base, _, increment = time_control.partition("+")
+    return sum(float(base) - clock for clock in clocks[-2:]) + float(increment or 0) * len(clocks)
+
+
+def _play_scores(rng: random.Random, nb_plies: int) -> list[int]:
+    score = rng.randint(-30, 50)
+    scores = []
+    for _ in range(nb_plies):
+        score += int(rng.gauss(0, 40))
+        if rng.random() < 0.03: # blunder
+            score += rng.choice([-1, 1]) * rng.randint(250, 800)
+        score = max(-1000, min(1000, score))
+        scores.append(score)
+    return scores
+
+
+def _game_results(rng: random.Random, board: chess.Board, white_rating: int, black_rating: int) -> tuple[str, str]:
+    """chess.com results of the white and black players. Decisive results follow the Elo expected score."""
+    if board.is_checkmate():
+        return ("checkmated", "win") if board.turn == chess.WHITE else ("win", "checkmated")
+    if board.is_stalemate():
+        return "stalemate", "stalemate"
+    if board.is_insufficient_material():
+        return "insufficient", "insufficient"
+    if rng.random() < DRAW_SHARE:
+        draw = rng.choice(["agreed", "agreed", "repetition"])
+        return draw, draw
+    loser_result = rng.choices(["resigned", "timeout", "abandoned"], weights=[0.6, 0.3, 0.1])[0]
+    white_expected_score = 1 / (1 + 10 ** ((black_rating - white_rating) / 400))
+    return ("win", loser_result) if rng.random() < white_expected_score else (loser_result, "win")
+
+
+def _player(username: str, rating: int, result: str) -> dict:
+    return {
+        "rating": rating,
+        "result": result,
+        "@id": f"https://api.chess.com/pub/player/{username.lower()}",
+        "username": username,
+        "uuid": str(uuid_lib.uuid5(uuid_lib.NAMESPACE_URL, username.lower())),
+    }
+
+
+def _generate_game(rng: random.Random, username: str, ratings: dict, start: datetime, end: datetime, openings_uci: list[str]):
+    game_uuid = str(uuid_lib.UUID(int=rng.getrandbits(128), version=4))
+    game_id = rng.randint(10**10, 10**11)
+    time_class = rng.choices(list(TIME_CONTROLS), weights=[share for share, _ in TIME_CONTROLS.values()])[0]
+    time_control = rng.choice(TIME_CONTROLS[time_class][1])
+    end_time = start + timedelta(seconds=rng.uniform(0, (end - start).total_seconds()))
+
+    if rng.random() < CHESS960_SHARE:
+        rules, board = "chess960", chess.Board.from_chess960_pos(rng.randint(0, 959))
+        opening_uci = None
+    else:
+        rules, board = "chess", chess.Board()
+        opening_uci = rng.choice(openings_uci)
+    initial_setup = board.fen()
+    sans = _play_game(rng, board, opening_uci)
+    clocks = _play_clocks(rng, len(sans), time_control)
+    scores = _play_scores(rng, len(sans))
+
+    rating = ratings[time_class]
+    opponent = f"opponent_{rng.randint(0, 10**6)}"
+    opponent_rating = max(100, rating + int(rng.gauss(0, 80)))
+    playing_white = rng.random() < 0.5
+    white, black = ((username, rating), (opponent, opponent_rating)) if playing_white else ((opponent, opponent_rating), (username, rating))
+    white_result, black_result = _game_results(rng, board, white[1], black[1])
+
+    # Rating of the next game of the user
+    playing_result = white_result if playing_white else black_result
+    opponent_result = black_result if playing_white else white_result
+    if playing_result == "win":
+        ratings[time_class] = rating + rng.randint(5, 12)
+    elif opponent_result == "win":
+        ratings[time_class] = max(100, rating - rng.randint(5, 12))
+
+    if white_result == "win":
+        result, termination = "1-0", TERMINATIONS[black_result].format(winner=white[0])
+    elif black_result == "win":
+        result, termination = "0-1", TERMINATIONS[white_result].format(winner=black[0])
+    else:
+        result, termination = "1/2-1/2", TERMINATIONS[white_result]
+
+    start_time = end_time - timedelta(seconds=_game_duration(clocks, time_control))
+    pgn_headers = {
+        "Event": "Let's Play!" if time_class == "daily" else "Live Chess",
+        "Site": "Chess.com",
+        "Date": start_time.strftime("%Y.%m.%d"),
+        "Round": "-",
+        "White": white[0],
+        "Black": black[0],
+        "Result": result,
+        "CurrentPosition": board.fen(),
+        "Timezone": "UTC",
+        "ECO": "A00",
+        "ECOUrl": "https://www.chess.com/openings/Synthetic-Opening",
+        "UTCDate": start_time.strftime("%Y.%m.%d"),
+        "UTCTime": start_time.strftime("%H:%M:%S"),
+        "WhiteElo": str(white[1]),
+        "BlackElo": str(black[1]),
+        "TimeControl": time_control,
+        "Termination": termination,
+        "StartTime": start_time.strftime("%H:%M:%S"),
+        "EndDate": end_time.strftime("%Y.%m.%d"),
+        "EndTime": end_time.strftime("%H:%M:%S"),
+        "Link": f"https://www.chess.com/game/{'daily' if time_class == 'daily' else 'live'}/{game_id}",
+    }
+    if rules == "chess960":
+        pgn_headers.update({"SetUp": "1", "FEN": initial_setup, "Variant": "Chess960"})
+
+    game = {
+        "url": pgn_headers["Link"],
+        "pgn": (
+            "\n".join(f'[{key} "{value}"]' for key, value in pgn_headers.items())
+            + "\n\n" + _format_movetext(sans, clocks) + f" {result}\n"
+        ),
+        "time_control": time_control,
+        "end_time": int(end_time.timestamp()),
+        "rated": rng.random() >= UNRATED_SHARE,
+        "tcn": encode_tcn(board.move_stack),
+        "uuid": game_uuid,
+        "initial_setup": initial_setup,
+        "fen": board.fen(),
+        "time_class": time_class,
+        "rules": rules,
+        "white": _player(white[0], white[1], white_result),
+        "black": _player(black[0], black[1], black_result),
+        "eco": "https://www.chess.com/openings/Synthetic-Opening",
+        "username": username.lower(),
+        "archive_url": f"https://api.chess.com/pub/player/{username.lower()}/games/{end_time:%Y/%m}",
+    }
+    if time_class == "daily":
+        game["start_time"] = int(start_time.timestamp())
+    if rng.random() < ACCURACIES_SHARE:
+        game["accuracies"] = {"white": round(rng.uniform(40, 99), 2), "black": round(rng.uniform(40, 99), 2)}
+
+    times = [
+        (game_uuid, ply, clock, _format_clock(clock))
+        for ply, clock in enumerate(clocks, 1)
+    ]
+    moves = [
+        (game_uuid, ply, move.uci(), score)
+        for ply, (move, score) in enumerate(zip(board.move_stack, scores), 1)
+    ]
+    return game, times, moves
+
+
+def generate_games(
+    usernames: list[str], games_per_user: int, start: datetime, end: datetime, openings_uci: list[str], seed: int,
+) -> tuple[list[dict], pd.DataFrame, pd.DataFrame]:
+    """Games of `usernames` ending between `start` and `end`, shaped like the chess.com API archives,
+    with the matching clock times (players_games_times) and move evaluations (players_games_moves) rows.
+    """
+    games, times, moves = [], [], []
+    for username in usernames:
+        rng = random.Random(f"{seed}:{username.lower()}")
+        base_rating = rng.gauss(1100, 350)
+        ratings = {time_class: int(min(2800, max(100, base_rating + rng.gauss(0, 100)))) for time_class in TIME_CONTROLS}
+        for _ in range(games_per_user):
+            game, game_times, game_moves = _generate_game(rng, username, ratings, start, end, openings_uci)
+            games.append(game)
+            times.extend(game_times)
+            moves.extend(game_moves)
+
+    return (
+        games,
+        pd.DataFrame(times, columns=["uuid", "move_number", "time_remaining_seconds", "time_remaining"]),
+        pd.DataFrame(moves, columns=["uuid", "move_number", "move", "score_white"]),
+    )
+
+
+def is_analyzed(game_uuid: str, analyzed_share: float) -> bool:
+    """Deterministic selection of the games loaded with their clock times and Stockfish evaluations."""
+    return int(game_uuid.replace("-", "")[:8], 16) / 16**8 < analyzed_share
+
+
+def create_database(db_name: str, drop_existing: bool) -> None:
+    """Create a database on the Postgres server of the .env file (from the default `postgres` maintenance database)."""
+    if db_name == os.getenv("DB_NAME"):
+        raise ValueError(f"The synthetic database must differ from DB_NAME ({db_name})")
+
+    server_url = get_engine().url.set(database="postgres")
+    engine = create_engine(server_url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        if drop_existing:
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{db_name}" WITH (FORCE)'))
+        exists = conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": db_name}).scalar()
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{db_name}"'))
+    engine.dispose()
+
+
+def _get_dlt_credentials() -> dict:
+    return {
+        "database":        os.getenv("DB_NAME"),
+        "username":        os.getenv("DB_USER"),
+        "password":        os.getenv("DB_PASSWORD"),
+        "host":            os.getenv("DB_HOST"),
+        "port":            int(os.getenv("DB_PORT")),
+        "connect_timeout": 15
+    }
+
+
+def _copy_dataframe(engine: Engine, df: pd.DataFrame, source_key: str, dtype: dict | None = None) -> None:
+    """Bulk-append a DataFrame with COPY into the table of a source of config.yml."""
+    config = load_config()
+    table_name, _ = get_table_settings(config, source_key)
+    copy_dataframe(engine, df, config["postgres"]["schemas"][source_key], table_name, dtype)
+
+
+def _create_indexes(engine: Engine, source_keys: list[str]) -> None:
+    config = load_config()
+    for source_key in source_keys:
+        table_name, index_field = get_table_settings(config, source_key)
+        create_index_if_not_exists(engine, config["postgres"]["schemas"][source_key], table_name, index_field)
+
+
+def load_games(
+    engine: Engine, usernames: list[str], games_per_user: int, start: datetime, end: datetime,
+    openings_uci: list[str], seed: int, loaded_at: datetime, analyzed_share: float = 1.0, workers: int | None = None,
+) -> None:
+    """Generate games in parallel (one task per user) and append them to the raw schemas, like the chess.com API (dlt),
+    game times and Stockfish pipelines do. Clock times, openings and evaluations are bulk-loaded with COPY as the games
+    are generated, while the games are streamed to dlt.
+    """
+    config = load_config()
+    classifier = OpeningClassifier(
+        [(uci, _opening_epd(uci)) for uci in openings_uci], depth=load_dbt_project()["vars"]["openings"]["hierarchy_depth"]
+    )
+    generate = partial(
+        generate_games, games_per_user=games_per_user, start=start, end=end, openings_uci=openings_uci, seed=seed,
+    )
+    log_timestamp = loaded_at.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _games_stream():
+        with multiprocessing.Pool(workers) as pool:
+            for games, times, moves in pool.imap(generate, ([username] for username in usernames)):
+                analyzed_uuids = {game["uuid"] for game in games if is_analyzed(game["uuid"], analyzed_share)}
+                if analyzed_uuids:
+                    times = times[times["uuid"].isin(analyzed_uuids)].assign(log_timestamp=loaded_at)
+                    moves = moves[moves["uuid"].isin(analyzed_uuids)].assign(log_timestamp=loaded_at)
+                    games_openings = pd.DataFrame({
+                        "uuid": [game["uuid"] for game in games if game["uuid"] in analyzed_uuids],
+                        "opening_ids": [
+                            format_opening_ids(classifier.classify(game["pgn"])) for game in games if game["uuid"] in analyzed_uuids
+                        ],
+                        "log_timestamp": loaded_at,
+                    })
+                    _copy_dataframe(engine, games_openings, "games_openings", {**LOG_TIMESTAMP_DTYPE, "opening_ids": ARRAY(BigInteger)})
+                    _copy_dataframe(engine, times, "games_times", LOG_TIMESTAMP_DTYPE)
+                    _copy_dataframe(engine, moves, "stockfish", LOG_TIMESTAMP_DTYPE)
+                yield [{**game, "log_timestamp": log_timestamp} for game in games]
+
+    pipeline = dlt.pipeline(
+        pipeline_name="synthetic_chess_games",
+        pipelines_dir=tempfile.mkdtemp(prefix="synthetic_chess_games_"), # no local state between loads
+        destination=dlt.destinations.postgres(credentials=_get_dlt_credentials()),
+        dataset_name=config["postgres"]["schemas"]["chess_com_api"],
+    )
+    pipeline.run(
+        _games_stream(), table_name="players_games", write_disposition="append",
+        columns={"end_time": {"data_type": "timestamp"}},
+    )
+    _create_indexes(engine, ["chess_com_api", "games_openings", "games_times", "stockfish"])
+
+
+def _opening_epd(uci: str) -> str:
+    board = chess.Board()
+    for move in uci.split(" "):
+        board.push_uci(move)
+    return board.epd()
+
+
+def load_openings(engine: Engine, openings: pd.DataFrame) -> None:
+    """Load openings in the raw openings table, like the openings pipeline does."""
+    content_hash = hashlib.sha256(openings.to_csv(index=False).encode("utf-8")).hexdigest()
+    openings = add_hierarchy_columns(openings, content_hash)
+    openings = openings.assign(log_timestamp=datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"))
+    _copy_dataframe(engine, openings, "openings", HIERARCHY_DTYPE)
+    _create_indexes(engine, ["openings"])
+
+
+def load_synthetic_database():
+    load_dotenv()
+
+    DB_NAME = os.getenv("SYNTHETIC_DB_NAME", "chess_synthetic") # Default: chess_synthetic
+    RESET = os.getenv("SYNTHETIC_RESET", "false").lower() == "true" # Default: False
+    USERS = int(os.getenv("SYNTHETIC_USERS", "1000")) # Default: 1000 users
+    GAMES_PER_USER = int(os.getenv("SYNTHETIC_GAMES_PER_USER", "1000")) # Default: 1000 games per user
+    MONTHS = int(os.getenv("SYNTHETIC_MONTHS", "12")) # Default: games of the last 12 months
+    OPENINGS = int(os.getenv("SYNTHETIC_OPENINGS", "3000")) # Default: 3000 openings (size of the Lichess dataset)
+    SEED = int(os.getenv("SYNTHETIC_SEED", "42")) # Default: 42
+    ANALYZED_SHARE = float(os.getenv("SYNTHETIC_ANALYZED_SHARE", "1")) # Default: all games analyzed
+    WORKERS = int(os.getenv("SYNTHETIC_WORKERS", str(os.cpu_count()))) # Default: number of CPUs
+
+    create_database(DB_NAME, drop_existing=RESET)
+    os.environ["DB_NAME"] = DB_NAME
+    engine = get_engine()
+
+    now = datetime.now(timezone.utc)
+    print(f"Loading {USERS * GAMES_PER_USER} synthetic games ({USERS} users) in database {DB_NAME}")
+    openings = generate_openings(OPENINGS, seed=SEED)
+    load_openings(engine, openings)
+    load_games(
+        engine, [f"synthetic_user_{i:05d}" for i in range(USERS)], GAMES_PER_USER,
+        start=now - timedelta(days=30 * MONTHS), end=now, openings_uci=list(openings["uci"]), seed=SEED,
+        loaded_at=now, analyzed_share=ANALYZED_SHARE, workers=WORKERS,
+    )
+    print(f"Synthetic database {DB_NAME} loaded. Set DB_NAME={DB_NAME} to run the pipelines, dbt or Streamlit on it.")
+
+
+if __name__ == "__main__":
+    load_synthetic_database()
@@ -1,6 +1,9 @@
 """A source loading player profiles and games from chess.com api"""
 
-from typing import Any, Callable, Dict, Iterator, List, Sequence
+import threading
+from functools import partial
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterator, List, Literal, Sequence
 
 import dlt
 from dlt.common import pendulum
@@ -8,14 +11,31 @@ from dlt.common.typing import TDataItem
 from dlt.sources import DltResource
 from dlt.sources.helpers import requests
 
-from .helpers import get_path_with_retry, get_url_with_retry, validate_month_string
-from .settings import UNOFFICIAL_CHESS_API_URL
+from .helpers import (
+    get_path_with_retry,
+    get_url_if_modified,
+    get_url_with_retry,
+    is_processable_game,
+    iter_concurrently,
+    map_concurrently,
+    stream_url_if_modified,
+    validate_month_string,
+)
+from .settings import ARCHIVE_BATCH_SIZE, OFFICIAL_CHESS_API_URL, UNOFFICIAL_CHESS_API_URL
+
+from datetime import datetime, timezone
 
-from datetime import datetime
+TArchiveMonths = Literal["all", "open", "closed"]
 
 @dlt.source(name="chess")
 def source(
-    players: List[str], start_month: str = None, end_month: str = None
+    players: List[str],
+    start_month: str = None,
+    end_month: str = None,
+    months: TArchiveMonths = "all",
+    players_start_month: Dict[str, str] = None,
+    processable_only: bool = False,
+    time_classes: List[str] = None,
 ) -> Sequence[DltResource]:
     """
     A dlt source for the chess.com api. It groups several resources (in this case chess.com API endpoints) containing
@@ -24,6 +44,13 @@ def source(
         players (List[str]): A list of the player usernames for which to get the data.
         start_month (str, optional): Filters out all the matches happening before `start_month`. Defaults to None.
         end_month (str, optional): Filters out all the matches happening after `end_month`. Defaults to None.
+        months (str, optional): Archives yielded by players_games: "open", "closed" or "all". Defaults to "all".
+        players_start_month (Dict[str, str], optional): `start_month` of specific players (e.g. of their user group),
+            overriding `start_month`. Defaults to None.
+        processable_only (bool, optional): Filters out the games players_games yields which can never be analyzed
+            (see `is_processable_game`). Defaults to False.
+        time_classes (List[str], optional): With `processable_only`, filters out the games of other time classes.
+            Defaults to None.
     Returns:
         Sequence[DltResource]: A sequence of resources that can be selected from including players_profiles,
         players_archives, players_games, players_online_status
@@ -31,7 +58,15 @@ def source(
     return (
         players_profiles(players),
         players_archives(players),
-        players_games(players, start_month=start_month, end_month=end_month),
+        players_games(
+            players,
+            start_month=start_month,
+            end_month=end_month,
+            months=months,
+            players_start_month=players_start_month,
+            processable_only=processable_only,
+            time_classes=time_classes,
+        ),
         players_online_status(players),
     )
 
@@ -70,85 +105,175 @@ def players_archives(players: List[str]) -> Iterator[List[TDataItem]]:
     Yields:
         Iterator[List[TDataItem]]: An iterator over list of player archive data.
     """
-    for username in players:
-        try:
-            data = get_path_with_retry(f"player/{username}/games/archives")
-            yield data.get("archives", [])
-        except requests.HTTPError as http_err:
-            if http_err.response.status_code == 404:
-                print(f"[SKIP] No archives found for user '{username}' (404).")
-                yield []
-            else:
-                raise
+    http_cache = dlt.current.resource_state().setdefault("http_cache", {})
+    # list the archives of all players concurrently (bounded and rate limited like every chess.com request)
+    yield from map_concurrently(partial(_get_archives_list, http_cache=http_cache), players)
+
+
+def _get_archives_list(username: str, http_cache: Dict[str, Any]) -> List[str]:
+    """
+    Returns the archive urls of a player. The list is kept in `http_cache` (resource state) with its ETag/Last-Modified,
+    so that an unchanged list is not downloaded again (304 Not Modified).
+    """
+    url = f"{OFFICIAL_CHESS_API_URL}player/{username}/games/archives"
+    cached = http_cache.setdefault(url, {})
+    try:
+        data = get_url_if_modified(url, cached)
+    except requests.HTTPError as http_err:
+        if http_err.response.status_code == 404:
+            print(f"[SKIP] No archives found for user '{username}' (404).")
+            http_cache.pop(url, None)
+            return []
+        raise
+    if data is not None:
+        cached["archives"] = data.get("archives", [])
+    return cached.get("archives", [])
 
 
 # Updated function for write_disposition="merge". The latest_checked_archive is identified and re-scanned on every run to integrate new games played.
+# Closed months archives never checked before are immutable and new: with months="open" they are only recorded, then
+# yielded by months="closed" so that they can be loaded with a cheap append instead of a merge.
 @dlt.resource(
     write_disposition="merge", primary_key="uuid", columns={"end_time": {"data_type": "timestamp"}}
 )
 def players_games(
-    players: List[str], start_month: str = None, end_month: str = None
-) -> Iterator[Callable[[], List[TDataItem]]]:
+    players: List[str],
+    start_month: str = None,
+    end_month: str = None,
+    months: TArchiveMonths = "all",
+    players_start_month: Dict[str, str] = None,
+    processable_only: bool = False,
+    time_classes: List[str] = None,
+) -> Iterator[List[TDataItem]]:
     """
     Yields `players` games that happened between `start_month` and `end_month`.
+    The archives are downloaded concurrently and parsed as they stream in, in batches of ARCHIVE_BATCH_SIZE games.
     Args:
         players (List[str]): List of player usernames to retrieve games for.
         start_month (str, optional): The starting month in the format "YYYY/MM". Defaults to None.
         end_month (str, optional): The ending month in the format "YYYY/MM". Defaults to None.
+        months (str, optional): "open" yields the archives which can receive new games (latest checked archive and
+            current month) and records the new archives of closed months, "closed" yields the recorded archives of
+            closed months, "all" yields both. Defaults to "all".
+        players_start_month (Dict[str, str], optional): `start_month` of specific players, overriding `start_month`.
+            Defaults to None.
+        processable_only (bool, optional): Filters out the games which can never be analyzed (variants, custom
+            initial setup, no clock times). Defaults to False.
+        time_classes (List[str], optional): With `processable_only`, filters out the games of other time classes.
+            Defaults to None.
     Yields:
-        Iterator[Callable[[], List[TDataItem]]]: An iterator over callables that return a list of games for each player.
-    """  
+        Iterator[List[TDataItem]]: An iterator over batches of games of an archive.
+    """
     
     # do a simple validation to prevent common mistakes in month format
     validate_month_string(start_month)
     validate_month_string(end_month)
+    # archive urls contain the lower case username
+    players_start_month = {username.lower(): month for username, month in (players_start_month or {}).items()}
+    for month in players_start_month.values():
+        validate_month_string(month)
 
     # get a list of already checked archives
     # from your point of view, the state is python dictionary that will have the same content the next time this function is called
     checked_archives = dlt.current.resource_state().setdefault("archives", [])
-    # get player archives, note that you can call the resource like any other function and just iterate it like a list
-    archives = players_archives(players)
+    closed_archives = dlt.current.resource_state().setdefault("closed_archives_to_load", [])
+    http_cache = dlt.current.resource_state().setdefault("http_cache", {})
+    # latest end_time (epoch) loaded per username: the games of re-scanned archives up to it are not yielded again
+    end_time_cursors = dlt.current.resource_state().setdefault("end_time_cursors", {})
+    # the games are filtered against the cursors of the previous run, while the archives of this run update them
+    previous_cursors = dict(end_time_cursors)
+    cursors_lock = threading.Lock()
+    current_month = datetime.now(tz=timezone.utc).strftime("%Y/%m")
 
-    if checked_archives:
-        latest_checked_archive_url = sorted(checked_archives, key=lambda url: url[-7:])[-1]
-        latest_checked_archive = latest_checked_archive_url[-7:]
-        print(f"archive period that will be re-processed: {latest_checked_archive}")
-    else:
-        latest_checked_archive = None
-        
-    # get archives in parallel by decorating the http request with defer
-    @dlt.defer
-    def _get_archive(url: str) -> List[TDataItem]:
+    def _is_new_game(cursor: int | None, url: str, game: TDataItem) -> bool:
+        # older archives (e.g. start_month moved backwards) only contain games before the cursor, all to be loaded
+        if cursor is None or url[-7:] < datetime.fromtimestamp(cursor, tz=timezone.utc).strftime("%Y/%m"):
+            return True
+        return game.get("end_time", 0) > cursor
+
+    def _get_archive(url: str) -> Iterator[List[TDataItem]]:
         print(f"Getting archive from {url}")
+        username = url.split("/")[5] # extract username from url: https://api.chess.com/pub/player/{username}
+        log_timestamp = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        cursor = previous_cursors.get(username)
         try:
-            games = get_url_with_retry(url).get("games", [])
-            username = url.split("/")[5] # extract username from url: https://api.chess.com/pub/player/{username}
-            for game in games:
-                game["username"] = username
-                game["archive_url"] = url
-                game["log_timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            return games  # type: ignore
+            # the archive of the current month is re-scanned: only download it if it changed since the last run
+            validators = http_cache.setdefault(url, {}) if url[-7:] >= current_month else {}
+            games = stream_url_if_modified(url, "games", validators)
+            if games is None:
+                print(f"Archive not modified since the last run: {url}")
+                return
+            max_end_time = 0
+            while batch := list(islice(games, ARCHIVE_BATCH_SIZE)):
+                max_end_time = max([max_end_time] + [game.get("end_time", 0) for game in batch])
+                batch = [
+                    game for game in batch
+                    if _is_new_game(cursor, url, game)
+                    and (not processable_only or is_processable_game(game, time_classes))
+                ]
+                for game in batch:
+                    game["username"] = username
+                    game["archive_url"] = url
+                    game["log_timestamp"] = log_timestamp
+                if batch:
+                    yield batch
+            if max_end_time:
+                with cursors_lock:
+                    end_time_cursors[username] = max(end_time_cursors.get(username) or 0, max_end_time)
         except requests.HTTPError as http_err:
             # sometimes archives are not available and the error seems to be permanent
             if http_err.response.status_code == 404:
-                return []
+                return
             raise
 
+    if months == "closed":
+        # the archives recorded by the previous "open" extraction (the state is only committed if the load succeeds)
+        urls = []
+        while closed_archives:
+            url = closed_archives.pop(0)
+            checked_archives.append(url)
+            urls.append(url)
+        yield from iter_concurrently(_get_archive, urls)
+        return
+
+    # get player archives, skipping the download of the unchanged lists (ETag/Last-Modified kept in the resource state)
+    for url in [url for url in http_cache if not url.endswith("/archives") and url[-7:] < current_month]:
+        del http_cache[url] # closed months are not re-scanned after the month of their last check
+    archives = chain.from_iterable(map_concurrently(partial(_get_archives_list, http_cache=http_cache), players))
+
+    if checked_archives:
+        latest_checked_archive_url = sorted(checked_archives, key=lambda url: url[-7:])[-1]
+        latest_checked_archive = latest_checked_archive_url[-7:]
+        print(f"archive period that will be re-processed: {latest_checked_archive}")
+    else:
+        latest_checked_archive = None
+    checked_urls = set(checked_archives)
+    recorded_closed_urls = set(closed_archives)
+
     # enumerate the archives
+    urls = []
     for url in archives:
         # the `url` format is https://api.chess.com/pub/player/{username}/games/{YYYY}/{MM}
-        if start_month and url[-7:] < start_month:
+        player_start_month = players_start_month.get(url.split("/")[5].lower(), start_month)
+        if player_start_month and url[-7:] < player_start_month:
             continue
         if end_month and url[-7:] > end_month:
             continue
         # do not download archive again, but download the latest one
-        if url in checked_archives and url[-7:] != latest_checked_archive:
+        if url in checked_urls and url[-7:] != latest_checked_archive:
+            continue
+        # new archive of a closed month: left to the "closed" extraction
+        if months == "open" and url not in checked_urls and url[-7:] < current_month and url[-7:] != latest_checked_archive:
+            if url not in recorded_closed_urls:
+                closed_archives.append(url)
+                recorded_closed_urls.add(url)
             continue
         # append the url only if the latest checked archive is not the same or if it's the first archive
         if latest_checked_archive is None or url[-7:] != latest_checked_archive:
             checked_archives.append(url)
-        # get the filtered archive
-        yield _get_archive(url)
+        urls.append(url)
+    # download the filtered archives concurrently, yielding their games as they stream in
+    yield from iter_concurrently(_get_archive, urls)
 
 @dlt.resource(write_disposition="append")
 def players_online_status(players: List[str]) -> Iterator[TDataItem]:
@@ -1,20 +1,287 @@
 """Chess source helpers"""
 
+import codecs
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+import requests
 from dlt.common.typing import StrAny
-from dlt.sources.helpers import requests
+from requests.adapters import HTTPAdapter
 
 from .settings import OFFICIAL_CHESS_API_URL
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+# chess.com serves serial requests without limit but throttles (429) parallel ones, so both are bounded
+MAX_CONCURRENT_REQUESTS = int(os.getenv("CHESS_API_MAX_CONCURRENT_REQUESTS", "4")) # Default: 4 requests in flight
+REQUESTS_PER_SECOND = float(os.getenv("CHESS_API_REQUESTS_PER_SECOND", "10")) # Default: 10 requests per second
+MAX_RETRIES = int(os.getenv("CHESS_API_MAX_RETRIES", "5")) # Default: 5 retries
+BACKOFF_SECONDS = 1.0 # first retry delay, doubled at each attempt
+MAX_BACKOFF_SECONDS = 60.0
+REQUEST_TIMEOUT_SECONDS = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+STANDARD_INITIAL_SETUP = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+STREAM_CHUNK_BYTES = 64 * 1024 # bytes read from the socket at a time by the streaming parser
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity` tokens kept for bursts."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take one token, waiting until one is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _create_session() -> requests.Session:
+    """Session reusing the connections to each host (one pool slot per concurrent request)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "chess_com_bi_pg (https://github.com/gabriellegall/chess_com_bi_pg)"
+    return session
+
+
+_session = _create_session()
+_rate_limiter = TokenBucket(REQUESTS_PER_SECOND)
+_concurrency = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def _retry_after_seconds(response: requests.Response) -> float | None:
+    """Delay requested by the server through the Retry-After header (seconds or HTTP date), if any."""
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter, so that throttled threads do not retry in lockstep."""
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt))
+
+
+def _get_with_retry(url: str, headers: dict | None = None, stream: bool = False) -> requests.Response:
+    """GET a URL within the rate limit and the concurrency pool.
+    429, 5xx and connection errors are retried after the Retry-After delay (if any) or a jittered exponential backoff.
+    Other errors raise requests.HTTPError (e.g. 404 for a missing archive).
+    With `stream`, only the headers are read: the body is left on the socket for the caller.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        _rate_limiter.acquire()
+        try:
+            with _concurrency:
+                response = _session.get(url, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS, stream=stream)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_backoff_seconds(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+            response.close()
+            delay = _retry_after_seconds(response)
+            time.sleep(delay if delay is not None else _backoff_seconds(attempt))
+            continue
+        response.raise_for_status()
+        return response
+
 
 def get_url_with_retry(url: str) -> StrAny:
-    r = requests.get(url)
-    return r.json()  # type: ignore
+    return _get_with_retry(url).json()  # type: ignore
+
+
+def _conditional_headers(validators: dict) -> dict:
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def _update_validators(validators: dict, response: requests.Response) -> None:
+    for key, header in [("etag", "ETag"), ("last_modified", "Last-Modified")]:
+        if response.headers.get(header):
+            validators[key] = response.headers[header]
+        else:
+            validators.pop(key, None)
+
+
+def get_url_if_modified(url: str, validators: dict) -> StrAny | None:
+    """GET a JSON document only if it changed since the response whose ETag/Last-Modified are in `validators`
+    (e.g. kept in the dlt resource state). Returns None if not modified (304), otherwise the document,
+    and updates `validators` in place with the new ETag/Last-Modified.
+    """
+    response = _get_with_retry(url, headers=_conditional_headers(validators))
+    if response.status_code == 304:
+        return None
+    _update_validators(validators, response)
+    return response.json()  # type: ignore
+
+
+def iter_json_array(chunks: Iterable[str], key: str) -> Iterator[Any]:
+    """Yield the objects of the array `key` of a JSON document (e.g. the games of {"games": [...]}) as its text
+    chunks come in: only the object being parsed and the current chunk are held in memory.
+    The array items must be objects or arrays (a number split across chunks could be read as complete).
+    """
+    decoder = json.JSONDecoder()
+    array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    separators = re.compile(r"[\s,]*")
+    chunks = iter(chunks)
+    buffer = ""
+    while True:
+        match = array_start.search(buffer)
+        if match:
+            position = match.end()
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            return # no such array
+        buffer += chunk
+
+    while True:
+        position = separators.match(buffer, position).end()
+        if buffer.startswith("]", position):
+            return
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError("Incomplete item", buffer, position)
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # the item continues in the next chunk
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+def _iter_text(response: requests.Response) -> Iterator[str]:
+    """Text chunks of a streamed response body, decoded incrementally (a UTF-8 character may span two chunks)."""
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+    finally:
+        response.close()
+
+
+def stream_url_if_modified(url: str, key: str, validators: dict) -> Iterator[Any] | None:
+    """Like get_url_if_modified, but returns an iterator over the items of the array `key` of the document,
+    parsed as the response body streams in (see iter_json_array) instead of loading the whole document.
+    """
+    response = _get_with_retry(url, headers=_conditional_headers(validators), stream=True)
+    if response.status_code == 304:
+        response.close()
+        return None
+    _update_validators(validators, response)
+    return iter_json_array(_iter_text(response), key)
 
 
 def get_path_with_retry(path: str) -> StrAny:
     return get_url_with_retry(f"{OFFICIAL_CHESS_API_URL}{path}")
 
 
+def map_concurrently(function: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+    """Apply `function` to the items in a pool of MAX_CONCURRENT_REQUESTS threads, yielding the results in order."""
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        yield from executor.map(function, items)
+
+
+def iter_concurrently(function: Callable[[T], Iterable[R]], items: Iterable[T], max_pending: int | None = None) -> Iterator[R]:
+    """Run the generators `function(item)` in a pool of MAX_CONCURRENT_REQUESTS threads, yielding their outputs as
+    they are produced (in no particular order). The threads wait while `max_pending` outputs (default: one per thread)
+    are not consumed, so that the outputs held in memory are bounded by the concurrency rather than by the items.
+    The first error of a generator is raised and stops the others.
+    """
+    outputs = queue.Queue(maxsize=max_pending or MAX_CONCURRENT_REQUESTS)
+    stopped = threading.Event()
+    done = object()
+
+    def _put(output) -> bool:
+        while not stopped.is_set():
+            try:
+                outputs.put(output, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(item: T) -> None:
+        if stopped.is_set():
+            return
+        try:
+            for output in function(item):
+                if not _put((None, output)):
+                    return
+        except BaseException as error:
+            _put((error, None))
+
+    def _run_all() -> None:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            list(executor.map(_run, items))
+        _put((None, done))
+
+    threading.Thread(target=_run_all, daemon=True).start()
+    try:
+        while True:
+            error, output = outputs.get()
+            if error is not None:
+                raise error
+            if output is done:
+                return
+            yield output
+    finally:
+        stopped.set()
+
+
+def is_processable_game(game: StrAny, time_classes: Iterable[str] | None = None) -> bool:
+    """Python counterpart of `processable_games_condition` (dbt_project.yml), checked against it by the tests:
+    standard chess from the initial position, with clock times in the PGN. With `time_classes` (`data_scope`), the
+    time class must be one of them.
+    """
+    return (
+        game.get("rules") == "chess"
+        and "[%clk " in (game.get("pgn") or "")
+        and game.get("initial_setup") in ("", STANDARD_INITIAL_SETUP)
+        and (time_classes is None or game.get("time_class") in time_classes)
+    )
+
+
 def validate_month_string(string: str) -> None:
     """Validates that the string is in YYYY/MM format"""
     if string and string[4] != "/":
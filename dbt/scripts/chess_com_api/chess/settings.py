@@ -1,4 +1,11 @@
 """Chess source settings and constants"""
 
-OFFICIAL_CHESS_API_URL = "https://api.chess.com/pub/"
+import os
+
+# Can be pointed to a local stand-in of the API (e.g. scripts/benchmark/fake_chess_api.py)
+OFFICIAL_CHESS_API_URL = os.getenv("OFFICIAL_CHESS_API_URL", "https://api.chess.com/pub/")
 UNOFFICIAL_CHESS_API_URL = "https://www.chess.com/callback/"
+
+# Games yielded at a time by players_games while an archive streams in: the games held in memory are bounded by
+# the number of concurrent requests times this batch size, whatever the size of the archives
+ARCHIVE_BATCH_SIZE = int(os.getenv("CHESS_API_ARCHIVE_BATCH_SIZE", "500")) # Default: 500 games
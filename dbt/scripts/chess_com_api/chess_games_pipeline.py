@@ -1,35 +1,186 @@
 import dlt
 from chess import source
 from dotenv import load_dotenv
+import hashlib
+import json
 import os
+import subprocess
 import sys
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import inspect, text
 
 sys.path.append(os.path.abspath('..'))
 from helper import (
     load_config,
+    load_dbt_project,
     get_engine,
     get_table_settings,
+    get_table_user_groups,
     create_index_if_not_exists,
+    set_run_state,
+    write_stage_report,
 )
 
 load_dotenv()
 config = load_config()
 
-def _run_pipeline_for_group(pipeline, users, start_month):
-    """Runs the DLT pipeline for a specific group of users."""
-    data = source(
-        users,
-        start_month=start_month,
-    )
-    info = pipeline.run(
-        data.with_resources("players_games"),
-        write_disposition="merge",
-        primary_key=["uuid", "username"]
-    )
-    print(info)
+NORMALIZE_WORKERS = int(os.getenv("DLT_NORMALIZE_WORKERS", "1")) # Default: 1 normalize process
+LOAD_WORKERS = int(os.getenv("DLT_LOAD_WORKERS", "20")) # Default: 20 load threads (dlt default)
+# Load files: "csv" is loaded with COPY, "insert_values" (dlt default) with INSERT statements,
+# "parquet" requires the adbc-driver-postgresql package (dlt falls back to insert_values without it)
+LOADER_FILE_FORMAT = os.getenv("DLT_LOADER_FILE_FORMAT", "csv") # Default: csv
+# Rows per load file: a big backfill is split into several files, loaded in parallel by the load threads
+FILE_MAX_ITEMS = int(os.getenv("DLT_FILE_MAX_ITEMS", "5000")) # Default: 5000 rows per file
+os.environ.setdefault("DATA_WRITER__FILE_MAX_ITEMS", str(FILE_MAX_ITEMS))
+# Only land the games within `processable_games_condition` of dbt_project.yml (variants, custom setups and games
+# without clock times can never be analyzed, whatever the dbt vars)
+SCOPE_FILTER = os.getenv("CHESS_API_SCOPE_FILTER", "true").lower() == "true" # Default: True
+# Also drop the games outside the `data_scope` time classes. Irreversible: the archives already checked are never
+# downloaded again, so the games dropped are not backfilled if `data_scope` is widened later
+TIME_CLASS_FILTER = os.getenv("CHESS_API_TIME_CLASS_FILTER", "false").lower() == "true" # Default: False
+# Users split across CHESS_API_SHARDS parallel processes, each with its own dlt state
+SHARDS = int(os.getenv("CHESS_API_SHARDS", "1")) # Default: 1, no sharding
+SHARD = os.getenv("CHESS_API_SHARD") # Set by run_pipeline for the process of each shard
+# Key of the Postgres advisory lock serializing the dlt schema migrations of the shards
+SCHEMA_MIGRATION_LOCK_KEY = 4624137
+
+def _get_players_start_month(user_groups):
+    """Maps each username of all user groups to the `start_month` of its group.
+    A username in several groups gets the earliest one (None: no limit)."""
+    players_start_month = {}
+    for group_config in user_groups.values():
+        start_month = group_config.get("start_month")
+        for username in group_config.get("usernames") or []:
+            if username not in players_start_month:
+                players_start_month[username] = start_month
+            elif players_start_month[username] is not None:
+                players_start_month[username] = None if start_month is None else min(players_start_month[username], start_month)
+    return players_start_month
+
+def _get_user_groups(engine):
+    """User groups of config.yml, plus the users of the `api.users_table`."""
+    user_groups = dict(config.get("api", {}).get("user_groups") or {})
+    if config.get("api", {}).get("users_table"):
+        user_groups.update(get_table_user_groups(engine, config["api"]["users_table"]))
+    if os.getenv("CHESS_API_USERNAMES"): # e.g. the ingestion benchmark: comma-separated usernames replacing the groups
+        user_groups = {"CHESS_API_USERNAMES": {"usernames": os.getenv("CHESS_API_USERNAMES").split(",")}}
+    return user_groups
+
+def _record_landed_users(engine, players_start_month):
+    """Records the users (and start months) whose games were landed, in `orchestration.run_state`.
+    The history of a new user is older than the [end_time] watermarks of the incremental models: the orchestrator
+    backfills the users added since its previous build and purges the users removed (see DbtBuilder), i.e. only
+    once their games are landed."""
+    set_run_state(engine, "chess_com_landed_users", json.dumps(players_start_month, sort_keys=True))
+
+def _get_shard(username, shards):
+    """Stable shard of a username: the same in every process and run (unlike the salted built-in hash)."""
+    return int(hashlib.md5(username.lower().encode("utf-8")).hexdigest(), 16) % shards
+
+def _has_games_state(pipeline):
+    """Whether the pipeline state knows checked archives (not the case for a new shard pipeline)."""
+    resources = (pipeline.state.get("sources") or {}).get("chess", {}).get("resources", {})
+    return bool(resources.get("players_games", {}).get("archives"))
+
+@contextmanager
+def _schema_migration_lock(engine):
+    """Postgres advisory lock held while a shard creates or migrates the shared dlt tables ([players_games] and the
+    `_dlt_*` tables): the shards extract in parallel, but their CREATE / ALTER TABLE statements would race."""
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_MIGRATION_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_MIGRATION_LOCK_KEY})
+
+def _run_pipeline(pipeline, engine, players_start_month, append_closed=True):
+    """Runs the DLT pipeline for all users at once: their archives are fetched concurrently in a single extract.
+    The re-scanned archives (latest checked and current month) may contain games already loaded and are merged.
+    The new archives of closed months are immutable and are appended, without staging nor delete-insert, unless
+    `append_closed` is False (they may have been loaded already under another state, e.g. with other shards).
+    The destination schema is synced under `_schema_migration_lock` before each load (see SHARDS).
+    Returns the ids of the loads of this run.
+    """
+    load_ids = []
+    time_classes = load_dbt_project()["vars"]["data_scope"]["time_class"] if SCOPE_FILTER and TIME_CLASS_FILTER else None
+    for months, write_disposition in [("open", "merge"), ("closed", "append" if append_closed else "merge")]:
+        data = source(
+            list(players_start_month),
+            months=months,
+            players_start_month=players_start_month,
+            processable_only=SCOPE_FILTER,
+            time_classes=time_classes,
+        )
+        pipeline.extract(
+            data.with_resources("players_games"),
+            write_disposition=write_disposition,
+            primary_key=["uuid", "username"],
+            loader_file_format=LOADER_FILE_FORMAT,
+        )
+        pipeline.normalize(workers=NORMALIZE_WORKERS)
+        if pipeline.has_pending_data:
+            with _schema_migration_lock(engine):
+                pipeline.sync_schema() # the load then finds the schema version stored and skips the migration
+        info = pipeline.load(workers=LOAD_WORKERS)
+        print(info)
+        load_ids.extend(info.loads_ids)
+    return load_ids
+
+def _get_end_time_watermark(engine, schema_name, table_name):
+    """Returns the latest [end_time] loaded, or None if the table does not exist yet."""
+    if not inspect(engine).has_table(table_name, schema=schema_name):
+        return None
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT MAX(end_time) FROM "{schema_name}"."{table_name}"')).scalar()
+
+def _count_new_games(engine, schema_name, table_name, load_ids):
+    """Counts the games landed by the loads of this run ([_dlt_load_id]), whatever their [end_time] (e.g. the
+    backfill of a new user). Only the games newer than the cursor of each player are yielded from the re-scanned
+    archives, so the games already loaded are not counted again.
+    """
+    if not load_ids or not inspect(engine).has_table(table_name, schema=schema_name):
+        return 0
+    query = f'SELECT COUNT(*) FROM "{schema_name}"."{table_name}" WHERE _dlt_load_id = ANY(:load_ids)'
+    with engine.connect() as conn:
+        return conn.execute(text(query), {"load_ids": list(load_ids)}).scalar()
+
+def _run_shards(shards):
+    """Runs the pipeline of each shard in its own process, in parallel, and returns the number of new games landed."""
+    processes = []
+    for shard in range(shards):
+        fd, report_path = tempfile.mkstemp(prefix=f"stage_report_chess_com_api_shard_{shard}_", suffix=".json")
+        os.close(fd)
+        env = {**os.environ, "CHESS_API_SHARD": str(shard), "STAGE_REPORT_PATH": report_path}
+        processes.append((subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env), report_path))
+
+    new_games = 0
+    failed_shards = []
+    for shard, (process, report_path) in enumerate(processes):
+        if process.wait() != 0:
+            failed_shards.append(shard)
+        with open(report_path, "r") as f:
+            content = f.read()
+        os.remove(report_path)
+        new_games += json.loads(content)["rows"] if content else 0
+    if failed_shards:
+        raise RuntimeError(f"chess.com API ingestion failed for shards {failed_shards} of {shards}")
+    return new_games
 
 def run_pipeline():
-    """Initializes and runs the DLT pipeline for all user groups defined in config."""
+    """Initializes and runs the DLT pipeline for all user groups defined in config (and the `api.users_table`).
+    With CHESS_API_SHARDS > 1, the users are split across as many processes, each running the pipeline of its shard.
+    """
+    if SHARDS > 1 and SHARD is None:
+        print(f"Running pipeline in {SHARDS} shards")
+        new_games = _run_shards(SHARDS)
+        print(f"{new_games} new games landed by {SHARDS} shards.")
+        engine = get_engine()
+        _record_landed_users(engine, _get_players_start_month(_get_user_groups(engine)))
+        write_stage_report("chess_com_api", rows=new_games)
+        return
+    shard = int(SHARD) if SHARDS > 1 else None
+
     credentials = {
         "database":        os.getenv("DB_NAME"),
         "username":        os.getenv("DB_USER"),
@@ -39,23 +190,50 @@ def run_pipeline():
         "connect_timeout": 15
     }
 
+    if shard is None:
+        pipeline_name, destination = "chess_games_pipeline", dlt.destinations.postgres(credentials=credentials)
+    else:
+        # own state per shard, and own staging dataset so that the merges of the shards do not collide
+        pipeline_name = f"chess_games_pipeline_shard_{shard}_of_{SHARDS}"
+        destination = dlt.destinations.postgres(
+            credentials=credentials, staging_dataset_name_layout=f"%s_staging_shard_{shard}"
+        )
     pipeline = dlt.pipeline(
-        pipeline_name="chess_games_pipeline",
-        destination=dlt.destinations.postgres(credentials=credentials),
+        pipeline_name=pipeline_name,
+        destination=destination,
         dataset_name=config["postgres"]["schemas"]["chess_com_api"],
     )
 
-    user_groups = config.get("api", {}).get("user_groups", {})
-    for group_name, group_config in user_groups.items():
-        users = group_config.get("usernames")
-        start_month = group_config.get("start_month")
-        if users:
-            print(f"Running pipeline for group: {group_name}")
-            _run_pipeline_for_group(pipeline, users, start_month)
-
     schema_name = config["postgres"]["schemas"]["chess_com_api"]
     table_name, index_field = get_table_settings(config, "chess_com_api")
-    create_index_if_not_exists(get_engine(), schema_name, table_name, index_field)
+    engine = get_engine()
+    watermark = _get_end_time_watermark(engine, schema_name, table_name)
+
+    user_groups = _get_user_groups(engine)
+    players_start_month = _get_players_start_month(user_groups)
+    if shard is not None:
+        players_start_month = {
+            username: month for username, month in players_start_month.items() if _get_shard(username, SHARDS) == shard
+        }
+    if players_start_month:
+        print(f"Running pipeline for {len(players_start_month)} users of groups: {', '.join(user_groups)}"
+              + ("" if shard is None else f" (shard {shard} of {SHARDS})"))
+        # games already landed without state for them (e.g. the number of shards changed): merge everything once
+        append_closed = watermark is None or _has_games_state(pipeline)
+        if not append_closed:
+            print("No archives checked yet by this pipeline while games are loaded: the closed archives are merged")
+        load_ids = _run_pipeline(pipeline, engine, players_start_month, append_closed=append_closed)
+    else:
+        load_ids = []
+
+    create_index_if_not_exists(engine, schema_name, table_name, index_field)
+    create_index_if_not_exists(engine, schema_name, table_name, "_dlt_load_id")
+
+    new_games = _count_new_games(engine, schema_name, table_name, load_ids)
+    print(f"{new_games} new games landed in `{schema_name}.{table_name}`.")
+    if shard is None: # recorded by the parent process once all shards succeeded
+        _record_landed_users(engine, players_start_month)
+    write_stage_report("chess_com_api", rows=new_games)
 
 if __name__ == "__main__":
     run_pipeline()
\ No newline at end of file
@@ -7,7 +7,8 @@ from sqlalchemy import text
 from sqlalchemy.types import DateTime
 
 sys.path.append(os.path.abspath('..'))
-from helper import get_engine, games_to_process, load_config, get_table_settings, create_index_if_not_exists
+from helper import get_engine, games_to_process, load_config, get_table_settings, create_index_if_not_exists, write_stage_report
+from openings.games_openings import classify_games, get_opening_classifier
 
 print("Starting games times processing")
 
@@ -33,6 +34,14 @@ query   = games_to_process(engine, schema=target_schema, table=target_table, lim
 games   = pd.read_sql(query, engine)
 print(f"Query executed successfully — {len(games)} rows fetched.")
 
+# Openings of the games whose clock times are processed below (the history is classified by the openings stage).
+# The times of a game are only written once it is classified: its stats never reach the marts without its openings.
+classifier = get_opening_classifier(engine)
+if classifier is None:
+    print("Clock times not processed until the openings are loaded.")
+    games = games.head(0)
+openings_rows = classify_games(engine, classifier, games)
+
 if not games.empty:
     games = games[['uuid', 'pgn']]
     games['move_data'] = games['pgn'].apply(_extract_move_data)
@@ -57,5 +66,7 @@ if not games.empty:
     create_index_if_not_exists(engine, target_schema, target_table, target_index_field)
 
     print(f"Inserted {len(games_expanded)} rows into `{target_schema}.{target_table}`.")
+    write_stage_report("games_times", rows=len(games_expanded) + openings_rows, games=len(games))
 else:
-    print("No rows to be inserted.")
\ No newline at end of file
+    print("No rows to be inserted.")
+    write_stage_report("games_times", rows=openings_rows, games=0)
\ No newline at end of file
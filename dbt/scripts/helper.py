@@ -1,12 +1,19 @@
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.engine import Engine
+import io
 import os
+import pandas as pd
 from dotenv import load_dotenv
 import yaml
 import hashlib
+import json
 import re
+import threading
 
 IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Orchestration tables already created by this process, per database (see _create_table_once)
+_created_tables = set()
+_created_tables_lock = threading.Lock()
 
 def get_engine() -> Engine:
 
@@ -91,6 +98,138 @@ def create_index_if_not_exists(engine: Engine, schema_name: str, table_name: str
     with engine.begin() as conn:
         conn.execute(query)
 
+def get_table_user_groups(engine: Engine, users_table: str) -> dict:
+    """User groups (like `api.user_groups` of config.yml) of the users listed in a table: "schema.table" with a
+    [username] column and an optional [start_month] column ("YYYY/MM"), one group per start_month."""
+    schema_name, _, table_name = users_table.partition(".")
+    schema_name = _validate_identifier(schema_name, "schema")
+    table_name = _validate_identifier(table_name, "table")
+
+    columns = {column["name"] for column in inspect(engine).get_columns(table_name, schema=schema_name)}
+    start_month = "start_month" if "start_month" in columns else "NULL"
+    query = text(f'SELECT username, {start_month} FROM "{schema_name}"."{table_name}" WHERE username IS NOT NULL')
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+
+    user_groups = {}
+    for username, month in rows:
+        group_name = users_table if month is None else f"{users_table} ({month})"
+        user_groups.setdefault(group_name, {"usernames": [], "start_month": month})["usernames"].append(username)
+    return user_groups
+
+def copy_dataframe(
+    engine: Engine, df: pd.DataFrame, schema_name: str, table_name: str, dtype: dict | None = None, replace: bool = False
+) -> None:
+    """Bulk-load a DataFrame with COPY, creating the schema and the table like pandas `to_sql` does if needed.
+    With `replace`, the rows of the table are truncated in the same transaction (the table itself is kept, as dbt
+    views may depend on it)."""
+    schema_name = _validate_identifier(schema_name, "schema")
+    table_name = _validate_identifier(table_name, "table")
+
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
+    df.head(0).to_sql(name=table_name, con=engine, schema=schema_name, if_exists="append", index=False, dtype=dtype)
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            if replace:
+                cursor.execute(f'TRUNCATE TABLE "{schema_name}"."{table_name}"')
+            cursor.copy_expert(f'COPY "{schema_name}"."{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+def write_stage_report(stage: str, rows: int, **details) -> None:
+    """Report the number of rows landed by a pipeline stage to the orchestrator.
+
+    `run_all.py` passes the report location through the STAGE_REPORT_PATH environment variable.
+    When a pipeline script is executed on its own, the variable is not set and nothing is written.
+    """
+    report_path = os.getenv("STAGE_REPORT_PATH")
+    if not report_path:
+        return
+
+    with open(report_path, "w") as f:
+        json.dump({"stage": stage, "rows": rows, **details}, f)
+
+def _create_table_once(
+    engine: Engine, schema_name: str, table_name: str, columns: str, index_field: str | None = None
+) -> str:
+    """Create an orchestration table (with its schema and index) on its first use by the process, and return its
+    qualified name. The following calls skip the DDL: the orchestration state is read and written on every stage."""
+    table = f'"{schema_name}"."{table_name}"'
+    key = (engine.url.render_as_string(hide_password=True), table)
+    with _created_tables_lock:
+        if key not in _created_tables:
+            with engine.begin() as conn:
+                conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
+                conn.execute(text(f'CREATE TABLE IF NOT EXISTS {table} ({columns})'))
+            create_index_if_not_exists(engine, schema_name, table_name, index_field)
+            _created_tables.add(key)
+    return table
+
+
+def _get_run_state_table(engine: Engine) -> str:
+    config = load_config()
+    schema_name = _validate_identifier(config["postgres"]["schemas"]["orchestration"], "schema")
+    table_name, _ = get_table_settings(config, "orchestration")
+    table_name = _validate_identifier(table_name, "table")
+    return _create_table_once(
+        engine, schema_name, table_name, "key TEXT PRIMARY KEY, value TEXT, updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP"
+    )
+
+
+def get_run_state(engine: Engine, key: str) -> str | None:
+    """Read a value persisted by the orchestrator (e.g. the last dbt logic hash). Returns None if never set."""
+    table = _get_run_state_table(engine)
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT value FROM {table} WHERE key = :key"), {"key": key}).scalar()
+
+
+def set_run_state(engine: Engine, key: str, value: str) -> None:
+    """Persist an orchestrator value, so that it survives container restarts and redeployments."""
+    table = _get_run_state_table(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"INSERT INTO {table} (key, value, updated_at) VALUES (:key, :value, CURRENT_TIMESTAMP) "
+                f"ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at"
+            ),
+            {"key": key, "value": value},
+        )
+
+
+def _get_stage_metrics_table(engine: Engine) -> str:
+    config = load_config()
+    schema_name = _validate_identifier(config["postgres"]["schemas"]["orchestration"], "schema")
+    table_name, index_field = get_table_settings(config, "orchestration_metrics")
+    table_name = _validate_identifier(table_name, "table")
+    return _create_table_once(
+        engine, schema_name, table_name,
+        "stage TEXT, started_at TIMESTAMPTZ, duration_seconds DOUBLE PRECISION, "
+        "rows_in BIGINT, rows_out BIGINT, status TEXT, details JSONB",
+        index_field,
+    )
+
+
+def record_stage_metric(engine: Engine, metric: dict) -> None:
+    """Append the metrics of one orchestrator stage execution (see scripts/orchestration/metrics.py)."""
+    table = _get_stage_metrics_table(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"INSERT INTO {table} (stage, started_at, duration_seconds, rows_in, rows_out, status, details) "
+                f"VALUES (:stage, :started_at, :duration_seconds, :rows_in, :rows_out, :status, CAST(:details AS JSONB))"
+            ),
+            {**metric, "details": json.dumps(metric["details"], default=str)},
+        )
+
+
 def table_with_prefix_exists(engine: Engine, schema_name: str, table_prefix: str) -> bool:
 
     inspector = inspect(engine)
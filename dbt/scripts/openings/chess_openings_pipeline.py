@@ -1,62 +1,127 @@
 import sys
 import os
+import hashlib
 import pandas as pd
 from datetime import datetime
-from sqlalchemy import text, inspect
+from dotenv import load_dotenv
+from huggingface_hub import hf_hub_download
+from sqlalchemy import inspect, text
 
 sys.path.append(os.path.abspath('..'))
-from helper import get_engine, load_config, get_table_settings, create_index_if_not_exists
+from helper import get_engine, load_config, get_table_settings, create_index_if_not_exists, copy_dataframe, get_run_state, set_run_state
+from openings.games_openings import get_opening_classifier, reclassify_all_games
+from openings.opening_hierarchy import HIERARCHY_DTYPE, add_hierarchy_columns
 
-print("Starting chess openings data loading")
+load_dotenv()
 
-config = load_config()
+OPENINGS_REPO_ID = "Lichess/chess-openings"
+OPENINGS_FILENAME = "data/train-00000-of-00001.parquet"
+# Local copy of the Hugging Face parquet (a volume in docker-compose.yml, so that it survives container restarts)
+CACHE_DIR = os.getenv("OPENINGS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")) # Default: scripts/openings/cache
+OFFLINE = os.getenv("OPENINGS_OFFLINE", "false").lower() == "true" # Default: False, the cache is refreshed if Hugging Face changed
 
-target_schema   = config["postgres"]["schemas"]["openings"]
-target_table, target_index_field = get_table_settings(config, "openings")
+def _get_parquet_path() -> str:
+    """Local path of the openings parquet. Hugging Face is only asked whether the file changed (ETag): it is downloaded
+    again only if so. Offline, or if Hugging Face cannot be reached, the cached file is used."""
+    if not OFFLINE:
+        try:
+            return hf_hub_download(OPENINGS_REPO_ID, OPENINGS_FILENAME, repo_type="dataset", local_dir=CACHE_DIR)
+        except Exception as e:
+            print(f"Could not refresh the openings parquet from Hugging Face ({e}), using the cached file")
+    return hf_hub_download(
+        OPENINGS_REPO_ID, OPENINGS_FILENAME, repo_type="dataset", local_dir=CACHE_DIR, local_files_only=True
+    )
+
+def _get_content_hash(path: str) -> str:
+    """SHA-256 of the parquet, cached next to it (`.sha256`) and recomputed only if the file changed."""
+    hash_path = f"{path}.sha256"
+    if os.path.isfile(hash_path) and os.path.getmtime(hash_path) >= os.path.getmtime(path):
+        with open(hash_path, "r") as f:
+            return f.read().strip()
+    with open(path, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    with open(hash_path, "w") as f:
+        f.write(content_hash)
+    return content_hash
 
-# Data Read
-try:
-    # Read the Parquet file directly from the Hugging Face dataset URL
-    print("Reading data from Parquet file on Hugging Face...")
-    df = pd.read_parquet("hf://datasets/Lichess/chess-openings/data/train-00000-of-00001.parquet")
-    print(f"Data fetched successfully — {len(df)} rows loaded.")
-except Exception as e:
-    print(f"Error reading Parquet file: {e}")
-    sys.exit(1)
+def _get_loaded_hash(engine, schema_name: str, table_name: str) -> str | None:
+    """Hash of the parquet the table was loaded from, kept on its rows with their hierarchy (None if not loaded)."""
+    if not inspect(engine).has_table(table_name, schema=schema_name):
+        return None
+    if "openings_sha256" not in {column["name"] for column in inspect(engine).get_columns(table_name, schema=schema_name)}:
+        return None
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT MAX(openings_sha256) FROM "{schema_name}"."{table_name}"')).scalar()
 
-# Data Load
-if not df.empty:
+def _add_hierarchy_columns_if_missing(engine, schema_name: str, table_name: str) -> None:
+    """Add the hierarchy columns to a table created before they existed (the dbt views depend on the table)."""
+    if not inspect(engine).has_table(table_name, schema=schema_name):
+        return
+    with engine.begin() as conn:
+        for column, column_type in HIERARCHY_DTYPE.items():
+            conn.execute(text(
+                f'ALTER TABLE "{schema_name}"."{table_name}" '
+                f'ADD COLUMN IF NOT EXISTS "{column}" {column_type.compile(dialect=engine.dialect)}'
+            ))
+
+def _load_openings(engine, parquet_path: str, content_hash: str, schema_name: str, table_name: str) -> None:
+    """Replaces the openings with those of the Parquet file, with their hierarchy and the hash of the file."""
+    df = pd.read_parquet(parquet_path)
+    print(f"Data read successfully — {len(df)} rows (sha256 {content_hash[:12]}).")
+    if df.empty:
+        print("No rows were loaded from the Parquet file.")
+        return
 
     df["log_timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     df = df.drop(columns=['img'], errors='ignore') # Drop 'img' column which contains incompatible data type
-    engine = get_engine()
+    # Openings hierarchy (prefix tree of the [uci] moves), only computed here when the dataset changes
+    df = add_hierarchy_columns(df, content_hash)
 
-    inspector = inspect(engine)
-    if not inspector.has_table(target_table, schema=target_schema):
-        try:
-            # Create the schema if it doesn't exist
-            with engine.begin() as conn:
-                conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {target_schema}"))
-                print(f"Schema '{target_schema}' ensured to exist.")
+    # Replace the rows (with the hash of the loaded file) with COPY in a single transaction
+    _add_hierarchy_columns_if_missing(engine, schema_name, table_name)
+    copy_dataframe(engine, df, schema_name, table_name, dtype=HIERARCHY_DTYPE, replace=True)
+    print(f"Inserted {len(df)} rows into `{schema_name}.{table_name}`.")
 
-            df.to_sql(
-                name        = target_table,
-                con         = engine,
-                schema      = target_schema,    
-                if_exists   = 'replace', # Overwrite the table if it exists
-                index       = False # Ignore the df index
-            )
+def run_pipeline():
+    """Loads the openings dataset if it changed, then classifies all the games against it if they were classified
+    against another one. This stage runs before any dbt build (run_all.py), and the hash of the dataset is only
+    recorded once all the games are classified: the full refresh it triggers never sees games without openings."""
+    print("Starting chess openings data loading")
 
-            print(f"Inserted {len(df)} rows into `{target_schema}.{target_table}`.")
+    config = load_config()
+    target_schema   = config["postgres"]["schemas"]["openings"]
+    target_table, target_index_field = get_table_settings(config, "openings")
 
-        except Exception as e:
-            print(f"Database operation failed: {e}")
-            sys.exit(1)
-    else:
-        print(f"Table {target_table} already exists. Moving on...")
+    # Data Read
+    try:
+        parquet_path = _get_parquet_path()
+        content_hash = _get_content_hash(parquet_path)
+    except Exception as e:
+        print(f"Error getting the openings Parquet file: {e}")
+        sys.exit(1)
+
+    engine = get_engine()
+    try:
+        if _get_loaded_hash(engine, target_schema, target_table) == content_hash:
+            print(f"Table {target_table} already loaded from this Parquet file (sha256 {content_hash[:12]}). Moving on...")
+        else:
+            _load_openings(engine, parquet_path, content_hash, target_schema, target_table)
+        create_index_if_not_exists(engine, target_schema, target_table, target_index_field)
+
+        # Games classified against another dataset (or an interrupted classification): classify them all again
+        if get_run_state(engine, "openings_sha256") != content_hash:
+            classifier = get_opening_classifier(engine)
+            if classifier is not None:
+                print("Classifying all the games against the openings dataset")
+                print(f"{reclassify_all_games(engine, classifier)} games classified.")
+                # the orchestrator runs a full refresh when the openings change (see FULL_REFRESH_STATE_KEYS)
+                set_run_state(engine, "openings_sha256", content_hash)
+
+    except Exception as e:
+        print(f"Database operation failed: {e}")
+        sys.exit(1)
 
-    create_index_if_not_exists(engine, target_schema, target_table, target_index_field)
-else:
-    print("No rows were loaded from the Parquet file.")
+    print("Finished chess openings data loading")
 
-print("Finished chess openings data loading")
\ No newline at end of file
+if __name__ == "__main__":
+    run_pipeline()
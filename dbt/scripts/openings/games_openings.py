@@ -0,0 +1,96 @@
+"""Openings of the games (`games_openings` table of config.yml), classified at ingestion with opening_classifier.py:
+- by chess_games_times_pipeline.py, for the games whose clock times it processes (before writing their times);
+- by chess_openings_pipeline.py, for all the games when a new openings dataset is loaded (before any dbt build).
+"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import BigInteger, DateTime
+
+from helper import (
+    copy_dataframe,
+    create_index_if_not_exists,
+    get_processable_games_condition,
+    get_table_settings,
+    load_config,
+    load_dbt_project,
+)
+from .opening_classifier import OpeningClassifier, format_opening_ids
+
+GAMES_OPENINGS_DTYPE = {"opening_ids": ARRAY(BigInteger), "log_timestamp": DateTime(timezone=True)}
+# Games classified and copied at a time when all the games are classified again
+RECLASSIFY_BATCH_SIZE = 10000
+
+
+def _get_games_openings_table(config: dict) -> tuple[str, str, str | None]:
+    table_name, index_field = get_table_settings(config, "games_openings")
+    return config["postgres"]["schemas"]["games_openings"], table_name, index_field
+
+
+def get_opening_classifier(engine) -> OpeningClassifier | None:
+    """OpeningClassifier of the openings loaded by chess_openings_pipeline.py (None if not loaded yet)."""
+    config = load_config()
+    openings_schema = config["postgres"]["schemas"]["openings"]
+    openings_table, _ = get_table_settings(config, "openings")
+    if not inspect(engine).has_table(openings_table, schema=openings_schema):
+        print(f"No openings in `{openings_schema}.{openings_table}` yet: games openings cannot be classified.")
+        return None
+    openings = pd.read_sql(f'SELECT uci, epd FROM "{openings_schema}"."{openings_table}"', engine)
+    depth = load_dbt_project()["vars"]["openings"]["hierarchy_depth"]
+    return OpeningClassifier(list(zip(openings["uci"], openings["epd"])), depth=depth)
+
+
+def classify_games(engine, classifier: OpeningClassifier, games: pd.DataFrame) -> int:
+    """Labels the `games` (uuid, pgn) not classified yet with their opening ids and returns their number."""
+    target_schema, target_table, target_index_field = _get_games_openings_table(load_config())
+    if games.empty:
+        return 0
+    if inspect(engine).has_table(target_table, schema=target_schema):
+        with engine.connect() as conn:
+            classified = set(conn.execute(
+                text(f'SELECT uuid FROM "{target_schema}"."{target_table}" WHERE uuid = ANY(:uuids)'),
+                {"uuids": list(games["uuid"])},
+            ).scalars())
+        games = games[~games["uuid"].isin(classified)]
+        if games.empty:
+            return 0
+
+    games_openings = pd.DataFrame({
+        "uuid": games["uuid"],
+        "opening_ids": [format_opening_ids(classifier.classify(pgn)) for pgn in games["pgn"]],
+        "log_timestamp": datetime.now(tz=timezone.utc),
+    })
+    copy_dataframe(engine, games_openings, target_schema, target_table, dtype=GAMES_OPENINGS_DTYPE)
+    create_index_if_not_exists(engine, target_schema, target_table, target_index_field)
+    create_index_if_not_exists(engine, target_schema, target_table, "uuid")
+    print(f"Inserted {len(games_openings)} rows into `{target_schema}.{target_table}`.")
+    return len(games_openings)
+
+
+def reclassify_all_games(engine, classifier: OpeningClassifier) -> int:
+    """Replaces the openings of all the processable games, classified against the openings of `classifier`, and
+    returns their number. The games are read in a single streamed scan (no anti-join) and copied in batches."""
+    config = load_config()
+    target_schema, target_table, _ = _get_games_openings_table(config)
+    games_schema = config["postgres"]["schemas"]["chess_com_api"]
+    games_table, _ = get_table_settings(config, "chess_com_api")
+    if not inspect(engine).has_table(games_table, schema=games_schema):
+        return 0
+
+    if inspect(engine).has_table(target_table, schema=target_schema):
+        with engine.begin() as conn:
+            conn.execute(text(f'TRUNCATE TABLE "{target_schema}"."{target_table}"'))
+    query = f"""
+        SELECT game.uuid, MAX(game.pgn) AS pgn
+        FROM "{games_schema}"."{games_table}" game
+        WHERE {get_processable_games_condition().replace("%", "%%")}
+        GROUP BY game.uuid
+    """
+    classified = 0
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for games in pd.read_sql(query, conn, chunksize=RECLASSIFY_BATCH_SIZE):
+            classified += classify_games(engine, classifier, games)
+    return classified
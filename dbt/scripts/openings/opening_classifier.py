@@ -0,0 +1,60 @@
+"""Position-based opening classifier, applied to the games at ingestion (chess_games_times_pipeline.py).
+
+The openings reference (Lichess chess-openings dataset) is indexed by the EPD of its final position, and each game
+is labelled in a single replay of its first plies: after each ply, the opening of the position reached (if any)
+becomes the opening of the game. Transpositions are therefore recognised, unlike with a match on the moves.
+"""
+
+import hashlib
+import re
+
+import chess
+
+PGN_HEADER_RE = re.compile(r"^\[.*\]\s*$", re.MULTILINE)
+PGN_COMMENT_RE = re.compile(r"\{[^}]*\}")
+PGN_MOVE_NUMBER_RE = re.compile(r"\d+\.+")
+PGN_RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+
+def opening_id(uci: str) -> int:
+    """Compact and stable id of an opening: the first 60 bits of the MD5 of its [uci] moves (fits in a BIGINT).
+    Only computed in Python: the openings and the games are both labelled with it at ingestion."""
+    return int(hashlib.md5(uci.encode("utf-8")).hexdigest()[:15], 16)
+
+
+def san_moves(pgn: str) -> list[str]:
+    """SAN moves of the mainline of a chess.com PGN (headers, clock comments, move numbers and result removed)."""
+    movetext = PGN_COMMENT_RE.sub(" ", PGN_HEADER_RE.sub("", pgn))
+    return [token for token in PGN_MOVE_NUMBER_RE.sub(" ", movetext).split() if token not in PGN_RESULTS]
+
+
+def format_opening_ids(opening_ids: list[int | None]) -> str:
+    """Postgres array literal of opening ids, e.g. to COPY them into a BIGINT[] column."""
+    return "{" + ",".join("NULL" if i is None else str(i) for i in opening_ids) + "}"
+
+
+class OpeningClassifier:
+    """Labels games with the openings of the positions reached in their first `depth` plies."""
+
+    def __init__(self, openings: list[tuple[str, str]], depth: int):
+        """`openings`: (uci, epd) of the openings. When several openings reach the same position, the one with the
+        fewest moves (then the first uci) is kept."""
+        self.depth = depth
+        self.positions = {}
+        for uci, epd in sorted(openings, key=lambda opening: (len(opening[0].split()), opening[0]), reverse=True):
+            self.positions[epd] = opening_id(uci)
+
+    def classify(self, pgn: str) -> list[int | None]:
+        """Opening id after each of the first `depth` plies: the latest opening position reached so far (None before
+        the first one). A game shorter than `depth` plies (or with an unreadable move) keeps its last opening."""
+        board = chess.Board()
+        opening_ids = []
+        current_id = None
+        for san in san_moves(pgn)[:self.depth]:
+            try:
+                board.push_san(san)
+            except ValueError:
+                break
+            current_id = self.positions.get(board.epd(), current_id)
+            opening_ids.append(current_id)
+        return opening_ids + [current_id] * (self.depth - len(opening_ids))
@@ -0,0 +1,51 @@
+"""Openings hierarchy, computed by the openings pipeline when the openings dataset changes (see int_openings_hierarchy).
+
+The openings are indexed by their [uci] moves, which makes a prefix tree: the parents of an opening are the openings
+whose moves are a prefix of its moves.
+"""
+
+import pandas as pd
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import BigInteger, Integer, Text
+
+from .opening_classifier import opening_id
+
+# Types of the hierarchy columns added to the raw openings table
+HIERARCHY_DTYPE = {
+    "opening_id": BigInteger(),
+    "uci_moves_depth": Integer(),
+    "uci_hierarchy_level_names": ARRAY(Text),
+    "openings_sha256": Text(),
+}
+
+
+def hierarchy_level_names(openings: dict[str, str]) -> dict[str, list[str | None]]:
+    """Names of the hierarchy levels of each opening ([uci] -> name): the i-th name is the name of the deepest opening
+    among the first i moves (None if there is none), the last one being the name of the opening itself."""
+    hierarchy = {}
+    for uci in openings:
+        moves = uci.split(" ")
+        level_names = []
+        current_name = None
+        for depth in range(1, len(moves) + 1):
+            current_name = openings.get(" ".join(moves[:depth]), current_name)
+            level_names.append(current_name)
+        hierarchy[uci] = level_names
+    return hierarchy
+
+
+def _format_text_array(values: list[str | None]) -> str:
+    """Postgres array literal of texts, e.g. to COPY them into a TEXT[] column."""
+    elements = ["NULL" if not isinstance(value, str) else '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"' for value in values]
+    return "{" + ",".join(elements) + "}"
+
+
+def add_hierarchy_columns(openings: pd.DataFrame, content_hash: str) -> pd.DataFrame:
+    """Openings with their hierarchy columns (HIERARCHY_DTYPE) and the hash of the dataset they were computed from."""
+    hierarchy = hierarchy_level_names(dict(zip(openings["uci"], openings["name"])))
+    return openings.assign(
+        opening_id=openings["uci"].map(opening_id),
+        uci_moves_depth=openings["uci"].map(lambda uci: len(uci.split(" "))),
+        uci_hierarchy_level_names=openings["uci"].map(lambda uci: _format_text_array(hierarchy[uci])),
+        openings_sha256=content_hash,
+    )
@@ -0,0 +1,349 @@
+"""dbt steps of the orchestrator: change-aware seed, blue/green full refresh, scope retention and selective runs"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import date
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from scripts.helper import get_run_state, set_run_state, load_dbt_project
+from scripts.orchestration.dbt_invoke import DbtInvoker, hash_paths
+from scripts.orchestration.freshness import record_games_freshness, setup_games_freshness
+from scripts.orchestration.metrics import StageMetrics
+
+SEEDS_DIR = "seeds"
+# Models whose new rows (log_timestamp) are checked by the incremental dbt tests (var `test_since`)
+TESTS_WATERMARK_MODELS = ["int_game_moves_base", "int_game_move_times_base"]
+SHADOW_SCHEMA_SUFFIX = "__shadow"
+
+# Any change in those files can alter the content of the models and requires a --full-refresh. scripts/config.yml is
+# not read by dbt (ingestion tuning, schedules...): the users it lists are backfilled or purged incrementally
+DBT_LOGIC_PATHS = ["models", "macros", "dbt_project.yml", "package-lock.yml"]
+# Hashes recorded in orchestration.run_state by the ingestion pipelines, whose changes also require a --full-refresh
+# - openings_sha256: openings dataset, against which all the games are classified again (int_games_openings)
+FULL_REFRESH_STATE_KEYS = ["openings_sha256"]
+
+# dbt selectors impacted by each change-aware stage
+STAGE_SELECTORS = {
+    "chess_com_api": "source:chess_com+",
+    "games_times":   "source:times+",
+    "stockfish":     "source:stockfish+",
+    "seeds":         "username_mapping+",
+}
+
+# Build tiers: the single place defining which models are rebuilt on every build and which on a slower schedule.
+# Each tier is rebuilt at most every `interval_env` seconds (environment variable, `default_interval` if not set).
+# - hot: lineage of obt_games_stats_filtered, the table read by the Streamlit dashboard.
+# - slow: all other models, i.e. the heavy per-ply facts (fct_game_moves) and the Metabase-only marts.
+DBT_TIERS = {
+    "hot": {
+        "select": "+obt_games_stats_filtered",
+        "exclude": [],
+        "interval_env": "DBT_HOT_TIER_INTERVAL",
+        "default_interval": 0,
+    },
+    "slow": {
+        "select": "fqn:*",
+        "exclude": ["+obt_games_stats_filtered"],
+        "interval_env": "DBT_SLOW_TIER_INTERVAL",
+        "default_interval": 3600,
+    },
+}
+
+
+def changed_selectors(stage_rows: dict) -> list[str]:
+    """Selectors of the stages that landed rows. A stage reporting None is considered as changed."""
+    return [
+        STAGE_SELECTORS[stage]
+        for stage, rows in stage_rows.items()
+        if stage in STAGE_SELECTORS and (rows is None or rows > 0)
+    ]
+
+
+def tier_run_args(tier: dict, selectors: list[str]) -> list[str]:
+    """dbt run arguments building the models of a tier which are downstream of the changed sources (intersection)."""
+    return [
+        "--select", *[f"{selector},{tier['select']}" for selector in selectors],
+        "--exclude", "dbt_project_evaluator", *tier["exclude"],
+    ]
+
+
+def get_logic_hash(engine: Engine) -> str:
+    """Hash of everything whose change requires a --full-refresh: the dbt logic files and FULL_REFRESH_STATE_KEYS."""
+    digest = hashlib.sha256(hash_paths(DBT_LOGIC_PATHS).encode("utf-8"))
+    for key in FULL_REFRESH_STATE_KEYS:
+        digest.update(f"{key}={get_run_state(engine, key) or ''}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_games_scope_start(engine: Engine) -> str:
+    """First day of the sliding games scope window, computed like the `games_scope_start_date` dbt macro."""
+    month_history_depth = int(load_dbt_project()["vars"]["data_scope"]["month_history_depth"])
+    query = text("SELECT DATE_TRUNC('MONTH', CURRENT_DATE - MAKE_INTERVAL(months => :depth))::date")
+    with engine.connect() as conn:
+        return conn.execute(query, {"depth": month_history_depth}).scalar().isoformat()
+
+
+def get_landed_users(engine: Engine) -> dict | None:
+    """Users (and start months) whose games were landed by the chess.com pipeline (None if it never ran)."""
+    landed_users = get_run_state(engine, "chess_com_landed_users")
+    return None if landed_users is None else json.loads(landed_users)
+
+
+def get_backfill_usernames(landed_users: dict | None, built_users: dict | None) -> list[str]:
+    """Users (lower case) landed since the warehouse was built, or with another start month (e.g. an older history).
+    Their history is older than the [end_time] watermarks: it is backfilled by the next builds (var
+    `backfill_usernames`). Nothing to backfill until both are known (the first build is a full refresh)."""
+    if landed_users is None or built_users is None:
+        return []
+    built_start_months = {username.lower(): start_month for username, start_month in built_users.items()}
+    return sorted({
+        username.lower()
+        for username, start_month in landed_users.items()
+        if username.lower() not in built_start_months or built_start_months[username.lower()] != start_month
+    })
+
+
+def get_removed_usernames(engine: Engine, landed_users: dict | None) -> list[str]:
+    """Users whose games are in the warehouse (int_players_base) while they are no longer landed, e.g. removed from
+    config.yml or from the `api.users_table`. Also catches the users brought back by a full refresh, whose games stay
+    in the raw tables."""
+    if landed_users is None:
+        return []
+    dbt_project = load_dbt_project()
+    int_schema = dbt_project["models"][dbt_project["name"]]["intermediate"]["+schema"]
+    if not inspect(engine).has_table("int_players_base", schema=int_schema):
+        return []
+    with engine.connect() as conn:
+        built_usernames = conn.execute(text(f'SELECT username FROM "{int_schema}".int_players_base')).scalars().all()
+    landed_usernames = {username.lower() for username in landed_users}
+    return sorted({username.lower() for username in built_usernames} - landed_usernames)
+
+
+def get_tests_watermarks(engine: Engine) -> dict[str, str]:
+    """Latest log_timestamp of each model of TESTS_WATERMARK_MODELS built in the warehouse (models still empty omitted).
+    Incremental dbt tests check the rows of each model loaded after its own watermark of the last passing test run:
+    the models can be built at different times (tiers, workers), with rows older than the latest ones of the other.
+    Taking the watermarks from the tested tables (rather than the wall clock) ensures that rows landed but not yet
+    built are tested later.
+    """
+    dbt_project = load_dbt_project()
+    int_schema = dbt_project["models"][dbt_project["name"]]["intermediate"]["+schema"]
+    watermarks = {}
+    with engine.connect() as conn:
+        for model in TESTS_WATERMARK_MODELS:
+            watermark = conn.execute(text(f'SELECT MAX(log_timestamp) FROM "{int_schema}".{model}')).scalar()
+            if watermark is not None:
+                watermarks[model] = watermark.isoformat()
+    return watermarks
+
+
+def run_blue_green_full_refresh(dbt: DbtInvoker) -> None:
+    """Full refresh built in shadow schemas, then swapped with the live schemas in a single transaction.
+    Dashboards keep reading the previous (complete) tables for the whole duration of the build.
+    """
+    shadow_args = json.dumps({"suffix": SHADOW_SCHEMA_SUFFIX})
+    dbt.invoke(["run-operation", "drop_shadow_schemas", "--args", shadow_args])
+    dbt.invoke(
+        ["run", "--full-refresh", "--exclude", "dbt_project_evaluator"],
+        dbt_vars={"shadow_schema_suffix": SHADOW_SCHEMA_SUFFIX},
+    )
+    dbt.invoke(["run-operation", "swap_shadow_schemas", "--args", shadow_args])
+
+
+class DbtBuilder:
+    """Runs the dbt build of one orchestrator iteration, given the rows landed by each stage since the previous build.
+
+    - dbt seed only runs when the content hash of the seed files changed.
+    - A blue/green full refresh only runs when the dbt logic hash (get_logic_hash) changed, or periodically if configured.
+    - Games which fell out of the sliding scope window are purged whenever the window moves, and the games of the
+      users no longer landed by the chess.com pipeline as soon as they are removed.
+    - The history of the users landed since the previous build is backfilled (var `backfill_usernames`), in each tier.
+    - Otherwise, dbt run is restricted to the models downstream of the changed sources, and skipped if nothing changed.
+      Each tier of DBT_TIERS is built at its own interval; the changed sources accumulate until the tier is due.
+      The first build of the process is never restricted, to catch up with rows landed before a restart.
+    All dbt commands run in-process through a DbtInvoker, which keeps the parsed manifest between builds.
+    After each build, the end-to-end freshness of the games which became visible in the dashboard is recorded.
+    """
+
+    def __init__(self, engine: Engine, metrics: StageMetrics, full_refresh_interval_days: int = 0):
+        self.engine = engine
+        self.metrics = metrics
+        self.dbt = DbtInvoker(metrics)
+        self.full_refresh_interval_days = full_refresh_interval_days
+        self.last_seeds_hash = None
+        self.initial_build_done = False
+        self.tier_intervals = {
+            name: int(os.getenv(tier["interval_env"], str(tier["default_interval"])))
+            for name, tier in DBT_TIERS.items()
+        }
+        self.tier_pending_selectors = {name: [] for name in DBT_TIERS}
+        self.tier_pending_backfill = {name: set() for name in DBT_TIERS}
+        self.tier_last_run = {name: None for name in DBT_TIERS}
+        # Users queued for a backfill in the tiers since the users built were last recorded
+        self.backfill_queued = set()
+        self._setup_games_freshness()
+
+    def build(self, stage_rows: dict) -> None:
+        stage_rows = dict(stage_rows)
+
+        # DBT seed - only when the seed files changed
+        seeds_hash = hash_paths([SEEDS_DIR])
+        if seeds_hash != self.last_seeds_hash:
+            self.dbt.invoke(["seed"])
+            self.last_seeds_hash = seeds_hash
+            stage_rows["seeds"] = None
+        else:
+            print("Skipping dbt seed (seed files unchanged)")
+
+        # DBT run
+        landed_users = get_landed_users(self.engine)
+        backfill_usernames = []
+        full_refresh_reason = self._full_refresh_reason()
+        if full_refresh_reason:
+            print(f"Running dbt full-refresh build in shadow schemas ({full_refresh_reason})")
+            logic_hash = get_logic_hash(self.engine)
+            games_scope_start = get_games_scope_start(self.engine)
+            run_blue_green_full_refresh(self.dbt)
+            set_run_state(self.engine, "dbt_logic_hash", logic_hash)
+            set_run_state(self.engine, "games_scope_start", games_scope_start)
+            set_run_state(self.engine, "last_full_refresh_date", date.today().isoformat())
+            self._mark_tiers_built()
+        else:
+            built_users = get_run_state(self.engine, "dbt_built_users")
+            backfill_usernames = [
+                username
+                for username in get_backfill_usernames(landed_users, built_users and json.loads(built_users))
+                if username not in self.backfill_queued
+            ]
+            if backfill_usernames:
+                print(f"Backfilling the games of the users landed since the previous build: {', '.join(backfill_usernames)}")
+                stage_rows["chess_com_api"] = None
+            self._run_incremental(changed_selectors(stage_rows), backfill_usernames)
+        self._apply_scope_retention(landed_users)
+
+        # the history of the users queued may become visible in this build, whatever the tier backfilling it
+        backfilled_usernames = sorted(self.backfill_queued)
+        # users built once no tier waits for their backfill anymore
+        if landed_users is not None and not any(self.tier_pending_backfill.values()):
+            set_run_state(self.engine, "dbt_built_users", json.dumps(landed_users, sort_keys=True))
+            self.backfill_queued = set()
+
+        self.initial_build_done = True
+        self._record_games_freshness(
+            full_refresh=full_refresh_reason is not None, backfilled_usernames=backfilled_usernames
+        )
+
+    def _setup_games_freshness(self) -> None:
+        """Once per process: the freshness table, view and recording start (best effort, like the recording)."""
+        try:
+            setup_games_freshness(self.engine)
+        except Exception as e:
+            print(f"Could not set up the games freshness: {e}")
+
+    def _record_games_freshness(self, full_refresh: bool, backfilled_usernames: list[str]) -> None:
+        """Best effort, like the stage metrics: a freshness failure never stops the pipeline."""
+        try:
+            with self.metrics.measure("games_freshness") as metric:
+                metric["rows_out"] = record_games_freshness(
+                    self.engine, full_refresh=full_refresh, backfilled_usernames=backfilled_usernames
+                )
+        except Exception as e:
+            print(f"Could not record the games freshness: {e}")
+
+    def test(self, full: bool = False) -> bool:
+        """Run the dbt tests and return whether they passed.
+
+        - full: all tests, on all rows (full sweep).
+        - incremental: only the tests tagged `incremental`, restricted to the rows of each model loaded since the last
+          passing test run (var `test_since`, one watermark per model). Falls back to a full sweep if no test ever passed.
+        """
+        watermarks = get_tests_watermarks(self.engine)
+        tests_since = None if full else get_run_state(self.engine, "dbt_tests_watermarks")
+        if tests_since is None:
+            print("Running dbt test (full sweep)")
+            passed = self.dbt.invoke(["test", "--exclude", "dbt_project_evaluator"], check=False)
+        else:
+            print(f"Running incremental dbt test on rows loaded since {tests_since}")
+            passed = self.dbt.invoke(
+                ["test", "--select", "tag:incremental", "--exclude", "dbt_project_evaluator"],
+                dbt_vars={"test_since": json.loads(tests_since)},
+                vars_affect_parsing=False,
+                check=False,
+            )
+
+        if passed:
+            set_run_state(self.engine, "dbt_tests_watermarks", json.dumps(watermarks))
+        return passed
+
+    def _full_refresh_reason(self) -> str | None:
+        if get_logic_hash(self.engine) != get_run_state(self.engine, "dbt_logic_hash"):
+            return "dbt logic, vars or openings changed"
+
+        if self.full_refresh_interval_days > 0:
+            last_full_refresh_date = get_run_state(self.engine, "last_full_refresh_date")
+            if (
+                last_full_refresh_date is None
+                or (date.today() - date.fromisoformat(last_full_refresh_date)).days >= self.full_refresh_interval_days
+            ):
+                return f"periodic full-refresh every {self.full_refresh_interval_days} days"
+
+        return None
+
+    def _apply_scope_retention(self, landed_users: dict | None) -> None:
+        """Purge the games which fell out of the sliding window (once per window move, i.e. once per month), and the
+        games of the users no longer landed."""
+        games_scope_start = get_games_scope_start(self.engine)
+        removed_usernames = get_removed_usernames(self.engine, landed_users)
+        if games_scope_start != get_run_state(self.engine, "games_scope_start"):
+            print(f"Games scope window moved to {games_scope_start}: purging out-of-scope games")
+        elif removed_usernames:
+            print(f"Purging the games of the users no longer landed: {', '.join(removed_usernames)}")
+        else:
+            return
+        retention_args = json.dumps({"removed_usernames": removed_usernames})
+        self.dbt.invoke(["run-operation", "apply_games_scope_retention", "--args", retention_args])
+        set_run_state(self.engine, "games_scope_start", games_scope_start)
+
+    def _mark_tiers_built(self) -> None:
+        for name in DBT_TIERS:
+            self.tier_pending_selectors[name] = []
+            self.tier_pending_backfill[name] = set()
+            self.tier_last_run[name] = time.monotonic()
+
+    def _run_incremental(self, selectors: list[str], backfill_usernames: list[str]) -> None:
+        self.backfill_queued.update(backfill_usernames)
+        if not self.initial_build_done:
+            print("Running regular dbt build (first build of the process)")
+            self.dbt.invoke(
+                ["run", "--exclude", "dbt_project_evaluator"],
+                dbt_vars={"backfill_usernames": backfill_usernames} if backfill_usernames else None,
+                vars_affect_parsing=False,
+            )
+            self._mark_tiers_built()
+            return
+
+        for name, tier in DBT_TIERS.items():
+            pending = self.tier_pending_selectors[name]
+            pending.extend(selector for selector in selectors if selector not in pending)
+            pending_backfill = self.tier_pending_backfill[name]
+            pending_backfill.update(backfill_usernames)
+
+            last_run = self.tier_last_run[name]
+            if last_run is not None and time.monotonic() - last_run < self.tier_intervals[name]:
+                print(f"Skipping dbt {name} tier (built less than {self.tier_intervals[name]}s ago)")
+            elif pending:
+                print(f"Running regular dbt build of the {name} tier on changed sources: {' '.join(pending)}")
+                self.dbt.invoke(
+                    ["run", *tier_run_args(tier, pending)],
+                    dbt_vars={"backfill_usernames": sorted(pending_backfill)} if pending_backfill else None,
+                    vars_affect_parsing=False,
+                )
+                self.tier_pending_selectors[name] = []
+                self.tier_pending_backfill[name] = set()
+                self.tier_last_run[name] = time.monotonic()
+            else:
+                print(f"Skipping dbt {name} tier (no new rows landed since its previous build)")
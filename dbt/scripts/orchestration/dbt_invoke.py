@@ -0,0 +1,102 @@
+"""In-process dbt invocations, reusing the parsed manifest across the iterations of the orchestrator"""
+
+import hashlib
+import json
+import os
+
+from dbt.cli.main import dbtRunner, dbtRunnerResult
+
+from scripts.orchestration.metrics import StageMetrics
+
+# Any change in those files changes the manifest and requires a new parse
+DBT_PROJECT_PATHS = [
+    "models", "macros", "seeds", "snapshots", "tests", "analyses",
+    "dbt_project.yml", "packages.yml", "package-lock.yml", "profiles.yml", "dbt_packages",
+]
+
+
+def hash_paths(paths: list[str]) -> str:
+    """Content hash of a list of files and directories (walked recursively, in a stable order)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+            )
+        elif os.path.isfile(path):
+            files.append(path)
+
+    digest = hashlib.sha256()
+    for file_path in sorted(files):
+        digest.update(file_path.replace(os.sep, "/").encode("utf-8"))
+        with open(file_path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def rows_affected(result: dbtRunnerResult) -> int | None:
+    """Total rows affected by the nodes of a dbt command (e.g. rows inserted by incremental models), if reported."""
+    node_results = getattr(result.result, "results", None)
+    if not node_results:
+        return None
+    rows = [
+        node_result.adapter_response.get("rows_affected")
+        for node_result in node_results
+        if node_result.adapter_response
+    ]
+    rows = [row for row in rows if row is not None]
+    return sum(rows) if rows else None
+
+
+class DbtInvoker:
+    """Runs dbt commands through the dbt Python runner in the current (long-lived) process.
+
+    The project is parsed once, and the resulting manifest is handed to every following command, which saves
+    the interpreter startup, adapter load and project parsing of a `dbt` CLI call. The project is parsed again
+    (partial parsing) only when the content hash of the project files changed.
+    Commands overriding `--vars` are parsed on their own, as vars can change the manifest (e.g. schema names),
+    unless the vars are only used when compiling the nodes (`vars_affect_parsing=False`).
+    Each command (and parse) is recorded in the stage metrics as `dbt <command>`.
+    """
+
+    def __init__(self, metrics: StageMetrics):
+        self.metrics = metrics
+        self.manifest = None
+        self.project_hash = None
+
+    def _get_manifest(self):
+        project_hash = hash_paths(DBT_PROJECT_PATHS)
+        if self.manifest is None or project_hash != self.project_hash:
+            print("Parsing dbt project (project files changed)" if self.manifest else "Parsing dbt project")
+            with self.metrics.measure("dbt parse"):
+                result = dbtRunner().invoke(["parse"])
+                if not result.success:
+                    raise RuntimeError("dbt parse failed") from result.exception
+            self.manifest = result.result
+            self.project_hash = project_hash
+        return self.manifest
+
+    def invoke(
+        self, args: list[str], dbt_vars: dict | None = None, vars_affect_parsing: bool = True, check: bool = True
+    ) -> bool:
+        """Run a dbt command (e.g. ["run", "--select", "..."]) and return whether it succeeded.
+        Raises a RuntimeError on failure when `check` is True, like `subprocess.run(..., check=True)`.
+        """
+        if dbt_vars:
+            args = [*args, "--vars", json.dumps(dbt_vars)]
+
+        if dbt_vars and vars_affect_parsing:
+            runner = dbtRunner()
+        else:
+            runner = dbtRunner(manifest=self._get_manifest())
+
+        with self.metrics.measure(f"dbt {args[0]}") as metric:
+            result = runner.invoke(args)
+            metric["rows_out"] = rows_affected(result)
+            metric["details"] = {"args": args}
+            metric["status"] = "success" if result.success else "failed"
+            if check and not result.success:
+                raise RuntimeError(f"dbt {' '.join(args)} failed") from result.exception
+        return result.success
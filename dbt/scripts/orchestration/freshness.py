@@ -0,0 +1,175 @@
+"""End-to-end freshness of the games: latency from the game end on chess.com until the game is visible in the dashboard"""
+
+import json
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from scripts.helper import get_run_state, set_run_state, get_table_settings, get_table_user_groups, load_config, load_dbt_project
+
+# Latency percentiles are computed on the games which became visible during this period
+PERCENTILES_PERIOD = "7 days"
+
+
+def _get_games_freshness_table() -> str:
+    config = load_config()
+    schema_name = config["postgres"]["schemas"]["orchestration"]
+    table_name, _ = get_table_settings(config, "orchestration_freshness")
+    return f'"{schema_name}"."{table_name}"'
+
+
+def setup_games_freshness(engine: Engine) -> None:
+    """Create the freshness table and its percentiles view, and set the start of the recording
+    (`games_freshness_since`) if not set yet. Run once per process, before the first record_games_freshness."""
+    config = load_config()
+    schema_name = config["postgres"]["schemas"]["orchestration"]
+    table_name, index_field = get_table_settings(config, "orchestration_freshness")
+    table = _get_games_freshness_table()
+
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            f'uuid TEXT, username TEXT, user_group TEXT, end_time TIMESTAMPTZ, '
+            f'api_timestamp TIMESTAMPTZ, times_timestamp TIMESTAMPTZ, stockfish_timestamp TIMESTAMPTZ, '
+            f'mart_timestamp TIMESTAMPTZ, PRIMARY KEY (uuid, username))'
+        ))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{index_field}" ON {table} ("{index_field}")'))
+        conn.execute(text(
+            f'CREATE OR REPLACE VIEW "{schema_name}"."{table_name}_percentiles" AS '
+            f'SELECT user_group, milestone, COUNT(*) AS nb_games, '
+            f'PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY latency_seconds) AS p50_seconds, '
+            f'PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY latency_seconds) AS p90_seconds, '
+            f'PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY latency_seconds) AS p99_seconds '
+            f'FROM ('
+            f'SELECT f.user_group, m.milestone, EXTRACT(EPOCH FROM m.milestone_timestamp - f.end_time) AS latency_seconds '
+            f'FROM {table} f '
+            f'CROSS JOIN LATERAL (VALUES '
+            f"('1-chess_com_api', f.api_timestamp), ('2-games_times', f.times_timestamp), "
+            f"('3-stockfish', f.stockfish_timestamp), ('4-mart', f.mart_timestamp)"
+            f') AS m (milestone, milestone_timestamp) '
+            f"WHERE f.mart_timestamp >= CURRENT_TIMESTAMP - INTERVAL '{PERCENTILES_PERIOD}' "
+            f'AND m.milestone_timestamp IS NOT NULL'
+            f') latencies '
+            f'GROUP BY user_group, milestone'
+        ))
+
+    if get_run_state(engine, "games_freshness_since") is None:
+        with engine.begin() as conn:
+            since = conn.execute(text("SELECT CURRENT_TIMESTAMP")).scalar().isoformat()
+            # games recorded before: their api_timestamp may be a local [log_timestamp], so their latencies are dropped
+            conn.execute(text(
+                f"UPDATE {table} SET api_timestamp = NULL, times_timestamp = NULL, stockfish_timestamp = NULL, "
+                f"mart_timestamp = NULL"
+            ))
+        set_run_state(engine, "games_freshness_since", since)
+
+
+def _get_user_groups(engine: Engine) -> dict:
+    """Mapping username (lower case) -> user group, from the chess.com API config.
+    The users of `api.users_table` which are in no group of config.yml get the table name as group."""
+    api_config = load_config().get("api", {})
+    user_groups = api_config.get("user_groups") or {}
+    mapping = {}
+    if api_config.get("users_table"):
+        for group_config in get_table_user_groups(engine, api_config["users_table"]).values():
+            mapping.update({username.lower(): api_config["users_table"] for username in group_config["usernames"]})
+    mapping.update({
+        username.lower(): group_name
+        for group_name, group_config in user_groups.items()
+        for username in group_config.get("usernames", [])
+    })
+    return mapping
+
+
+def record_games_freshness(engine: Engine, full_refresh: bool = False, backfilled_usernames: list[str] = ()) -> int:
+    """Record the timestamps of the games which became visible in obt_games_stats_filtered since the previous call.
+
+    For each game: end time on chess.com, load by the chess.com API pipeline, clock times parsing, Stockfish analysis
+    and visibility in the mart (i.e. the end of the dbt build which inserted it). Games are recorded once: the
+    blue/green full refreshes rebuild the marts but do not change the recorded timestamps.
+    Games are only marked as seen (without timestamps) when their latency is unknown or meaningless:
+    - on the first call, for the games already in the mart;
+    - after a full refresh (`full_refresh`), which makes visible games of any age at once;
+    - for the users whose history is being backfilled (`backfilled_usernames`, lower case), for the same reason;
+    - for the games loaded by the chess.com API before the recording started (`games_freshness_since`), whose
+      [log_timestamp] may not be in UTC.
+    The table must have been created by setup_games_freshness. Returns the number of games recorded with timestamps.
+    """
+    table = _get_games_freshness_table()
+    dbt_project = load_dbt_project()
+    models_config = dbt_project["models"][dbt_project["name"]]
+    int_schema = models_config["intermediate"]["+schema"]
+    marts_schema = models_config["marts"]["+schema"]
+
+    watermark = get_run_state(engine, "games_freshness_watermark")
+    since = get_run_state(engine, "games_freshness_since")
+    query = text(f"""
+        WITH new_games AS (
+            SELECT d.uuid, d.username, d.end_time, d.log_timestamp AS api_timestamp
+            FROM "{marts_schema}".obt_games_stats_filtered o
+            INNER JOIN "{marts_schema}".dim_games d
+                ON d.games_sk = o.games_sk
+            WHERE
+                o.run_timestamp > CAST(:watermark AS TIMESTAMPTZ)
+                AND NOT EXISTS (SELECT 1 FROM {table} f WHERE f.uuid = d.uuid AND f.username = d.username)
+        )
+        , times AS (
+            SELECT t.uuid, MAX(t.log_timestamp) AS times_timestamp
+            FROM "{int_schema}".int_game_move_times_base t
+            WHERE t.log_timestamp >= (SELECT MIN(end_time) FROM new_games)
+                AND t.uuid IN (SELECT uuid FROM new_games)
+            GROUP BY t.uuid
+        )
+        , moves AS (
+            SELECT m.uuid, MAX(m.log_timestamp) AS stockfish_timestamp
+            FROM "{int_schema}".int_game_moves_base m
+            WHERE m.log_timestamp >= (SELECT MIN(end_time) FROM new_games)
+                AND m.uuid IN (SELECT uuid FROM new_games)
+            GROUP BY m.uuid
+        )
+        INSERT INTO {table} (
+            uuid, username, user_group, end_time, api_timestamp, times_timestamp, stockfish_timestamp, mart_timestamp
+        )
+        SELECT
+            n.uuid,
+            n.username,
+            ug.user_group,
+            n.end_time,
+            CASE WHEN recorded.with_timestamps THEN n.api_timestamp END,
+            CASE WHEN recorded.with_timestamps THEN times.times_timestamp END,
+            CASE WHEN recorded.with_timestamps THEN moves.stockfish_timestamp END,
+            CASE WHEN recorded.with_timestamps THEN CURRENT_TIMESTAMP END
+        FROM new_games n
+        LEFT JOIN times USING (uuid)
+        LEFT JOIN moves USING (uuid)
+        LEFT JOIN JSONB_EACH_TEXT(CAST(:user_groups AS JSONB)) AS ug (username, user_group)
+            ON ug.username = LOWER(n.username)
+        CROSS JOIN LATERAL (
+            SELECT
+                :with_timestamps
+                AND n.api_timestamp >= CAST(:since AS TIMESTAMPTZ)
+                AND NOT LOWER(n.username) = ANY(CAST(:backfilled_usernames AS TEXT[])) AS with_timestamps
+        ) recorded
+        ON CONFLICT (uuid, username) DO NOTHING
+        RETURNING (api_timestamp IS NOT NULL) AS with_timestamps
+    """)
+
+    with engine.begin() as conn:
+        new_watermark = conn.execute(
+            text(f'SELECT MAX(run_timestamp) FROM "{marts_schema}".obt_games_stats_filtered')
+        ).scalar()
+        recorded = conn.execute(
+            query,
+            {
+                "watermark": watermark or "-infinity",
+                "with_timestamps": watermark is not None and not full_refresh,
+                "since": since,
+                "backfilled_usernames": list(backfilled_usernames),
+                "user_groups": json.dumps(_get_user_groups(engine)),
+            },
+        ).scalars().all()
+
+    if new_watermark is not None:
+        set_run_state(engine, "games_freshness_watermark", new_watermark.isoformat())
+    return sum(recorded)
@@ -0,0 +1,66 @@
+"""Per-stage metrics of the orchestrator: duration, rows in/out and exit status of every stage and dbt command"""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import requests
+from sqlalchemy.engine import Engine
+
+from scripts.helper import record_stage_metric
+
+
+class StageMetrics:
+    """Measures each stage and appends one row per execution to the stage metrics table (orchestration.stage_metrics).
+
+    Stages lasting more than `slow_stage_seconds` (0: disabled) raise an alert: a warning is printed and,
+    if `alert_url` is set (e.g. a Healthchecks.io ping URL followed by /log), the message is posted to it.
+    Recording is best effort: a metrics failure never stops the pipeline.
+    """
+
+    def __init__(self, engine: Engine, slow_stage_seconds: float = 0, alert_url: str | None = None):
+        self.engine = engine
+        self.slow_stage_seconds = slow_stage_seconds
+        self.alert_url = alert_url
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Measure the enclosed block. The yielded dict can be filled with `rows_in`, `rows_out`, `details`
+        and `status` (default: "success", or "failed" if the block raises an exception)."""
+        metric = {"rows_in": None, "rows_out": None, "details": {}}
+        started_at = datetime.now(timezone.utc)
+        start = time.monotonic()
+        status = "failed"
+        try:
+            yield metric
+            status = metric.get("status", "success")
+        finally:
+            self._record({
+                **metric,
+                "stage": stage,
+                "started_at": started_at,
+                "duration_seconds": round(time.monotonic() - start, 3),
+                "status": status,
+            })
+
+    def _record(self, metric: dict) -> None:
+        print(
+            f"Stage '{metric['stage']}': {metric['status']} in {metric['duration_seconds']}s "
+            f"(rows in: {metric['rows_in']}, rows out: {metric['rows_out']})"
+        )
+        try:
+            record_stage_metric(self.engine, metric)
+        except Exception as e:
+            print(f"Could not record the metrics of stage '{metric['stage']}': {e}")
+
+        if self.slow_stage_seconds > 0 and metric["duration_seconds"] > self.slow_stage_seconds:
+            message = (
+                f"Slow stage '{metric['stage']}': {metric['duration_seconds']}s "
+                f"(threshold: {self.slow_stage_seconds}s)"
+            )
+            print(f"WARNING: {message}")
+            if self.alert_url:
+                try:
+                    requests.post(self.alert_url, data=message, timeout=5)
+                except requests.RequestException as e:
+                    print(f"Could not send the slow stage alert: {e}")
@@ -0,0 +1,48 @@
+"""Ingestion stages executed by the orchestrator (run_all.py)"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from scripts.orchestration.metrics import StageMetrics
+
+# Each stage is a standalone pipeline script, executed in its own folder
+STAGES = {
+    "openings":      {"script": "chess_openings_pipeline.py",       "cwd": "scripts/openings"},
+    "chess_com_api": {"script": "chess_games_pipeline.py",          "cwd": "scripts/chess_com_api"},
+    "games_times":   {"script": "chess_games_times_pipeline.py",    "cwd": "scripts/games_times"},
+    "stockfish":     {"script": "chess_games_moves_pipeline.py",    "cwd": "scripts/stockfish"},
+}
+
+
+def run_stage(stage: str, metrics: StageMetrics) -> dict | None:
+    """Run a pipeline script and return the report it wrote with `write_stage_report`, or None if it reported nothing.
+    Rows in/out are taken from the report: games processed (if reported) and rows landed.
+    """
+    fd, report_path = tempfile.mkstemp(prefix=f"stage_report_{stage}_", suffix=".json")
+    os.close(fd)
+    try:
+        with metrics.measure(stage) as metric:
+            subprocess.run(
+                [sys.executable, STAGES[stage]["script"]],
+                check=True,
+                cwd=STAGES[stage]["cwd"],
+                env={**os.environ, "STAGE_REPORT_PATH": report_path},
+            )
+            with open(report_path, "r") as f:
+                content = f.read()
+            report = json.loads(content) if content else None
+            if report:
+                metric["rows_in"] = report.get("games")
+                metric["rows_out"] = report["rows"]
+                metric["details"] = report
+        return report
+    finally:
+        os.remove(report_path)
+
+
+def report_rows(report: dict | None) -> int | None:
+    """Rows landed according to a stage report. None means unknown (and is treated as changed)."""
+    return report["rows"] if report else None
@@ -0,0 +1,77 @@
+"""Long-running workers of the orchestrator, each stage running at its own cadence (RUN_MODE=workers)"""
+
+import threading
+import traceback
+from typing import Callable
+
+
+class PendingChanges:
+    """Thread-safe accumulation of the stage reports landed since the last dbt build."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._games = {}
+
+    def add(self, stage: str, report: dict | None) -> None:
+        with self._lock:
+            rows = report["rows"] if report else None
+            if rows is None or (stage in self._rows and self._rows[stage] is None):
+                # unknown row count: the stage is considered as changed until the next build
+                self._rows[stage] = None
+            else:
+                self._rows[stage] = self._rows.get(stage, 0) + rows
+            self._games[stage] = self._games.get(stage, 0) + (report or {}).get("games", 0)
+
+    def games(self, stage: str) -> int:
+        """Number of games landed by a stage since the last build (e.g. newly analyzed games for `stockfish`)."""
+        with self._lock:
+            return self._games.get(stage, 0)
+
+    def has_changes(self) -> bool:
+        with self._lock:
+            return any(rows is None or rows > 0 for rows in self._rows.values())
+
+    def pop(self) -> dict:
+        """Return the rows landed per stage and reset the accumulation."""
+        with self._lock:
+            rows = self._rows
+            self._rows = {}
+            self._games = {}
+            return rows
+
+
+class Worker(threading.Thread):
+    """Runs `task` in a loop, waiting `cadence` seconds between two runs, until `stop_event` is set.
+
+    Any exception raised by the task is stored in `error` and stops all the workers sharing the same `stop_event`.
+    """
+
+    def __init__(self, name: str, task: Callable[[], None], cadence: float, stop_event: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.task = task
+        self.cadence = cadence
+        self.stop_event = stop_event
+        self.error = None
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.task()
+            except Exception as e:
+                print(f"Worker '{self.name}' failed:")
+                traceback.print_exc()
+                self.error = e
+                self.stop_event.set()
+                return
+            self.stop_event.wait(self.cadence)
+
+
+def run_workers(workers: list[Worker], stop_event: threading.Event) -> Worker | None:
+    """Start all workers and block until one of them fails. Returns the failed worker."""
+    for worker in workers:
+        print(f"Starting worker '{worker.name}' (cadence: {worker.cadence}s)")
+        worker.start()
+
+    stop_event.wait()
+    return next((worker for worker in workers if worker.error is not None), None)
@@ -13,7 +13,7 @@ import glob
 from pathlib import Path
 
 sys.path.append(os.path.abspath('..'))
-from helper import get_engine, games_to_process, load_config, get_table_settings, create_index_if_not_exists
+from helper import get_engine, games_to_process, load_config, get_table_settings, create_index_if_not_exists, write_stage_report
 
 print("Starting games moves processing")
 
@@ -174,6 +174,8 @@ if not games.empty:
     create_index_if_not_exists(engine, target_schema, target_table, target_index_field)
 
     print(f"Inserted {len(games_moves)} rows into `{target_schema}.{target_table}`.")
+    write_stage_report("stockfish", rows=len(games_moves), games=len(games))
 else:
     print("No rows to be inserted.")
+    write_stage_report("stockfish", rows=0, games=0)
 
@@ -0,0 +1,114 @@
+import re
+import sys
+import os
+from datetime import datetime, timezone
+import chess
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from scripts.benchmark.dbt_benchmark import compare_to_baseline
+from scripts.benchmark.fake_chess_api import FakeChessApi
+from scripts.chess_com_api.chess import helpers as chess_helpers
+from scripts.benchmark.query_plans import compare_to_baseline as compare_plans_to_baseline, get_watermark_columns, summarize_plan
+from scripts.benchmark.synthetic_data import encode_tcn, generate_games, generate_openings, TCN_ALPHABET, TCN_PROMOTION_PIECES
+
+def test_compare_to_baseline():
+    """Test compare_to_baseline function."""
+    baseline = {'timings': {'full': {'model.a': 10.0, 'model.b': 1.0}, 'incremental': {'model.a': 2.0}}}
+    results = {'timings': {
+        'full': {'model.a': 13.0, 'model.b': 1.4, 'model.new': 5.0},
+        'incremental': {'model.a': 2.1},
+    }}
+    regressions = compare_to_baseline(results, baseline, tolerance=0.2, min_seconds=0.5)
+
+    # model.b is 40% slower but only by 0.4 second, model.new has no baseline
+    assert regressions == [{'phase': 'full', 'model': 'model.a', 'baseline_seconds': 10.0, 'seconds': 13.0}]
+
+def test_generate_games():
+    """Test generate_games function."""
+    openings = generate_openings(20, seed=1)
+    assert openings['uci'].is_unique
+
+    start, end = datetime(2026, 1, 1, tzinfo=timezone.utc), datetime(2026, 2, 1, tzinfo=timezone.utc)
+    games, times, moves = generate_games(['user1', 'user2'], 3, start, end, list(openings['uci']), seed=42)
+    assert len(games) == 6
+
+    # Deterministic for a given seed, whatever the split of the users between workers
+    games_again, _, _ = generate_games(['user2'], 3, start, end, list(openings['uci']), seed=42)
+    assert games[3:] == games_again
+
+    for game in games:
+        assert start.timestamp() <= game['end_time'] <= end.timestamp()
+        assert game['username'] in [game['white']['username'], game['black']['username']]
+        # One [%clk] comment per move, parsed like chess_games_times_pipeline.py, matching the times and moves rows
+        clocks = re.findall(r'\[%clk (\d+):(\d{2}):(\d{2}(?:\.\d)?)\]', game['pgn'])
+        assert len(clocks) == (times['uuid'] == game['uuid']).sum() == (moves['uuid'] == game['uuid']).sum()
+        # Games start with one of the openings
+        if game['rules'] == 'chess960':
+            continue
+        game_moves = ' '.join(moves.loc[moves['uuid'] == game['uuid'], 'move'])
+        assert any(game_moves.startswith(uci) for uci in openings['uci'])
+
+def test_encode_tcn():
+    """Test encode_tcn function."""
+    board = chess.Board('8/P7/8/8/8/8/8/k6K w - - 0 1')
+    moves = [chess.Move.from_uci('h1g1'), chess.Move.from_uci('a1b1'), chess.Move.from_uci('a7a8n')]
+    tcn = encode_tcn(moves)
+    assert len(tcn) == 6
+    assert tcn[:4] == TCN_ALPHABET[chess.H1] + TCN_ALPHABET[chess.G1] + TCN_ALPHABET[chess.A1] + TCN_ALPHABET[chess.B1]
+    # Promotions encode the piece and the file offset instead of the target square
+    assert tcn[5] == TCN_ALPHABET[64 + TCN_PROMOTION_PIECES.index('n') * 3 + 1]
+    assert encode_tcn([chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5')]) == 'mC0K'
+
+def test_query_plans_compare_to_baseline():
+    """Test summarize_plan and the query plans compare_to_baseline functions."""
+    plan = {'Plan': {
+        'Node Type': 'Hash Join', 'Total Cost': 1200.0, 'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'players_games', 'Schema': 'chess_com', 'Total Cost': 900.0},
+            {'Node Type': 'Index Only Scan', 'Relation Name': 'players_games_moves', 'Schema': 'stockfish', 'Total Cost': 300.0},
+        ],
+    }, 'Execution Time': 12.5}
+    summary = summarize_plan(plan)
+    assert summary['seq_scans'] == ['chess_com.players_games']
+    assert summary['execution_ms'] == 12.5
+
+    baseline = {'queries': {
+        'q1': {'total_cost': 1000.0, 'seq_scans': []},
+        'q2': {'total_cost': 1000.0, 'seq_scans': ['chess_com.players_games']},
+        'q3': {'total_cost': 100.0, 'seq_scans': ['chess_com.players_games']},
+    }}
+    results = {'queries': {'q1': summary, 'q2': summary, 'q3': summary, 'q_new': summary}}
+    flags = compare_plans_to_baseline(results, baseline, cost_tolerance=1)
+
+    # q1 flipped to a sequential scan, q3 cost jumped, q2 is unchanged and q_new has no baseline
+    assert [flag['query'] for flag in flags] == ['q1', 'q3']
+
+def test_get_watermark_columns():
+    """Test get_watermark_columns function."""
+    models_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'models')
+    with open(os.path.join(models_dir, 'intermediate', 'games', 'int_games_openings.sql'), 'r') as f:
+        assert get_watermark_columns(f.read()) == ['run_timestamp', 'openings_log_timestamp']
+    # Each column once, whatever the number of subqueries using it
+    sql = 'WHERE x > (SELECT MAX(i.end_time) FROM {{ this }} i) OR y > (select max(i.end_time) from {{this}} i)'
+    assert get_watermark_columns(sql) == ['end_time']
+    assert get_watermark_columns('SELECT * FROM {{ this }}') == []
+
+def test_fake_chess_api(monkeypatch):
+    """Test FakeChessApi class with the chess.com fetch helpers."""
+    monkeypatch.setattr(chess_helpers.time, 'sleep', lambda seconds: None)
+    api = FakeChessApi(games_per_user=20, months=2, error_429_rate=0.3)
+    base_url = api.start()
+    try:
+        # Throttled requests are retried by the fetch layer
+        archives = chess_helpers.get_url_with_retry(f'{base_url}player/User1/games/archives')['archives']
+        assert archives and all(url.startswith(f'{base_url}player/User1/games/') for url in archives)
+        validators = {}
+        games = chess_helpers.get_url_if_modified(archives[-1], validators)['games']
+        assert games and 'username' not in games[0]
+
+        # Unchanged archive: 304 Not Modified
+        api.error_429_rate = 0
+        assert chess_helpers.get_url_if_modified(archives[-1], validators) is None
+        requests_count = api.requests_count
+        assert chess_helpers.get_url_if_modified(archives[-1], {}) == {'games': games}
+        assert api.requests_count == requests_count + 1
+    finally:
+        api.stop()
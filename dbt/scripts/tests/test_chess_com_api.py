@@ -0,0 +1,323 @@
+import sys
+import os
+import hashlib
+import importlib.util
+import json
+import sqlite3
+from datetime import datetime, timezone
+import dlt
+import pytest
+import requests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from scripts.chess_com_api.chess import helpers, source
+from scripts.chess_com_api.chess.settings import OFFICIAL_CHESS_API_URL
+from scripts.helper import get_processable_games_condition
+
+CHESS_COM_API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'chess_com_api'))
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, payload=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.payload = payload
+
+    encoding = 'utf-8'
+
+    def json(self):
+        return self.payload
+
+    def iter_content(self, chunk_size):
+        content = json.dumps(self.payload).encode('utf-8')
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.headers = []
+
+    def get(self, url, headers, timeout, stream=False):
+        self.calls += 1
+        self.headers.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+class FakeChessApiSession:
+    """chess.com API stand-in for the chess source: archives of games per username and month, with ETags."""
+
+    def __init__(self, archives):
+        self.archives = archives
+        self.urls = []
+        self.not_modified_urls = []
+
+    def get(self, url, headers, timeout, stream=False):
+        self.urls.append(url)
+        _, username, _, *month = url[len(OFFICIAL_CHESS_API_URL):].split('/')
+        if month == ['archives']:
+            payload = {'archives': [f'{OFFICIAL_CHESS_API_URL}player/{username}/games/{m}' for m in sorted(self.archives[username])]}
+        elif '/'.join(month) in self.archives[username]:
+            payload = {'games': self.archives[username]['/'.join(month)]}
+        else:
+            return FakeResponse(404)
+        etag = '"%s"' % hashlib.md5(json.dumps(payload).encode('utf-8')).hexdigest()
+        if headers.get('If-None-Match') == etag:
+            self.not_modified_urls.append(url)
+            return FakeResponse(304)
+        return FakeResponse(200, headers={'ETag': etag}, payload=payload)
+
+def _game(uuid, month, day):
+    """Processable game of an archive month (YYYY/MM)."""
+    end_time = datetime.strptime(f'{month}/{day:02d}', '%Y/%m/%d').replace(tzinfo=timezone.utc)
+    return {
+        'uuid': uuid, 'url': f'https://www.chess.com/game/live/{uuid}', 'end_time': int(end_time.timestamp()),
+        'rules': 'chess', 'time_class': 'blitz', 'initial_setup': helpers.STANDARD_INITIAL_SETUP,
+        'pgn': '1. e4 {[%clk 0:02:59.9]} 1... e5 {[%clk 0:02:58.1]}',
+    }
+
+def _load_games(pipeline, players):
+    """Runs the open then the closed months extractions, like chess_games_pipeline.py, and returns the games loaded."""
+    loaded = 0
+    for months in ['open', 'closed']:
+        pipeline.extract(source(players, months=months, processable_only=True).with_resources('players_games'))
+        pipeline.normalize()
+        loaded += pipeline.last_trace.last_normalize_info.row_counts.get('players_games', 0)
+        pipeline.load()
+    return loaded
+
+@pytest.fixture
+def games_pipeline():
+    """chess_games_pipeline.py, imported like when it runs from its folder, where `chess` is the dlt source package
+    (and not python-chess, restored afterwards)."""
+    is_chess_module = lambda name: name == 'chess' or name.startswith('chess.')
+    saved_modules = {name: module for name, module in sys.modules.items() if is_chess_module(name)}
+    for name in saved_modules:
+        del sys.modules[name]
+    sys.path.insert(0, CHESS_COM_API_DIR)
+    try:
+        spec = importlib.util.spec_from_file_location('chess_games_pipeline', os.path.join(CHESS_COM_API_DIR, 'chess_games_pipeline.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        sys.path.remove(CHESS_COM_API_DIR)
+        for name in [name for name in sys.modules if is_chess_module(name)]:
+            del sys.modules[name]
+        sys.modules.update(saved_modules)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the sleeps instead of waiting."""
+    recorded = []
+    monkeypatch.setattr(helpers.time, 'sleep', recorded.append)
+    monkeypatch.setattr(helpers, '_rate_limiter', helpers.TokenBucket(rate=1000))
+    return recorded
+
+def test_get_url_with_retry(monkeypatch, sleeps):
+    """Test get_url_with_retry function."""
+    # 429 with Retry-After, then a connection error and a 503 retried with backoff, then success
+    session = FakeSession([
+        FakeResponse(429, headers={'Retry-After': '7'}),
+        requests.ConnectionError(),
+        FakeResponse(503),
+        FakeResponse(200, payload={'games': []}),
+    ])
+    monkeypatch.setattr(helpers, '_session', session)
+    assert helpers.get_url_with_retry('https://api.chess.com/pub/player/a') == {'games': []}
+    assert session.calls == 4
+    assert sleeps[0] == 7
+    # Backoff doubles at each attempt (up to 2s then 4s), with jitter
+    assert 0 <= sleeps[1] <= helpers.BACKOFF_SECONDS * 2 and 0 <= sleeps[2] <= helpers.BACKOFF_SECONDS * 4
+
+    # Other errors are not retried
+    session = FakeSession([FakeResponse(404)])
+    monkeypatch.setattr(helpers, '_session', session)
+    with pytest.raises(requests.HTTPError):
+        helpers.get_url_with_retry('https://api.chess.com/pub/player/a/games/archives')
+    assert session.calls == 1
+
+    # Retries are bounded
+    session = FakeSession([FakeResponse(429)] * (helpers.MAX_RETRIES + 1))
+    monkeypatch.setattr(helpers, '_session', session)
+    with pytest.raises(requests.HTTPError):
+        helpers.get_url_with_retry('https://api.chess.com/pub/player/a')
+    assert session.calls == helpers.MAX_RETRIES + 1
+
+def test_get_url_if_modified(monkeypatch, sleeps):
+    """Test get_url_if_modified function."""
+    session = FakeSession([
+        FakeResponse(200, headers={'ETag': '"v1"', 'Last-Modified': 'Sun, 18 Oct 2026 10:00:00 GMT'}, payload={'games': [1]}),
+        FakeResponse(304),
+        FakeResponse(200, headers={'ETag': '"v2"'}, payload={'games': [1, 2]}),
+    ])
+    monkeypatch.setattr(helpers, '_session', session)
+    url = 'https://api.chess.com/pub/player/a/games/2026/10'
+    validators = {}
+
+    # First call: no condition, the validators of the response are kept
+    assert helpers.get_url_if_modified(url, validators) == {'games': [1]}
+    assert session.headers[0] == {}
+    assert validators == {'etag': '"v1"', 'last_modified': 'Sun, 18 Oct 2026 10:00:00 GMT'}
+
+    # Not modified: short-circuited, validators unchanged
+    assert helpers.get_url_if_modified(url, validators) is None
+    assert session.headers[1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Sun, 18 Oct 2026 10:00:00 GMT'}
+    assert validators['etag'] == '"v1"'
+
+    # Modified: new document and validators (Last-Modified no longer sent by the server)
+    assert helpers.get_url_if_modified(url, validators) == {'games': [1, 2]}
+    assert validators == {'etag': '"v2"'}
+
+def test_token_bucket(monkeypatch):
+    """Test TokenBucket class."""
+    now = [0.0]
+    monkeypatch.setattr(helpers.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(helpers.time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+
+    # The burst capacity is served immediately, then one token every 1 / rate seconds
+    bucket = helpers.TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert now[0] == 0
+    bucket.acquire()
+    bucket.acquire()
+    assert now[0] == pytest.approx(1.0)
+
+def test_iter_json_array():
+    """Test iter_json_array function."""
+    document = '{"games": [{"url": "a", "pgn": "1. e4 {[%clk 0:03:00]} e5"}, {"url": "b", "white": {"username": "é"}}\n]}'
+    expected = [{'url': 'a', 'pgn': '1. e4 {[%clk 0:03:00]} e5'}, {'url': 'b', 'white': {'username': 'é'}}]
+    # Items split across chunks at every possible position
+    for size in range(1, len(document) + 1):
+        chunks = [document[i:i + size] for i in range(0, len(document), size)]
+        assert list(helpers.iter_json_array(chunks, 'games')) == expected
+    assert list(helpers.iter_json_array(['{"games": []}'], 'games')) == []
+    assert list(helpers.iter_json_array(['{"code": 0}'], 'games')) == []
+    # A truncated document is an error
+    with pytest.raises(ValueError):
+        list(helpers.iter_json_array([document[:40]], 'games'))
+
+def test_iter_concurrently():
+    """Test iter_concurrently function."""
+    outputs = helpers.iter_concurrently(lambda n: iter(range(n)), [3, 0, 2], max_pending=1)
+    assert sorted(outputs) == [0, 0, 1, 1, 2]
+
+    def _fail(n):
+        yield n
+        raise requests.HTTPError('500 error')
+    with pytest.raises(requests.HTTPError):
+        list(helpers.iter_concurrently(_fail, [1, 2]))
+
+def test_is_processable_game():
+    """Test is_processable_game function."""
+    game = {'rules': 'chess', 'pgn': '1. e4 {[%clk 0:02:59.9]} 1... e5', 'initial_setup': helpers.STANDARD_INITIAL_SETUP, 'time_class': 'blitz'}
+    assert helpers.is_processable_game(game)
+    assert helpers.is_processable_game(game, ['blitz', 'rapid'])
+    assert helpers.is_processable_game({**game, 'initial_setup': ''})
+    assert not helpers.is_processable_game(game, ['rapid'])
+    assert not helpers.is_processable_game({**game, 'rules': 'chess960'})
+    assert not helpers.is_processable_game({**game, 'pgn': '1. e4 e5'})
+    assert not helpers.is_processable_game({**game, 'initial_setup': '8/8/8/8/8/8/8/K6k w - - 0 1'})
+
+def test_is_processable_game_matches_sql_condition():
+    """Test is_processable_game against the `processable_games_condition` of dbt_project.yml."""
+    connection = sqlite3.connect(":memory:")
+    connection.create_function("strpos", 2, lambda string, substring: string.find(substring) + 1)
+    connection.execute("CREATE TABLE players_games (rules TEXT, pgn TEXT, initial_setup TEXT)")
+    game = {'rules': 'chess', 'pgn': '1. e4 {[%clk 0:02:59.9]} 1... e5', 'initial_setup': helpers.STANDARD_INITIAL_SETUP}
+    games = [
+        game,
+        {**game, 'initial_setup': ''},
+        {**game, 'initial_setup': '8/8/8/8/8/8/8/K6k w - - 0 1'},
+        {**game, 'rules': 'chess960'},
+        {**game, 'pgn': '1. e4 e5'},
+        {**game, 'pgn': ''},
+    ]
+    condition = get_processable_games_condition()
+    for game in games:
+        connection.execute("DELETE FROM players_games")
+        connection.execute("INSERT INTO players_games VALUES (:rules, :pgn, :initial_setup)", game)
+        selected = connection.execute(f"SELECT COUNT(*) FROM players_games game WHERE {condition}").fetchone()[0]
+        assert helpers.is_processable_game(game) == bool(selected), game
+
+def test_players_games(monkeypatch, sleeps, tmp_path):
+    """Test players_games resource against a fake chess.com API, across runs sharing the pipeline state."""
+    now = datetime.now(timezone.utc)
+    current_month = now.strftime('%Y/%m')
+    closed_months = [f'{now.year - 1}/11', f'{now.year - 1}/12']
+    archives = {'alice': {
+        closed_months[0]: [_game('a1', closed_months[0], 3)],
+        closed_months[1]: [_game('a2', closed_months[1], 5), _game('a3', closed_months[1], 6)],
+        current_month: [_game('a4', current_month, 1)],
+    }}
+    session = FakeChessApiSession(archives)
+    monkeypatch.setattr(helpers, '_session', session)
+    pipeline = dlt.pipeline(
+        pipeline_name='test_players_games', pipelines_dir=str(tmp_path),
+        destination=dlt.destinations.dummy(completed_prob=1.0),
+    )
+    closed_urls = {f'{OFFICIAL_CHESS_API_URL}player/alice/games/{month}' for month in closed_months}
+    current_url = f'{OFFICIAL_CHESS_API_URL}player/alice/games/{current_month}'
+
+    # First run: every archive is fetched once, the closed months by the "closed" extraction
+    assert _load_games(pipeline, ['alice']) == 4
+    assert closed_urls < set(session.urls) and len(session.urls) == 4
+
+    # Nothing changed: the archives list and the current month are not modified (304), the closed months are skipped
+    session.urls.clear()
+    assert _load_games(pipeline, ['alice']) == 0
+    assert not closed_urls & set(session.urls)
+    assert set(session.not_modified_urls) == {f'{OFFICIAL_CHESS_API_URL}player/alice/games/archives', current_url}
+
+    # A new game in the current month: the archive is re-scanned, only the game after the cursor is loaded
+    archives['alice'][current_month].append(_game('a5', current_month, 1) | {'end_time': archives['alice'][current_month][0]['end_time'] + 60})
+    session.urls.clear()
+    assert _load_games(pipeline, ['alice']) == 1
+    assert not closed_urls & set(session.urls) and current_url in session.urls
+
+    # The games which can never be analyzed are not loaded
+    archives['alice'][current_month].append(_game('a6', current_month, 1) | {'end_time': archives['alice'][current_month][1]['end_time'] + 60, 'rules': 'chess960'})
+    assert _load_games(pipeline, ['alice']) == 0
+
+def test_get_shard(games_pipeline):
+    """Test _get_shard function."""
+    usernames = [f'user_{i}' for i in range(100)]
+    shards = [games_pipeline._get_shard(username, 4) for username in usernames]
+    # Stable across processes and runs (not the salted built-in hash), whatever the case of the username
+    assert shards[:5] == [int(hashlib.md5(username.encode('utf-8')).hexdigest(), 16) % 4 for username in usernames[:5]]
+    assert games_pipeline._get_shard('USER_0', 4) == shards[0]
+    # Every user in exactly one shard, all shards used
+    assert set(shards) == {0, 1, 2, 3}
+
+def test_run_shards(monkeypatch, games_pipeline):
+    """Test _run_shards function with fake shard processes."""
+    exit_codes = {}
+
+    class FakeProcess:
+        def __init__(self, args, env):
+            self.shard = int(env['CHESS_API_SHARD'])
+            # a shard which fails early writes no report
+            if exit_codes.get(self.shard, 0) == 0:
+                with open(env['STAGE_REPORT_PATH'], 'w') as f:
+                    json.dump({'stage': 'chess_com_api', 'rows': 10 * self.shard + 1}, f)
+
+        def wait(self):
+            return exit_codes.get(self.shard, 0)
+
+    monkeypatch.setattr(games_pipeline.subprocess, 'Popen', FakeProcess)
+    # The new games of the shards are summed
+    assert games_pipeline._run_shards(3) == 1 + 11 + 21
+
+    # A failed shard fails the run, naming it
+    exit_codes[1] = 1
+    with pytest.raises(RuntimeError, match=r'shards \[1\] of 3'):
+        games_pipeline._run_shards(3)
@@ -0,0 +1,140 @@
+import sys
+import os
+import hashlib
+import chess
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from scripts.openings import chess_openings_pipeline
+from scripts.openings.opening_classifier import OpeningClassifier, format_opening_ids, opening_id, san_moves
+from scripts.openings.opening_hierarchy import hierarchy_level_names
+
+def _epd(uci):
+    board = chess.Board()
+    for move in uci.split(' '):
+        board.push_uci(move)
+    return board.epd()
+
+OPENINGS = ['e2e4', 'e2e4 e7e5', 'e2e4 e7e5 g1f3', 'g1f3']
+
+def test_san_moves():
+    """Test san_moves function."""
+    pgn = '[Event "Live Chess"]\n[Result "1-0"]\n\n1. e4 {[%clk 0:02:59.9]} 1... e5 {[%clk 0:02:58]} 2. Qh5 {[%clk 0:02:57]} 1-0\n'
+    assert san_moves(pgn) == ['e4', 'e5', 'Qh5']
+
+def test_opening_classifier():
+    """Test OpeningClassifier class."""
+    classifier = OpeningClassifier([(uci, _epd(uci)) for uci in OPENINGS], depth=5)
+
+    # Latest opening position reached after each ply, the last one repeated for short games
+    assert classifier.classify('1. e4 e5 2. Nf3 1-0') == [opening_id('e2e4'), opening_id('e2e4 e7e5'), opening_id('e2e4 e7e5 g1f3')] + [opening_id('e2e4 e7e5 g1f3')] * 2
+    # Transposition: 1. Nf3 e5 2. e4 reaches the position of 1. e4 e5 2. Nf3
+    assert classifier.classify('1. Nf3 e5 2. e4 Nc6 3. d4')[2] == opening_id('e2e4 e7e5 g1f3')
+    # No opening position before the first one reached
+    assert classifier.classify('1. d4 d5 2. e4')[:2] == [None, None]
+    assert format_opening_ids([None, 12]) == '{NULL,12}'
+
+def test_opening_id():
+    """Test opening_id function: the first 60 bits of the MD5 of the moves."""
+    assert opening_id('e2e4') == int('b902d00cf2a424f', 16) < 2 ** 60
+
+def test_hierarchy_level_names():
+    """Test hierarchy_level_names function."""
+    openings = {'e2e4': 'King Pawn', 'e2e4 e7e5 g1f3': 'King Knight', 'd2d4 d7d5': 'Queen Gambit'}
+    hierarchy = hierarchy_level_names(openings)
+    # The deepest parent opening at each level, the opening itself at its own depth
+    assert hierarchy['e2e4 e7e5 g1f3'] == ['King Pawn', 'King Pawn', 'King Knight']
+    assert hierarchy['d2d4 d7d5'] == [None, 'Queen Gambit']
+
+def test_get_parquet_path(monkeypatch):
+    """Test _get_parquet_path function: Hugging Face asked first, the cached file used offline or if unreachable."""
+    calls = []
+    cached = {'available': True}
+
+    def _hf_hub_download(repo_id, filename, repo_type, local_dir, local_files_only=False):
+        calls.append(local_files_only)
+        if not local_files_only and not cached.get('online'):
+            raise ConnectionError('Hugging Face unreachable')
+        if local_files_only and not cached['available']:
+            raise FileNotFoundError('not in the cache')
+        return os.path.join(local_dir, filename)
+    monkeypatch.setattr(chess_openings_pipeline, 'hf_hub_download', _hf_hub_download)
+
+    # Online: checked against Hugging Face (downloaded again only if changed)
+    cached['online'] = True
+    assert chess_openings_pipeline._get_parquet_path().endswith(chess_openings_pipeline.OPENINGS_FILENAME)
+    assert calls == [False]
+
+    # Unreachable: cache hit
+    cached['online'] = False
+    calls.clear()
+    assert chess_openings_pipeline._get_parquet_path().endswith(chess_openings_pipeline.OPENINGS_FILENAME)
+    assert calls == [False, True]
+
+    # Offline: Hugging Face is not asked, and a cache miss is an error
+    monkeypatch.setattr(chess_openings_pipeline, 'OFFLINE', True)
+    calls.clear()
+    chess_openings_pipeline._get_parquet_path()
+    assert calls == [True]
+    cached['available'] = False
+    with pytest.raises(FileNotFoundError):
+        chess_openings_pipeline._get_parquet_path()
+
+def test_get_content_hash(tmp_path):
+    """Test _get_content_hash function: computed once per file version, then read from the .sha256 file."""
+    path = tmp_path / 'openings.parquet'
+    path.write_bytes(b'v1')
+    assert chess_openings_pipeline._get_content_hash(str(path)) == hashlib.sha256(b'v1').hexdigest()
+    assert (tmp_path / 'openings.parquet.sha256').read_text() == hashlib.sha256(b'v1').hexdigest()
+
+    # Cache hit: the file did not change since its hash was written
+    (tmp_path / 'openings.parquet.sha256').write_text('cached')
+    assert chess_openings_pipeline._get_content_hash(str(path)) == 'cached'
+
+    # Cache miss: the file changed (e.g. a new download)
+    path.write_bytes(b'v2')
+    hash_mtime = os.path.getmtime(tmp_path / 'openings.parquet.sha256')
+    os.utime(path, (hash_mtime + 10, hash_mtime + 10))
+    assert chess_openings_pipeline._get_content_hash(str(path)) == hashlib.sha256(b'v2').hexdigest()
+
+@pytest.fixture
+def openings_run(monkeypatch):
+    """run_pipeline with the dataset hash, the hash of the loaded rows and the classification state of `state`, and
+    the loads and classifications it runs recorded in `state` (no database)."""
+    state = {'content_hash': 'sha-1', 'loaded_hash': None, 'openings_sha256': None, 'classifier': object(), 'actions': []}
+    pipeline = chess_openings_pipeline
+    monkeypatch.setattr(pipeline, '_get_parquet_path', lambda: 'openings.parquet')
+    monkeypatch.setattr(pipeline, '_get_content_hash', lambda path: state['content_hash'])
+    monkeypatch.setattr(pipeline, 'get_engine', lambda: None)
+    monkeypatch.setattr(pipeline, 'create_index_if_not_exists', lambda *args: None)
+    monkeypatch.setattr(pipeline, '_get_loaded_hash', lambda engine, schema, table: state['loaded_hash'])
+    monkeypatch.setattr(pipeline, '_load_openings', lambda engine, path, content_hash, schema, table: state['actions'].append('load'))
+    monkeypatch.setattr(pipeline, 'get_run_state', lambda engine, key: state[key])
+    monkeypatch.setattr(pipeline, 'set_run_state', lambda engine, key, value: state.__setitem__(key, value))
+    monkeypatch.setattr(pipeline, 'get_opening_classifier', lambda engine: state['classifier'])
+    monkeypatch.setattr(pipeline, 'reclassify_all_games', lambda engine, classifier: state['actions'].append('reclassify') or 0)
+    return state
+
+def test_run_pipeline_hash_mismatch(openings_run):
+    """Test run_pipeline function: the dataset is loaded and the games classified again only when their hashes differ."""
+    # Openings not loaded yet: loaded, then all the games classified before the hash is recorded
+    chess_openings_pipeline.run_pipeline()
+    assert openings_run['actions'] == ['load', 'reclassify']
+    assert openings_run['openings_sha256'] == 'sha-1'
+
+    # Same dataset: nothing to do
+    openings_run['loaded_hash'] = 'sha-1'
+    openings_run['actions'].clear()
+    chess_openings_pipeline.run_pipeline()
+    assert openings_run['actions'] == []
+
+    # New dataset whose games classification is interrupted: resumed on the next run (hash still differs)
+    openings_run['content_hash'] = 'sha-2'
+    openings_run['classifier'] = None
+    openings_run['actions'].clear()
+    chess_openings_pipeline.run_pipeline()
+    assert openings_run['actions'] == ['load'] and openings_run['openings_sha256'] == 'sha-1'
+    openings_run['loaded_hash'] = 'sha-2'
+    openings_run['classifier'] = object()
+    openings_run['actions'].clear()
+    chess_openings_pipeline.run_pipeline()
+    assert openings_run['actions'] == ['reclassify'] and openings_run['openings_sha256'] == 'sha-2'
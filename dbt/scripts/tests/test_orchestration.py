@@ -0,0 +1,266 @@
+import json
+import threading
+import time
+import sys
+import os
+from datetime import date, timedelta
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from scripts.orchestration import dbt_build
+from scripts.orchestration.dbt_build import DBT_TIERS, DbtBuilder, changed_selectors, get_backfill_usernames, tier_run_args
+from scripts.orchestration.dbt_invoke import hash_paths
+from scripts.orchestration.workers import PendingChanges, Worker, run_workers
+from scripts.orchestration import metrics as metrics_module
+from scripts.orchestration.metrics import StageMetrics
+
+def test_changed_selectors():
+    """Test changed_selectors function."""
+    # Stages with rows landed (or unknown row counts) are selected, in order
+    stage_rows = {'chess_com_api': 0, 'games_times': 12, 'stockfish': None}
+    assert changed_selectors(stage_rows) == ['source:times+', 'source:stockfish+']
+
+    # Nothing landed: nothing to run
+    assert changed_selectors({'chess_com_api': 0, 'games_times': 0, 'stockfish': 0}) == []
+
+    # Stages without selector are ignored
+    assert changed_selectors({'openings': None, 'seeds': None}) == ['username_mapping+']
+
+def test_tier_run_args():
+    """Test tier_run_args function."""
+    # Each changed source is intersected with the tier selection
+    args = tier_run_args(DBT_TIERS['hot'], ['source:stockfish+', 'source:times+'])
+    assert args == [
+        '--select', 'source:stockfish+,+obt_games_stats_filtered', 'source:times+,+obt_games_stats_filtered',
+        '--exclude', 'dbt_project_evaluator',
+    ]
+
+    # Tier exclusions are appended to the dbt_project_evaluator exclusion
+    args = tier_run_args(DBT_TIERS['slow'], ['source:chess_com+'])
+    assert args == [
+        '--select', 'source:chess_com+,fqn:*',
+        '--exclude', 'dbt_project_evaluator', '+obt_games_stats_filtered',
+    ]
+
+def test_get_backfill_usernames():
+    """Test get_backfill_usernames function."""
+    built_users = {'Alice': '2024-01', 'bob': None}
+    # New users and earlier start months are backfilled (lower case), removed users are not
+    landed_users = {'alice': '2023-01', 'Bob': None, 'Carol': '2024-06'}
+    assert get_backfill_usernames(landed_users, built_users) == ['alice', 'carol']
+    assert get_backfill_usernames(built_users, built_users) == []
+
+    # Nothing to backfill until the landed and built users are known
+    assert get_backfill_usernames(None, built_users) == []
+    assert get_backfill_usernames(landed_users, None) == []
+
+def test_hash_paths(tmp_path):
+    """Test hash_paths function."""
+    (tmp_path / 'models').mkdir()
+    (tmp_path / 'models' / 'a.sql').write_text('SELECT 1')
+    (tmp_path / 'dbt_project.yml').write_text('name: test')
+    paths = [str(tmp_path / 'models'), str(tmp_path / 'dbt_project.yml'), str(tmp_path / 'missing.yml')]
+
+    reference = hash_paths(paths)
+    assert hash_paths(paths) == reference
+
+    # Content change
+    (tmp_path / 'models' / 'a.sql').write_text('SELECT 2')
+    assert hash_paths(paths) != reference
+
+    # New file
+    (tmp_path / 'models' / 'a.sql').write_text('SELECT 1')
+    assert hash_paths(paths) == reference
+    (tmp_path / 'models' / 'b.sql').write_text('')
+    assert hash_paths(paths) != reference
+
+def test_pending_changes():
+    """Test PendingChanges accumulation."""
+    pending = PendingChanges()
+    assert not pending.has_changes()
+
+    pending.add('chess_com_api', {'stage': 'chess_com_api', 'rows': 0})
+    assert not pending.has_changes()
+
+    pending.add('stockfish', {'stage': 'stockfish', 'rows': 120, 'games': 3})
+    pending.add('stockfish', {'stage': 'stockfish', 'rows': 80, 'games': 2})
+    assert pending.has_changes()
+    assert pending.games('stockfish') == 5
+
+    # An unknown row count is sticky until the next pop
+    pending.add('games_times', None)
+    pending.add('games_times', {'stage': 'games_times', 'rows': 10, 'games': 1})
+
+    assert pending.pop() == {'chess_com_api': 0, 'stockfish': 200, 'games_times': None}
+    assert not pending.has_changes()
+    assert pending.games('stockfish') == 0
+
+def test_worker_failure_stops_all_workers():
+    """Test that a failing worker stops the other workers."""
+    stop_event = threading.Event()
+    calls = []
+
+    def _failing_task():
+        raise ValueError('boom')
+
+    workers = [
+        Worker('healthy', lambda: calls.append(1), 0.01, stop_event),
+        Worker('failing', _failing_task, 0.01, stop_event),
+    ]
+    failed_worker = run_workers(workers, stop_event)
+    assert failed_worker.name == 'failing'
+    assert isinstance(failed_worker.error, ValueError)
+    workers[0].join(timeout=1)
+    assert not workers[0].is_alive()
+
+def test_stage_metrics(monkeypatch, capsys):
+    """Test StageMetrics.measure context manager."""
+    recorded = []
+    monkeypatch.setattr(metrics_module, 'record_stage_metric', lambda engine, metric: recorded.append(metric))
+    metrics = StageMetrics(engine=None, slow_stage_seconds=0)
+
+    # Successful stage: rows filled by the measured block
+    with metrics.measure('games_times') as metric:
+        metric['rows_in'] = 2
+        metric['rows_out'] = 150
+    assert recorded[-1]['stage'] == 'games_times'
+    assert recorded[-1]['status'] == 'success'
+    assert (recorded[-1]['rows_in'], recorded[-1]['rows_out']) == (2, 150)
+    assert recorded[-1]['duration_seconds'] >= 0
+
+    # Failed stage: recorded as failed and the exception is propagated
+    try:
+        with metrics.measure('stockfish'):
+            raise RuntimeError('engine crashed')
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'The exception should be propagated'
+    assert recorded[-1]['stage'] == 'stockfish'
+    assert recorded[-1]['status'] == 'failed'
+
+    # Status set by the measured block (e.g. dbt test returning failures without raising)
+    with metrics.measure('dbt test') as metric:
+        metric['status'] = 'failed'
+    assert recorded[-1]['status'] == 'failed'
+    assert 'Slow stage' not in capsys.readouterr().out
+
+    # Slow stage alert
+    metrics.slow_stage_seconds = 0.001
+    with metrics.measure('dbt run'):
+        time.sleep(0.01)
+    assert "WARNING: Slow stage 'dbt run'" in capsys.readouterr().out
+
+    # A metrics failure never stops the pipeline
+    def _failing_record(engine, metric):
+        raise ConnectionError('database unavailable')
+    monkeypatch.setattr(metrics_module, 'record_stage_metric', _failing_record)
+    with metrics.measure('chess_com_api'):
+        pass
+
+class FakeDbtInvoker:
+    def __init__(self):
+        self.calls = []
+
+    def invoke(self, args, dbt_vars=None, vars_affect_parsing=True, check=True):
+        self.calls.append((args, dbt_vars))
+        return True
+
+    def commands(self):
+        """The dbt commands invoked since the previous call (run-operations named after their macro)."""
+        commands = [args[1] if args[0] == 'run-operation' else args[0] for args, _ in self.calls]
+        self.calls = []
+        return commands
+
+@pytest.fixture
+def builder(monkeypatch):
+    """DbtBuilder with a fake dbt, an in-memory run_state and the hashes, window start and removed users of
+    `builder.warehouse` (no database)."""
+    run_state = {}
+    warehouse = {'seeds_hash': 'seeds-1', 'logic_hash': 'logic-1', 'games_scope_start': '2026-09-01', 'removed_usernames': []}
+    monkeypatch.setattr(dbt_build, 'get_run_state', lambda engine, key: run_state.get(key))
+    monkeypatch.setattr(dbt_build, 'set_run_state', lambda engine, key, value: run_state.__setitem__(key, value))
+    monkeypatch.setattr(dbt_build, 'hash_paths', lambda paths: warehouse['seeds_hash'])
+    monkeypatch.setattr(dbt_build, 'get_logic_hash', lambda engine: warehouse['logic_hash'])
+    monkeypatch.setattr(dbt_build, 'get_games_scope_start', lambda engine: warehouse['games_scope_start'])
+    monkeypatch.setattr(dbt_build, 'get_removed_usernames', lambda engine, landed_users: warehouse['removed_usernames'])
+    monkeypatch.setattr(dbt_build, 'setup_games_freshness', lambda engine: None)
+    monkeypatch.setattr(dbt_build, 'record_games_freshness', lambda engine, **kwargs: 0)
+    monkeypatch.setattr(metrics_module, 'record_stage_metric', lambda engine, metric: None)
+    builder = DbtBuilder(engine=None, metrics=StageMetrics(engine=None))
+    builder.dbt = FakeDbtInvoker()
+    builder.run_state = run_state
+    builder.warehouse = warehouse
+    return builder
+
+def test_dbt_builder_full_refresh_reason(builder):
+    """Test DbtBuilder._full_refresh_reason method."""
+    # Never built, or dbt logic (or openings) changed since the last full refresh
+    assert builder._full_refresh_reason() is not None
+    builder.run_state['dbt_logic_hash'] = 'logic-1'
+    assert builder._full_refresh_reason() is None
+    builder.warehouse['logic_hash'] = 'logic-2'
+    assert 'logic' in builder._full_refresh_reason()
+
+    # Periodic full refresh, if enabled
+    builder.run_state['dbt_logic_hash'] = 'logic-2'
+    builder.full_refresh_interval_days = 7
+    assert 'periodic' in builder._full_refresh_reason()
+    builder.run_state['last_full_refresh_date'] = (date.today() - timedelta(days=3)).isoformat()
+    assert builder._full_refresh_reason() is None
+    builder.run_state['last_full_refresh_date'] = (date.today() - timedelta(days=7)).isoformat()
+    assert 'periodic' in builder._full_refresh_reason()
+
+def test_dbt_builder_build(builder):
+    """Test DbtBuilder.build method: seeds, blue/green full refresh, retention and incremental runs."""
+    no_rows = {'chess_com_api': 0, 'games_times': 0, 'stockfish': 0}
+
+    # First build: seeds, then a blue/green full refresh recording the logic hash and window start
+    builder.build(no_rows)
+    assert builder.dbt.commands() == ['seed', 'drop_shadow_schemas', 'run', 'swap_shadow_schemas']
+    assert builder.run_state['dbt_logic_hash'] == 'logic-1'
+    assert builder.run_state['games_scope_start'] == '2026-09-01'
+
+    # Nothing changed: seed, retention and run skipped
+    builder.build(no_rows)
+    assert builder.dbt.commands() == []
+
+    # Seed files changed: seeds loaded again, and their downstream models rebuilt
+    builder.warehouse['seeds_hash'] = 'seeds-2'
+    builder.build(no_rows)
+    assert builder.dbt.calls[0] == (['seed'], None)
+    assert all('username_mapping+' in args[2] for args, _ in builder.dbt.calls[1:])
+    builder.dbt.commands()
+
+    # Window moved: out-of-scope games purged once, before the new start is recorded
+    builder.warehouse['games_scope_start'] = '2026-10-01'
+    builder.build(no_rows)
+    assert builder.dbt.calls == [(['run-operation', 'apply_games_scope_retention', '--args', '{"removed_usernames": []}'], None)]
+    assert builder.run_state['games_scope_start'] == '2026-10-01'
+    builder.dbt.commands()
+    builder.build(no_rows)
+    assert builder.dbt.commands() == []
+
+    # Users no longer landed: purged through the retention macro
+    builder.warehouse['removed_usernames'] = ['bob']
+    builder.build(no_rows)
+    assert builder.dbt.calls == [(['run-operation', 'apply_games_scope_retention', '--args', '{"removed_usernames": ["bob"]}'], None)]
+
+def test_dbt_builder_backfill(builder):
+    """Test DbtBuilder.build method: backfill of the users landed since the previous build, in each tier."""
+    builder.run_state['chess_com_landed_users'] = json.dumps({'alice': None})
+    builder.build({'chess_com_api': 10})
+    assert json.loads(builder.run_state['dbt_built_users']) == {'alice': None}
+    builder.dbt.commands()
+
+    # New user: backfilled by the hot tier, the slow tier is not due yet, so the users built are not recorded
+    builder.run_state['chess_com_landed_users'] = json.dumps({'alice': None, 'Carol': '2024/01'})
+    builder.build({'chess_com_api': 0})
+    assert [dbt_vars for _, dbt_vars in builder.dbt.calls] == [{'backfill_usernames': ['carol']}]
+    assert json.loads(builder.run_state['dbt_built_users']) == {'alice': None}
+    builder.dbt.commands()
+
+    # Not queued again for the hot tier; recorded once the slow tier got it too
+    builder.tier_intervals['slow'] = 0
+    builder.build({'chess_com_api': 0})
+    assert builder.dbt.calls == [(['run', *tier_run_args(DBT_TIERS['slow'], ['source:chess_com+'])], {'backfill_usernames': ['carol']})]
+    assert json.loads(builder.run_state['dbt_built_users']) == {'alice': None, 'Carol': '2024/01'}
@@ -1,9 +1,18 @@
-{{ config(warn_if = '>1', error_if = '>50', enabled = true) }}
+{{ config(warn_if = '>1', error_if = '>50', enabled = true, tags = ['incremental']) }}
 
 WITH agg_game AS (
   SELECT DISTINCT -- uuid is only unique per [username]
     uuid
   FROM {{ ref ('int_games_filtered') }}
+  {% if var('test_since') %}
+  WHERE uuid IN ( -- incremental test: only the games with moves or times loaded since the last passing test
+    SELECT uuid FROM {{ ref ('int_game_moves_base') }}
+    WHERE log_timestamp > '{{ var('test_since').get('int_game_moves_base', '-infinity') }}'::timestamptz
+    UNION
+    SELECT uuid FROM {{ ref ('int_game_move_times_base') }}
+    WHERE log_timestamp > '{{ var('test_since').get('int_game_move_times_base', '-infinity') }}'::timestamptz
+  )
+  {% endif %}
 )
 
 , agg_times AS (
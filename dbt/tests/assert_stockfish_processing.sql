@@ -1,4 +1,4 @@
-{{ config(warn_if = '>1', error_if = '>50', enabled = true) }}
+{{ config(warn_if = '>1', error_if = '>50', enabled = true, tags = ['incremental']) }}
 
 WITH agg_game AS (
   SELECT 
@@ -6,6 +6,12 @@ WITH agg_game AS (
     uuid,
     MIN(pgn) AS pgn
   FROM {{ ref ('int_games_filtered') }}
+  {% if var('test_since') %}
+  WHERE uuid IN ( -- incremental test: only the games with moves loaded since the last passing test
+    SELECT uuid FROM {{ ref ('int_game_moves_base') }}
+    WHERE log_timestamp > '{{ var('test_since').get('int_game_moves_base', '-infinity') }}'::timestamptz
+  )
+  {% endif %}
   GROUP BY username, uuid
 )
 
@@ -14,6 +20,9 @@ WITH agg_game AS (
     uuid,
     COUNT(*) AS nb_moves
   FROM {{ ref ('int_game_moves_base') }}
+  {% if var('test_since') %}
+  WHERE uuid IN (SELECT uuid FROM agg_game)
+  {% endif %}
   GROUP BY uuid
 )
 